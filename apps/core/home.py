@@ -0,0 +1,164 @@
+"""
+首頁 read model：各區塊預先算好，集中存成單一快取文件。
+
+文件格式為 ``{區塊名稱: {"value": 內容, "built_at": 建立時間}}``，內容一律是精簡卡片或字串，
+不含 ORM 物件。各區塊有自己的新鮮時間（``SECTION_TTLS``）：
+
+- Celery beat 每 ``HOME_REFRESH_INTERVAL`` 秒執行 ``refresh_home_document``，
+  重算在下一次執行前就會過期的區塊，平時請求只需一次快取讀取
+- 請求讀到的文件缺少某些區塊（快取剛清空、beat 未執行）或區塊已過期時，只重算這些區塊並寫回，
+  其餘區塊照常使用
+- 重算一律先取得 ``CacheLock``（beat 與請求共用同一把鎖），同時只有一個行程在算，讀改寫不會互相覆蓋；
+  沒搶到鎖的請求直接使用過期的舊區塊，完全沒有舊值的區塊才短暫等待，逾時後自行計算但不寫回
+
+個人化推薦依使用者而異，不放在共用文件中（見 ``recommendations.personal_picks``）。
+"""
+
+import random
+import time
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from apps.motry.caching import WAIT_INTERVAL, WAIT_TIMEOUT, CacheLock
+from apps.motry.cards import garage_card, sample_vehicle_ids, vehicle_card, vehicle_cards
+from apps.motry.models import Tag, UserVehicle
+from apps.motry.trending import trending_tags, trending_vehicles
+
+HOME_DOCUMENT_CACHE_KEY = "home:document"
+HOME_DOCUMENT_CACHE_TIMEOUT = 60 * 60  # 文件本身的保留時間；區塊是否過期另依 SECTION_TTLS 判斷
+HOME_REFRESH_INTERVAL = 60  # beat 執行間隔（秒），需與 CELERY_BEAT_SCHEDULE 一致
+HOME_BUILD_LOCK = "home:document"
+HOME_BUILD_LOCK_TIMEOUT = 30  # 秒：重算所有區塊的最長時間，逾時後鎖自動釋放
+
+POPULAR_TAGS_LIMIT = 6
+LATEST_GARAGE_LIMIT = 6
+RECOMMENDED_LIMIT = 4
+RANDOM_POOLS = 6  # 輪替的隨機推薦組數，同一時段的訪客不會都看到同樣 4 台
+
+SECTION_TTLS = {
+    "popular_tags": 60 * 10,
+    "latest_garage": 60 * 2,
+    "trending_vehicles": 60 * 5,
+    "random_pools": 60 * 5,
+}
+
+
+def _popular_tags() -> list[str]:
+    # 本週熱門（時間衰減分數）；剛上線、近期沒有互動時退回全期標籤數
+    tags = trending_tags(POPULAR_TAGS_LIMIT) or (
+        Tag.objects.annotate(post_count=Count("tag_posts")).order_by("-post_count", "name")[:POPULAR_TAGS_LIMIT]
+    )
+    return [tag.name for tag in tags]
+
+
+def _latest_garage():
+    entries = (
+        UserVehicle.objects.select_related("vehicle", "user")
+        .prefetch_related("vehicle__images")
+        .order_by("-created_at")[:LATEST_GARAGE_LIMIT]
+    )
+    return [garage_card(entry) for entry in entries]
+
+
+def _trending_vehicles():
+    return [vehicle_card(vehicle) for vehicle in trending_vehicles(RECOMMENDED_LIMIT)]
+
+
+def _random_pools():
+    # 各組獨立以 id 範圍探測抽樣；目錄為空時回傳空清單
+    pools = [vehicle_cards(sample_vehicle_ids(RECOMMENDED_LIMIT)) for _ in range(RANDOM_POOLS)]
+    return [pool for pool in pools if pool]
+
+
+SECTION_BUILDERS = {
+    "popular_tags": _popular_tags,
+    "latest_garage": _latest_garage,
+    "trending_vehicles": _trending_vehicles,
+    "random_pools": _random_pools,
+}
+
+
+def _is_fresh(entry, section: str, now: float, margin: float = 0) -> bool:
+    return entry is not None and now + margin - entry["built_at"] < SECTION_TTLS[section]
+
+
+def _stale_sections(document: dict, now: float, margin: float = 0) -> list[str]:
+    return [section for section in SECTION_BUILDERS if not _is_fresh(document.get(section), section, now, margin)]
+
+
+def _build_sections(document: dict, sections, now: float) -> dict:
+    document = dict(document)
+    for section in sections:
+        document[section] = {"value": SECTION_BUILDERS[section](), "built_at": now}
+    return document
+
+
+def _values(document: dict) -> dict:
+    return {section: entry["value"] for section, entry in document.items() if section in SECTION_BUILDERS}
+
+
+def _wait_for_sections(sections) -> dict:
+    """等待持有鎖的行程寫回缺少的區塊；逾時則自行計算（不寫回，避免與持鎖者互相覆蓋）。"""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY) or {}
+        if all(section in document for section in sections):
+            return document
+    missing = [section for section in sections if section not in document]
+    return _build_sections(document, missing, time.time())
+
+
+def get_home_document() -> dict:
+    """讀取首頁文件（一次快取讀取），缺少或已過期的區塊由單一行程重算；回傳 ``{區塊名稱: 內容}``。"""
+    now = time.time()
+    document = cache.get(HOME_DOCUMENT_CACHE_KEY) or {}
+    stale = _stale_sections(document, now)
+    if not stale:
+        return _values(document)
+
+    lock = CacheLock(HOME_BUILD_LOCK, HOME_BUILD_LOCK_TIMEOUT)
+    if not lock.acquire():
+        # 其他行程正在重算：過期的區塊先用舊值，只有完全缺少的區塊才等待
+        missing = [section for section in stale if section not in document]
+        if missing:
+            document = _wait_for_sections(missing)
+        return _values(document)
+    try:
+        # 取得鎖後重讀，其他行程可能剛寫回
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY) or {}
+        stale = _stale_sections(document, now)
+        if stale:
+            document = _build_sections(document, stale, now)
+            cache.set(HOME_DOCUMENT_CACHE_KEY, document, HOME_DOCUMENT_CACHE_TIMEOUT)
+    finally:
+        lock.release()
+    return _values(document)
+
+
+def refresh_home_document(force: bool = False) -> list[str]:
+    """
+    重算在下一次 beat 前就會過期的區塊（force 時全部重算），回傳重算的區塊。
+
+    請求正在重算（鎖被持有）時本次略過，回傳空清單，由下一次 beat 補上。
+    """
+    lock = CacheLock(HOME_BUILD_LOCK, HOME_BUILD_LOCK_TIMEOUT)
+    if not lock.acquire():
+        return []
+    try:
+        now = time.time()
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY) or {}
+        due = list(SECTION_BUILDERS) if force else _stale_sections(document, now, margin=HOME_REFRESH_INTERVAL)
+        if due:
+            document = _build_sections(document, due, now)
+            cache.set(HOME_DOCUMENT_CACHE_KEY, document, HOME_DOCUMENT_CACHE_TIMEOUT)
+        return due
+    finally:
+        lock.release()
+
+
+def random_pick(document: dict) -> list:
+    """從文件的隨機推薦組中挑一組。"""
+    pools = document.get("random_pools") or []
+    return random.choice(pools) if pools else []
@@ -0,0 +1,38 @@
+"""
+專案共用的 middleware。
+
+``AsyncWhiteNoiseMiddleware``：WhiteNoise 的 middleware 只支援同步，放在 ASGI 的 middleware 鏈中時，
+Django 會把整條鏈包成同步（"Asynchronous handler adapted for middleware ..."），
+每個 async view 的請求都要在執行緒與 event loop 之間來回切換。
+這裡加上 async 路徑：非靜態檔的請求只做一次 dict 查詢就交給下一層，不離開 event loop；
+只有命中靜態檔（正式環境通常由 CDN / 反向代理處理）時才到執行緒開檔回應。
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # 開發模式（autorefresh）每次都查檔案系統
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,22 @@
+"""
+首頁相關 Celery 任務
+
+- refresh_home_document: 重算即將過期的首頁區塊（定時任務，見 ``apps.core.home``）
+"""
+
+import logging
+
+from celery import shared_task
+
+from .home import refresh_home_document as refresh
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_home_document(force: bool = False) -> dict:
+    """定時任務：重算在下一次執行前就會過期的首頁區塊。"""
+    sections = refresh(force=force)
+    if sections:
+        logger.info(f"首頁區塊已更新: {sections}")
+    return {"sections": sections}
@@ -1,64 +1,33 @@
-import random
-
-from django.core.cache import cache
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
-from django.db.models import Count
 
+from apps.core.home import RECOMMENDED_LIMIT, get_home_document, random_pick
 from apps.motry.forms import BRAND_CHOICES
-from apps.motry.models import Tag, Vehicle, UserVehicle
-
-# 快取鍵與時間常數
-RECOMMENDED_VEHICLES_CACHE_KEY = "home:recommended_vehicles"
-RECOMMENDED_VEHICLES_CACHE_TIMEOUT = 300  # 5 分鐘
-
-
-def _get_random_vehicles(count: int = 4) -> list[Vehicle]:
-    """
-    使用更高效的方式獲取隨機車輛。
-    先從快取取，避免每次都執行 ORDER BY RANDOM() 全表掃描。
-    """
-    cached = cache.get(RECOMMENDED_VEHICLES_CACHE_KEY)
-    if cached is not None:
-        return cached
-
-    # 取得所有車輛 ID，然後隨機選取
-    vehicle_ids = list(Vehicle.objects.values_list("id", flat=True))
-    if not vehicle_ids:
-        return []
-
-    # 隨機選取 ID
-    selected_ids = random.sample(vehicle_ids, min(count, len(vehicle_ids)))
-
-    # 用選出的 ID 查詢完整資料
-    vehicles = list(
-        Vehicle.objects.filter(id__in=selected_ids).prefetch_related("images")
-    )
-
-    cache.set(RECOMMENDED_VEHICLES_CACHE_KEY, vehicles, RECOMMENDED_VEHICLES_CACHE_TIMEOUT)
-    return vehicles
+from apps.motry.recommendations import personal_picks
 
 
 def home(request: HttpRequest) -> HttpResponse:
-    popular_tags = (
-        Tag.objects.annotate(post_count=Count("tag_posts"))
-        .order_by("-post_count", "name")[:6]
-    )
+    # 熱門標籤、車友車庫、本週熱門與隨機推薦來自預先算好的首頁文件（見 ``apps.core.home``）
+    document = get_home_document()
 
     popular_brands = [brand_key for brand_key, _ in BRAND_CHOICES[:6]]
 
-    recommended_vehicles = _get_random_vehicles(4)
-
-    latest_user_vehicles = (
-        UserVehicle.objects.select_related("vehicle", "user")
-        .prefetch_related("vehicle__images")
-        .order_by("-created_at")[:6]
-    )
+    # 登入且已有協同過濾推薦時優先顯示個人化推薦，其次本週熱門，最後隨機推薦
+    recommended_vehicles = personal_picks(request.user, RECOMMENDED_LIMIT)
+    recommended_personal = bool(recommended_vehicles)
+    recommended_trending = False
+    if not recommended_personal:
+        recommended_vehicles = document["trending_vehicles"]
+        recommended_trending = bool(recommended_vehicles)
+    if not recommended_vehicles:
+        recommended_vehicles = random_pick(document)
 
     context = {
-        "popular_tags": popular_tags,
+        "popular_tags": document["popular_tags"],
         "popular_brands": popular_brands,
         "recommended_vehicles": recommended_vehicles,
-        "latest_user_vehicles": latest_user_vehicles,
+        "recommended_personal": recommended_personal,
+        "recommended_trending": recommended_trending,
+        "latest_user_vehicles": document["latest_garage"],
     }
     return render(request, "core/home.html", context)
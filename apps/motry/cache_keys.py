@@ -1 +1,8 @@
 BRAND_MAP_CACHE_KEY = "motry:brand-map"
+TAG_LIST_CACHE_KEY = "motry:tag-list"
+CATALOG_VERSION_CACHE_KEY = "motry:catalog-version"
+EXPORT_RESULT_CACHE_KEY = "motry:export:result:{digest}"
+EXPORT_INFLIGHT_CACHE_KEY = "motry:export:inflight:{digest}"
+TASK_SUBSCRIBERS_CACHE_KEY = "motry:task:subscribers:{task_id}"
+NEIGHBOR_REFRESH_PENDING_KEY = "motry:neighbors:pending"
+NEIGHBOR_REFRESH_SCHEDULED_KEY = "motry:neighbors:scheduled"
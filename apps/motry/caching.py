@@ -0,0 +1,482 @@
+"""
+防止快取雪崩（cache stampede）的讀取輔助函式。
+
+原本各處都是「get → miss → 重建 → set」，快取過期的瞬間所有併發請求會同時重建。
+``get_or_rebuild`` 改為：
+
+- single-flight：以分散式鎖（Redis ``SET NX PX``；locmem 時用 ``cache.add``）
+  保證同一個 key 同時只有一個請求在重建
+- soft / hard TTL：值在 soft TTL 後視為過期但仍保留到 hard TTL
+- stale-while-revalidate：過期但仍在 hard TTL 內時，搶到鎖的請求負責重建，
+  其他請求直接回傳舊值；background=True 時連搶到鎖的請求也不等待，改由背景執行緒重建
+- 完全沒有值時，沒搶到鎖的請求短暫等待重建結果，逾時才自行重建
+
+``TwoTierCache`` 在前面再加一層行程內 LRU，給每個請求都會讀的小型值使用。
+``aget_or_rebuild`` 為 async view 使用的非同步版本。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_ENVELOPE_MARKER = "__swr__"
+
+LOCK_TIMEOUT = 10  # 秒：重建最長時間，逾時後鎖自動釋放
+WAIT_TIMEOUT = 2.0  # 秒：沒有舊值可用時等待其他請求重建的時間
+WAIT_INTERVAL = 0.05
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+	return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _redis_client():
+	"""django_redis 後端時回傳原生 Redis client，其他後端（locmem）回傳 None。"""
+	client = getattr(cache, "client", None)
+	if client is not None and hasattr(client, "get_client"):
+		return client.get_client(write=True)
+	return None
+
+
+class CacheLock:
+	"""
+	以快取實作的分散式鎖。
+
+	Redis：``SET key token NX PX``，釋放時用 Lua 比對 token 後才刪除，避免誤刪別人的鎖。
+	locmem：``cache.add`` 在單一行程內為原子操作，等同本地鎖。
+	"""
+
+	def __init__(self, name: str, timeout: float = LOCK_TIMEOUT):
+		self.key = f"lock:{name}"
+		self.timeout = timeout
+		self.token = uuid.uuid4().hex
+		self._client = _redis_client()
+
+	def acquire(self) -> bool:
+		if self._client is not None:
+			return bool(
+				self._client.set(cache.make_key(self.key), self.token, nx=True, px=int(self.timeout * 1000))
+			)
+		return cache.add(self.key, self.token, self.timeout)
+
+	def release(self) -> None:
+		if self._client is not None:
+			self._client.eval(_RELEASE_SCRIPT, 1, cache.make_key(self.key), self.token)
+			return
+		if cache.get(self.key) == self.token:
+			cache.delete(self.key)
+
+
+def set_fresh(key: str, value: Any, soft_ttl: float, hard_ttl: float | None = None) -> None:
+	"""寫入快取值：soft_ttl 內為新鮮值，hard_ttl 前仍可作為舊值回傳。"""
+	hard_ttl = hard_ttl or soft_ttl * 2
+	cache.set(
+		key,
+		{_ENVELOPE_MARKER: 1, "value": value, "fresh_until": time.time() + soft_ttl},
+		hard_ttl,
+	)
+
+
+def _read(key: str) -> dict | None:
+	entry = cache.get(key)
+	if isinstance(entry, dict) and entry.get(_ENVELOPE_MARKER):
+		return entry
+	return None
+
+
+def _rebuild(key: str, builder: Callable[[], Any], soft_ttl: float, hard_ttl: float | None) -> Any:
+	value = builder()
+	set_fresh(key, value, soft_ttl, hard_ttl)
+	return value
+
+
+def _rebuild_in_background(key, builder, soft_ttl, hard_ttl, lock: CacheLock) -> None:
+	def run():
+		try:
+			_rebuild(key, builder, soft_ttl, hard_ttl)
+		except Exception:
+			logger.exception(f"背景重建快取失敗: {key}")
+		finally:
+			lock.release()
+			# 背景執行緒自己的資料庫連線需手動關閉
+			connections.close_all()
+
+	threading.Thread(target=run, name=f"cache-refresh:{key}", daemon=True).start()
+
+
+def get_or_rebuild(
+	key: str,
+	builder: Callable[[], Any],
+	soft_ttl: float,
+	hard_ttl: float | None = None,
+	background: bool = False,
+	lock_timeout: float = LOCK_TIMEOUT,
+	wait_timeout: float = WAIT_TIMEOUT,
+) -> Any:
+	"""
+	讀取快取，必要時以 single-flight 方式重建。
+
+	Args:
+		key: 快取鍵
+		builder: 重建函式（無參數），回傳要快取的值
+		soft_ttl: 新鮮時間（秒）
+		hard_ttl: 快取保留時間（秒），預設為 soft_ttl 的兩倍
+		background: 過期時由背景執行緒重建，請求本身直接回傳舊值
+		lock_timeout: 重建鎖的逾時秒數
+		wait_timeout: 沒有舊值時等待他人重建的秒數
+	"""
+	entry = _read(key)
+	if entry is not None:
+		if time.time() < entry["fresh_until"]:
+			return entry["value"]
+
+		# stale-while-revalidate：只有搶到鎖的請求重建，其餘回傳舊值
+		lock = CacheLock(key, lock_timeout)
+		if not lock.acquire():
+			return entry["value"]
+		if background:
+			_rebuild_in_background(key, builder, soft_ttl, hard_ttl, lock)
+			return entry["value"]
+		try:
+			return _rebuild(key, builder, soft_ttl, hard_ttl)
+		finally:
+			lock.release()
+
+	lock = CacheLock(key, lock_timeout)
+	if lock.acquire():
+		try:
+			# 取得鎖後再確認一次，可能剛好被其他請求寫入
+			entry = _read(key)
+			if entry is not None:
+				return entry["value"]
+			return _rebuild(key, builder, soft_ttl, hard_ttl)
+		finally:
+			lock.release()
+
+	deadline = time.monotonic() + wait_timeout
+	while time.monotonic() < deadline:
+		time.sleep(WAIT_INTERVAL)
+		entry = _read(key)
+		if entry is not None:
+			return entry["value"]
+
+	logger.warning(f"等待快取重建逾時，改為自行重建: {key}")
+	return _rebuild(key, builder, soft_ttl, hard_ttl)
+
+
+# ==========================================
+# 兩層快取：行程內 LRU（L1）+ Redis（L2）
+# ==========================================
+
+class LocalLRU:
+	"""有容量上限的行程內 LRU（thread-safe）。"""
+
+	def __init__(self, maxsize: int = 256):
+		self.maxsize = maxsize
+		self._data: OrderedDict[str, Any] = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: str) -> Any:
+		with self._lock:
+			value = self._data.get(key)
+			if value is not None:
+				self._data.move_to_end(key)
+			return value
+
+	def set(self, key: str, value: Any) -> None:
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def delete(self, key: str) -> None:
+		with self._lock:
+			self._data.pop(key, None)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+class TwoTierCache:
+	"""
+	給「很小、很常讀、很少變」的值使用的兩層快取。
+
+	- L1：行程內 LRU，l1_ttl 秒內直接命中，不需任何網路往返
+	- l1_ttl 過後只讀一次 Redis 上的世代計數（很小的 int）確認是否被失效，
+	  世代未變就繼續沿用 L1 值；超過 max_age 才回到 L2 重新讀取完整值
+	- L2：Redis，讀取時經過 ``get_or_rebuild``（single-flight + stale-while-revalidate）
+	- 失效：``invalidate`` 刪除 L2 key 並遞增世代計數，其他 worker 最慢 l1_ttl 秒後察覺
+	"""
+
+	def __init__(self, namespace: str, maxsize: int = 256, l1_ttl: float = 5.0, max_age: float = 60.0):
+		self.namespace = namespace
+		self.generation_key = f"motry:gen:{namespace}"
+		self.l1_ttl = l1_ttl
+		self.max_age = max_age
+		self._l1 = LocalLRU(maxsize)
+		self._stats = {"l1_hits": 0, "l1_revalidated": 0, "l2_hits": 0, "misses": 0}
+		self._stats_lock = threading.Lock()
+		_TWO_TIER_CACHES[namespace] = self
+
+	def _record(self, name: str) -> None:
+		with self._stats_lock:
+			self._stats[name] += 1
+
+	def generation(self) -> int:
+		return cache.get(self.generation_key, 0)
+
+	def get_or_rebuild(
+		self,
+		key: str,
+		builder: Callable[[], Any],
+		soft_ttl: float,
+		hard_ttl: float | None = None,
+		background: bool = False,
+	) -> Any:
+		now = time.monotonic()
+		entry = self._l1.get(key)
+		if entry is not None and now - entry["loaded_at"] < self.max_age:
+			if now - entry["checked_at"] < self.l1_ttl:
+				self._record("l1_hits")
+				return entry["value"]
+			if entry["generation"] == self.generation():
+				entry["checked_at"] = now
+				self._record("l1_revalidated")
+				return entry["value"]
+
+		generation = self.generation()
+		rebuilt = False
+
+		def tracked_builder():
+			nonlocal rebuilt
+			rebuilt = True
+			return builder()
+
+		value = get_or_rebuild(key, tracked_builder, soft_ttl, hard_ttl, background=background)
+		self._record("misses" if rebuilt else "l2_hits")
+		self._l1.set(
+			key,
+			{"value": value, "generation": generation, "loaded_at": now, "checked_at": now},
+		)
+		return value
+
+	def invalidate(self, *keys: str) -> None:
+		"""刪除 L2 key 並遞增世代計數；本行程的 L1 立即清除。"""
+		if keys:
+			cache.delete_many(list(keys))
+		if not cache.add(self.generation_key, 1, None):
+			try:
+				cache.incr(self.generation_key)
+			except ValueError:
+				cache.set(self.generation_key, 1, None)
+		for key in keys:
+			self._l1.delete(key)
+		if not keys:
+			self._l1.clear()
+
+	def stats(self) -> dict:
+		"""本行程各層命中次數與命中率（l1 含世代檢查後沿用的次數）。"""
+		with self._stats_lock:
+			stats = dict(self._stats)
+		total = sum(stats.values())
+		l1 = stats["l1_hits"] + stats["l1_revalidated"]
+		stats.update(
+			{
+				"requests": total,
+				"l1_size": len(self._l1),
+				"l1_hit_rate": round(l1 / total, 4) if total else None,
+				"l2_hit_rate": round(stats["l2_hits"] / (total - l1), 4) if total - l1 else None,
+			}
+		)
+		return stats
+
+
+_TWO_TIER_CACHES: dict[str, TwoTierCache] = {}
+
+
+def two_tier_stats() -> dict[str, dict]:
+	return {namespace: tier.stats() for namespace, tier in _TWO_TIER_CACHES.items()}
+
+
+# 車款目錄相關（品牌清單、目錄版本），Vehicle 變動時失效
+catalog_cache = TwoTierCache("catalog")
+# 標籤清單，Tag 變動時失效
+tag_cache = TwoTierCache("tags")
+
+
+# ==========================================
+# 非同步版本（ASGI async view 使用）
+# ==========================================
+# django_redis 只有同步 client，``cache.aget`` 等方法實際上是 sync_to_async 包裝，
+# 每次呼叫都要切換到執行緒。django_redis 後端時改用 redis.asyncio 直接存取，
+# key 與序列化沿用 django_redis（``make_key`` / ``client.encode`` / ``client.decode``），兩邊可互相讀寫。
+# 連線設定取自 django_redis 的 connection pool（CACHES OPTIONS 的密碼、timeout、pool 大小、TLS 等），
+# 每個 event loop 共用一個 client，伺服器關閉時以 ``aclose_async_redis`` 釋放（見 config/asgi.py）。
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_SYNC_ONLY_KWARGS = {"parser_class", "retry"}
+
+
+def _async_connection_pool():
+	"""依 django_redis（寫入端）connection pool 的設定建立對應的 redis.asyncio pool；無法對應時回傳 None。"""
+	from redis.asyncio import connection as async_connection
+
+	sync_pool = cache.client.get_client(write=True).connection_pool
+	connection_class = getattr(async_connection, sync_pool.connection_class.__name__, None)
+	if connection_class is None:
+		return None
+	# 只傳 async 連線類別接受的參數；parser、retry 等 sync 專用物件略過，改用 redis.asyncio 預設值
+	accepted = set()
+	for klass in connection_class.__mro__:
+		if "__init__" in vars(klass):
+			accepted.update(inspect.signature(klass.__init__).parameters)
+	kwargs = {key: value for key, value in sync_pool.connection_kwargs.items() if key in accepted and key not in _SYNC_ONLY_KWARGS}
+	return async_connection.ConnectionPool(
+		connection_class=connection_class, max_connections=sync_pool.max_connections, **kwargs
+	)
+
+
+def _async_redis():
+	"""回傳目前 event loop 專用的 redis.asyncio client；非 django_redis 後端回傳 None。"""
+	client = getattr(cache, "client", None)
+	if client is None or not hasattr(client, "decode") or not hasattr(client, "get_client"):
+		return None
+	loop = asyncio.get_running_loop()
+	if loop in _async_clients:
+		return _async_clients[loop]
+	from redis.asyncio import Redis
+
+	pool = _async_connection_pool()
+	redis_client = Redis.from_pool(pool) if pool is not None else None
+	_async_clients[loop] = redis_client
+	return redis_client
+
+
+async def aclose_async_redis() -> None:
+	"""關閉目前 event loop 的 redis.asyncio client 與其 connection pool。"""
+	redis_client = _async_clients.pop(asyncio.get_running_loop(), None)
+	if redis_client is not None:
+		await redis_client.aclose()
+
+
+async def acache_get(key: str, default: Any = None) -> Any:
+	redis_client = _async_redis()
+	if redis_client is None:
+		return await cache.aget(key, default)
+	raw = await redis_client.get(cache.make_key(key))
+	return default if raw is None else cache.client.decode(raw)
+
+
+async def acache_set(key: str, value: Any, timeout: float | None) -> None:
+	redis_client = _async_redis()
+	if redis_client is None:
+		await cache.aset(key, value, timeout)
+		return
+	px = int(timeout * 1000) if timeout else None
+	await redis_client.set(cache.make_key(key), cache.client.encode(value), px=px)
+
+
+async def acache_delete(key: str) -> None:
+	redis_client = _async_redis()
+	if redis_client is None:
+		await cache.adelete(key)
+		return
+	await redis_client.delete(cache.make_key(key))
+
+
+async def _aacquire_lock(name: str, token: str, timeout: float) -> bool:
+	key = f"lock:{name}"
+	redis_client = _async_redis()
+	if redis_client is None:
+		return await cache.aadd(key, token, timeout)
+	return bool(await redis_client.set(cache.make_key(key), token, nx=True, px=int(timeout * 1000)))
+
+
+async def _arelease_lock(name: str, token: str) -> None:
+	key = f"lock:{name}"
+	redis_client = _async_redis()
+	if redis_client is None:
+		if await cache.aget(key) == token:
+			await cache.adelete(key)
+		return
+	await redis_client.eval(_RELEASE_SCRIPT, 1, cache.make_key(key), token)
+
+
+async def _aread(key: str) -> dict | None:
+	entry = await acache_get(key)
+	if isinstance(entry, dict) and entry.get(_ENVELOPE_MARKER):
+		return entry
+	return None
+
+
+async def _arebuild(key: str, builder: Callable[[], Any], soft_ttl: float, hard_ttl: float | None) -> Any:
+	# 重建通常需要查 DB（同步 ORM），只有未命中時才切換到執行緒
+	value = await sync_to_async(builder)()
+	hard_ttl = hard_ttl or soft_ttl * 2
+	await acache_set(
+		key,
+		{_ENVELOPE_MARKER: 1, "value": value, "fresh_until": time.time() + soft_ttl},
+		hard_ttl,
+	)
+	return value
+
+
+async def aget_or_rebuild(
+	key: str,
+	builder: Callable[[], Any],
+	soft_ttl: float,
+	hard_ttl: float | None = None,
+	lock_timeout: float = LOCK_TIMEOUT,
+	wait_timeout: float = WAIT_TIMEOUT,
+) -> Any:
+	"""``get_or_rebuild`` 的非同步版本：命中時不經過任何執行緒切換。builder 仍為同步函式。"""
+	entry = await _aread(key)
+	if entry is not None and time.time() < entry["fresh_until"]:
+		return entry["value"]
+
+	token = uuid.uuid4().hex
+	if await _aacquire_lock(key, token, lock_timeout):
+		try:
+			if entry is None:
+				# 取得鎖後再確認一次，可能剛好被其他請求寫入
+				fresh = await _aread(key)
+				if fresh is not None:
+					return fresh["value"]
+			return await _arebuild(key, builder, soft_ttl, hard_ttl)
+		finally:
+			await _arelease_lock(key, token)
+
+	if entry is not None:
+		return entry["value"]
+
+	deadline = time.monotonic() + wait_timeout
+	while time.monotonic() < deadline:
+		await asyncio.sleep(WAIT_INTERVAL)
+		entry = await _aread(key)
+		if entry is not None:
+			return entry["value"]
+
+	logger.warning(f"等待快取重建逾時，改為自行重建: {key}")
+	return await _arebuild(key, builder, soft_ttl, hard_ttl)
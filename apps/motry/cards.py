@@ -0,0 +1,124 @@
+"""
+首頁推薦用的精簡車款卡片與隨機抽樣。
+
+- ``VehicleCard``：推薦區塊只需要的欄位（名稱、年份、主要規格、展示圖 URL），
+  快取內容不再是帶有 prefetch 圖片的 ORM 物件，pickle 後只有數百 bytes
+- ``GarageCard``：首頁「車友車庫」的一筆分享（車庫照片優先，其次車款展示圖）
+- ``sample_vehicle_ids``：以 id 範圍隨機探測抽樣，不把整張表的 id 載入 Python，也不用 ORDER BY RANDOM()；
+  id 有空洞時依命中率放大下一輪探測數，仍不足時以隨機起點之後的 id 補足
+"""
+
+from __future__ import annotations
+
+import math
+import random
+from dataclasses import dataclass
+
+from django.db.models import Max, Min
+
+from .models import UserVehicle, Vehicle
+from .templatetags.motry_extras import vehicle_showcase_image
+from .utils import is_placeholder_image
+
+SAMPLE_ROUNDS = 4
+SAMPLE_MAX_PROBES = 500
+SAMPLE_MIN_HIT_RATE = 0.02
+
+
+@dataclass(frozen=True, slots=True)
+class VehicleCard:
+	id: int
+	brand: str
+	model: str
+	years_from: int | None
+	years_to: int | None
+	displacement_cc: int | None
+	horsepower_ps: int | None
+	image: str
+
+	@property
+	def name(self) -> str:
+		return f"{self.brand} {self.model}"
+
+
+def vehicle_card(vehicle: Vehicle) -> VehicleCard:
+	"""ORM 物件轉為卡片；展示圖沿用 ``vehicle_showcase_image``（需先 prefetch images 以免逐台查詢）。"""
+	return VehicleCard(
+		id=vehicle.id,
+		brand=vehicle.brand,
+		model=vehicle.model,
+		years_from=vehicle.years_from,
+		years_to=vehicle.years_to,
+		displacement_cc=vehicle.displacement_cc,
+		horsepower_ps=vehicle.horsepower_ps,
+		image=vehicle_showcase_image(vehicle),
+	)
+
+
+@dataclass(frozen=True, slots=True)
+class GarageCard:
+	id: int
+	vehicle_id: int
+	brand: str
+	model: str
+	alias: str
+	username: str
+	image: str
+
+	@property
+	def name(self) -> str:
+		return f"{self.brand} {self.model}"
+
+
+def garage_card(entry: UserVehicle) -> GarageCard:
+	"""車庫項目轉為卡片（需先 select_related vehicle / user 並 prefetch vehicle__images）。"""
+	image = entry.image.url if entry.image else ""
+	if not image and entry.image_url and not is_placeholder_image(entry.image_url):
+		image = entry.image_url
+	return GarageCard(
+		id=entry.id,
+		vehicle_id=entry.vehicle_id,
+		brand=entry.vehicle.brand,
+		model=entry.vehicle.model,
+		alias=entry.alias,
+		username=entry.user.username,
+		image=image or vehicle_showcase_image(entry.vehicle),
+	)
+
+
+def vehicle_cards(vehicle_ids) -> list[VehicleCard]:
+	"""依 vehicle_ids 的順序取得卡片（一次查詢車款 + 一次查詢圖片），已刪除的車略過。"""
+	vehicles = Vehicle.objects.prefetch_related("images").in_bulk(list(vehicle_ids))
+	return [vehicle_card(vehicles[vehicle_id]) for vehicle_id in vehicle_ids if vehicle_id in vehicles]
+
+
+def sample_vehicle_ids(count: int) -> list[int]:
+	"""隨機抽出最多 count 個車款 id（見模組說明）。"""
+	bounds = Vehicle.objects.aggregate(low=Min("id"), high=Max("id"))
+	low, high = bounds["low"], bounds["high"]
+	if low is None or count <= 0:
+		return []
+
+	found: set[int] = set()
+	probes = count * 2
+	for _ in range(SAMPLE_ROUNDS):
+		needed = count - len(found)
+		if needed <= 0:
+			break
+		candidates = {random.randint(low, high) for _ in range(probes)} - found
+		if not candidates:
+			continue
+		hits = set(Vehicle.objects.filter(id__in=candidates).values_list("id", flat=True))
+		found |= hits
+		# 命中率反映 id 空洞比例，下一輪據此放大探測數
+		hit_rate = max(len(hits) / len(candidates), SAMPLE_MIN_HIT_RATE)
+		probes = min(math.ceil((count - len(found)) / hit_rate * 1.5), SAMPLE_MAX_PROBES)
+
+	if len(found) < count:
+		# 目錄很小或 id 極度稀疏：從隨機起點往後（不足再從頭）取連續的 id 補足
+		start = random.randint(low, high)
+		queryset = Vehicle.objects.exclude(id__in=found).order_by("id").values_list("id", flat=True)
+		found.update(queryset.filter(id__gte=start)[: count - len(found)])
+		found.update(queryset.filter(id__lt=start)[: count - len(found)])
+
+	return random.sample(sorted(found), min(count, len(found)))
@@ -1,15 +1,87 @@
+import asyncio
 import json
 import logging
+import weakref
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from urllib.parse import parse_qs
 
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from .event_stream import aread_events_after
+from .frames import encode_frame, is_binary, select_subprotocol
+from .membership import subscribed_vehicle_ids
+from .notifications import MAX_SUBSCRIBED_VEHICLES, user_group, vehicle_group
+from .task_events import task_events_group
+
 logger = logging.getLogger(__name__)
 
+# 同一篇貼文的留言 / 按讚可合併為一筆（附 count）；新貼文重複時只保留一筆
+MERGEABLE_KINDS = {"new_comment", "new_like"}
+
+
+@dataclass
+class ConnectionMetrics:
+	"""單一通知連線的佇列統計（見 ``notification_connection_metrics``）。"""
+
+	user_id: int
+	queue_depth: int = 0
+	max_queue_depth: int = 0
+	events: int = 0
+	coalesced: int = 0
+	dropped: int = 0
+	frames: int = 0
+
+
+_active_connections: "weakref.WeakSet[NotificationConsumer]" = weakref.WeakSet()
+
+
+def notification_connection_metrics(top: int = 20) -> dict:
+	"""本行程所有通知連線的佇列深度統計；per_connection 只列佇列最深的 top 條。"""
+	metrics = [consumer.metrics for consumer in list(_active_connections)]
+	deepest = sorted(metrics, key=lambda item: (item.max_queue_depth, item.queue_depth), reverse=True)[:top]
+	return {
+		"connections": len(metrics),
+		"queue_depth_total": sum(item.queue_depth for item in metrics),
+		"max_queue_depth": max((item.max_queue_depth for item in metrics), default=0),
+		"events": sum(item.events for item in metrics),
+		"frames": sum(item.frames for item in metrics),
+		"coalesced": sum(item.coalesced for item in metrics),
+		"dropped": sum(item.dropped for item in metrics),
+		"per_connection": [asdict(item) for item in deepest],
+	}
+
 
 class NotificationConsumer(AsyncWebsocketConsumer):
-	"""Week 12 WebSocket 範例：推送新貼文通知。"""
+	"""
+	Week 12 WebSocket：推送新貼文與互動通知。
+
+	連線只加入與使用者相關的 group（見 ``notifications``）：自己的使用者 group、
+	最愛 / 車庫車輛的 group，以及目前瀏覽頁面的車輛 group。
+
+	重連時以 ``?last_event_id=<id>`` 連線，加入 group 後先補送期間漏掉的事件（見 ``event_stream``），
+	再處理即時事件；補送不完整時送出 ``{"type": "replay_truncated"}``，前端應重新載入資料。
+
+	事件不逐筆送出，先進入每條連線的待送佇列：
+	- 批次視窗：第一筆事件進來後等 batch_window 秒或累積 batch_max_events 筆，合併成一個
+	  ``{"type": "batch", "events": [...]}`` frame（只有一筆時照舊送出單一物件）
+	- 合併：同一篇貼文的重複事件只保留最新一筆（留言 / 按讚附上 count）
+	- 佇列上限：上一個 frame 交給伺服器前不送下一個，期間事件留在佇列中合併；
+	  佇列超過 max_pending 筆時丟棄最舊的事件，下一個 frame 附上 ``dropped`` 筆數
 
-	group_name = "motry_notifications"
+	這裡限制的是 consumer 內的待送佇列與送出頻率（每 batch_window 秒最多一個 frame），不是用戶端的接收速度：
+	daphne 的 ``send`` 在 frame 交給 Twisted transport 後就返回，consumer 看不到 transport 的緩衝大小。
+	讀取很慢的用戶端，其 transport 緩衝由 daphne 的 keepalive 限制：閒置 ``--ping-interval``（預設 20 秒）後送出 ping，
+	``--ping-timeout``（預設 30 秒）內沒收到 pong（pong 排在已緩衝的資料之後）就關閉連線，
+	因此緩衝最多累積約一分鐘的 frame。
+
+	握手時可協商 subprotocol 改用 msgpack 二進位 frame（見 ``frames``），未協商時維持 JSON 文字 frame。
+	"""
+
+	batch_window = 0.25
+	batch_max_events = 20
+	max_pending = 200
 
 	async def connect(self):
 		# 檢查用戶是否已認證
@@ -19,31 +91,192 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 			await self.close(code=4001)
 			return
 
-		await self.channel_layer.group_add(self.group_name, self.channel_name)
-		await self.accept()
+		self.user_id = user.id
+		self.joined_groups = set()
+		self.subscribed_vehicles = set()
+		self.watched_vehicle = None
+		self.replayed_ids = set()
+		self.metrics = ConnectionMetrics(user_id=user.id)
+		self._pending = OrderedDict()
+		self._dropped_unreported = 0
+		self._wakeup = asyncio.Event()
+		self._flusher = None
+		self.subprotocol = select_subprotocol(self.scope.get("subprotocols"))
+		# 先加入 group 再補送：補送期間的即時事件會排在 channel 中，connect 結束後才處理
+		await self._refresh_subscriptions()
+		await self.accept(subprotocol=self.subprotocol)
+		self._flusher = asyncio.create_task(self._flush_loop())
+		_active_connections.add(self)
+		query = parse_qs(self.scope.get("query_string", b"").decode("latin-1"))
+		last_event_id = (query.get("last_event_id") or [None])[0]
+		if last_event_id:
+			await self._replay(self.joined_groups, last_event_id)
 		logger.info(f"WebSocket connected for user: {user.id}")
 
 	async def disconnect(self, close_code):
-		await self.channel_layer.group_discard(self.group_name, self.channel_name)
+		_active_connections.discard(self)
+		flusher = getattr(self, "_flusher", None)
+		if flusher is not None:
+			flusher.cancel()
+		metrics = getattr(self, "metrics", None)
+		if metrics is not None and metrics.dropped:
+			logger.warning(f"通知連線佇列溢出，丟棄 {metrics.dropped} 筆事件: {asdict(metrics)}")
+		await self._apply_groups(set())
 
 	async def receive(self, text_data=None, bytes_data=None):
-		# 本示範僅單向推播，不處理前端傳來的訊息
-		# 驗證接收到的資料格式（防止惡意輸入）
-		if text_data:
-			try:
-				json.loads(text_data)
-			except json.JSONDecodeError:
-				logger.warning("Invalid JSON received in WebSocket")
-		return
+		# 前端只會送出 {"action": "watch", "vehicle_id": <id|null>, "last_event_id": <id>}（目前瀏覽的車輛頁面）
+		if not text_data:
+			return
+		try:
+			data = json.loads(text_data)
+		except json.JSONDecodeError:
+			logger.warning("Invalid JSON received in WebSocket")
+			return
+		if not isinstance(data, dict) or data.get("action") != "watch":
+			return
+
+		vehicle_id = data.get("vehicle_id")
+		if vehicle_id is not None and (not isinstance(vehicle_id, int) or isinstance(vehicle_id, bool) or vehicle_id <= 0):
+			return
+		self.watched_vehicle = vehicle_id
+		added = self._wanted_groups() - self.joined_groups
+		await self._apply_groups(self._wanted_groups())
+		if added and data.get("last_event_id"):
+			await self._replay(added, data["last_event_id"])
+
+	def _wanted_groups(self) -> set[str]:
+		vehicle_ids = set(self.subscribed_vehicles)
+		if self.watched_vehicle:
+			vehicle_ids.add(self.watched_vehicle)
+		return {user_group(self.user_id), *(vehicle_group(vehicle_id) for vehicle_id in vehicle_ids)}
+
+	async def _refresh_subscriptions(self):
+		vehicle_ids = await database_sync_to_async(subscribed_vehicle_ids)(self.user_id)
+		self.subscribed_vehicles = set(sorted(vehicle_ids)[:MAX_SUBSCRIBED_VEHICLES])
+		await self._apply_groups(self._wanted_groups())
+
+	async def _apply_groups(self, wanted: set[str]):
+		joined = getattr(self, "joined_groups", set())
+		await asyncio.gather(
+			*(self.channel_layer.group_add(group, self.channel_name) for group in wanted - joined),
+			*(self.channel_layer.group_discard(group, self.channel_name) for group in joined - wanted),
+		)
+		self.joined_groups = wanted
+
+	async def _replay(self, groups, last_event_id: str):
+		events, truncated = await aread_events_after(groups, last_event_id)
+		# 補送期間寫入的事件可能同時在即時佇列中，即時送達時略過
+		self.replayed_ids = {event_id for event_id, _ in events}
+		for event_id, event in events:
+			await self._send_event({**event, "event_id": event_id}, replayed=True)
+		if truncated:
+			await self._send_frame({"type": "replay_truncated"})
+
+	async def motry_subscriptions(self, event):
+		await self._refresh_subscriptions()
 
 	async def motry_notification(self, event):
+		event_id = event.get("event_id")
+		if event_id and event_id in self.replayed_ids:
+			self.replayed_ids.discard(event_id)
+			return
+		await self._send_event(event)
+
+	async def _send_event(self, event: dict, replayed: bool = False):
+		# 車輛 group 也包含作者本人，自己發的貼文不通知
+		if event.get("actor_id") == self.user_id:
+			return
+		payload = {
+			"type": event.get("kind"),
+			"event_id": event.get("event_id"),
+			"post_id": event.get("post_id"),
+			"title": event.get("title"),
+			"vehicle": event.get("vehicle"),
+			"actor": event.get("actor"),
+		}
+		if replayed:
+			payload["replayed"] = True
+		self._enqueue(payload)
+
+	def _enqueue(self, payload: dict):
+		metrics = self.metrics
+		metrics.events += 1
+		key = (payload["type"], payload["post_id"])
+		previous = self._pending.pop(key, None)
+		if previous is not None:
+			metrics.coalesced += 1
+			if payload["type"] in MERGEABLE_KINDS:
+				payload["count"] = previous.get("count", 1) + 1
+		self._pending[key] = payload
+		if len(self._pending) > self.max_pending:
+			self._pending.popitem(last=False)
+			self._dropped_unreported += 1
+			metrics.dropped += 1
+		metrics.queue_depth = len(self._pending)
+		metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+		self._wakeup.set()
+
+	async def _flush_loop(self):
+		while True:
+			await self._wakeup.wait()
+			if len(self._pending) < self.batch_max_events:
+				await asyncio.sleep(self.batch_window)
+			size = min(len(self._pending), self.batch_max_events)
+			batch = [self._pending.popitem(last=False)[1] for _ in range(size)]
+			if not self._pending:
+				self._wakeup.clear()
+			self.metrics.queue_depth = len(self._pending)
+			if not batch:
+				continue
+
+			if len(batch) == 1 and not self._dropped_unreported:
+				frame = batch[0]
+			else:
+				frame = {"type": "batch", "events": batch}
+				if self._dropped_unreported:
+					frame["dropped"] = self._dropped_unreported
+					self._dropped_unreported = 0
+			# 等 frame 交給 daphne 後才處理下一批（不代表用戶端已收到，見類別說明）；期間的新事件留在佇列中合併
+			await self._send_frame(frame)
+			self.metrics.frames += 1
+
+	async def _send_frame(self, frame: dict):
+		data = encode_frame(frame, self.subprotocol)
+		if is_binary(self.subprotocol):
+			await self.send(bytes_data=data)
+		else:
+			await self.send(text_data=data)
+
+
+class TaskEventConsumer(AsyncWebsocketConsumer):
+	"""背景任務事件推播：進度 / 完成 / 失敗，取代前端輪詢任務狀態。"""
+
+	async def connect(self):
+		user = self.scope.get("user")
+		if not user or user.is_anonymous:
+			logger.warning("Task event WebSocket rejected: user not authenticated")
+			await self.close(code=4001)
+			return
+
+		self.group_name = task_events_group(user.id)
+		await self.channel_layer.group_add(self.group_name, self.channel_name)
+		await self.accept()
+
+	async def disconnect(self, close_code):
+		group_name = getattr(self, "group_name", None)
+		if group_name:
+			await self.channel_layer.group_discard(group_name, self.channel_name)
+
+	async def task_event(self, event):
 		await self.send(
 			text_data=json.dumps(
 				{
-					"type": "new_post",
-					"post_id": event.get("post_id"),
-					"title": event.get("title"),
-					"vehicle": event.get("vehicle"),
+					"type": "task_event",
+					"task_id": event.get("task_id"),
+					"status": event.get("status"),
+					"rows": event.get("rows"),
+					"result": event.get("result"),
+					"stats": event.get("stats"),
 				}
 			)
 		)
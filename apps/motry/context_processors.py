@@ -1,14 +1,17 @@
 import json
 from typing import Dict, List
 
-from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 from django.utils.safestring import mark_safe
 
 from .cache_keys import BRAND_MAP_CACHE_KEY
+from .caching import catalog_cache
 from .forms import BRAND_CHOICES
+from .inbox import get_unread_count
 from .models import Vehicle
 
 BRAND_MAP_CACHE_TTL = 600  # 10 分鐘
+BRAND_MAP_CACHE_HARD_TTL = 60 * 60  # 過期後最多再沿用 50 分鐘舊值（背景重建期間）
 
 
 def _build_brand_list() -> List[str]:
@@ -25,13 +28,25 @@ def _build_brand_list() -> List[str]:
 
 
 def vehicle_brand_map(request) -> Dict[str, object]:
-	# Week 12 Redis 快取示範：優先從 Redis 取得品牌列表，沒有才查 DB 再寫回快取
-	brands = cache.get(BRAND_MAP_CACHE_KEY)
-	if brands is None:
-		brands = _build_brand_list()
-		cache.set(BRAND_MAP_CACHE_KEY, brands, BRAND_MAP_CACHE_TTL)
+	# Week 12 Redis 快取示範：優先從 Redis 取得品牌列表，過期時由背景重建，避免每個請求都查 DB
+	# 每個頁面都會讀，前面再加一層行程內 L1，多數請求連 Redis 都不用碰
+	brands = catalog_cache.get_or_rebuild(
+		BRAND_MAP_CACHE_KEY,
+		_build_brand_list,
+		soft_ttl=BRAND_MAP_CACHE_TTL,
+		hard_ttl=BRAND_MAP_CACHE_HARD_TTL,
+		background=True,
+	)
 
 	return {
 		"brand_list": brands,
 		"brand_list_json": mark_safe(json.dumps(brands, ensure_ascii=False)),
 	}
+
+
+def notification_badge(request) -> Dict[str, object]:
+	# 導覽列未讀徽章：讀快取中的計數器（見 inbox），頁面沒用到時不會讀取
+	user = getattr(request, "user", None)
+	if user is None or not user.is_authenticated:
+		return {}
+	return {"unread_notification_count": SimpleLazyObject(lambda: get_unread_count(user.id))}
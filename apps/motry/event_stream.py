@@ -0,0 +1,150 @@
+"""
+通知事件紀錄：斷線重連時補送漏掉的事件。
+
+Channels 的 group_send 只送給當下在線的連線。每個通知 group 另外寫一份 Redis Stream
+（``motry:events:<group>``，``XADD MAXLEN ~`` 限制長度並設定過期），事件 id 即 Stream id
+（``<毫秒>-<序號>``）。前端記住最後收到的 id，重連時帶上 ``last_event_id``，
+consumer 以一次 pipeline 對各 group 執行 ``XRANGE (last_event_id +`` 補送後才開始即時推送。
+
+非 Redis 後端（開發 / 測試的 locmem + InMemoryChannelLayer）改用行程內的 ``LocalEventStream``，
+id 格式與排序規則相同。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from redis.exceptions import RedisError
+
+from .caching import _async_redis, _redis_client
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "motry:events:{group}"
+STREAM_MAXLEN = 200  # 每個 group 保留的事件數（近似值）
+STREAM_TTL = 60 * 60 * 24  # group 一天沒有新事件時整個 Stream 過期
+REPLAY_LIMIT = 100  # 單次重連最多補送的事件數
+
+
+def parse_event_id(value) -> tuple[int, int] | None:
+	"""``"1700000000000-3"`` → (1700000000000, 3)；格式錯誤回傳 None。"""
+	if not isinstance(value, str):
+		return None
+	ms, _, seq = value.partition("-")
+	if not ms.isdigit() or not (seq or "0").isdigit():
+		return None
+	return int(ms), int(seq or 0)
+
+
+class LocalEventStream:
+	"""行程內的 Stream 替代品（每個 group 一個固定長度 deque）。"""
+
+	def __init__(self, maxlen: int = STREAM_MAXLEN):
+		self.maxlen = maxlen
+		self._streams: dict[str, deque] = {}
+		self._last_id = (0, 0)
+		self._lock = threading.Lock()
+
+	def append(self, group: str, event: dict) -> str:
+		with self._lock:
+			ms = int(time.time() * 1000)
+			last_ms, last_seq = self._last_id
+			self._last_id = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+			event_id = "{}-{}".format(*self._last_id)
+			stream = self._streams.setdefault(group, deque(maxlen=self.maxlen))
+			stream.append((self._last_id, event_id, event))
+			return event_id
+
+	def read_after(self, groups, after: tuple[int, int]) -> tuple[list[tuple[str, dict]], bool]:
+		"""回傳 (after 之後的事件, 是否因長度上限而有遺失)。"""
+		with self._lock:
+			items, truncated = [], False
+			for group in groups:
+				stream = self._streams.get(group)
+				if not stream:
+					continue
+				# 最舊一筆已比 after 新：中間的事件已被淘汰
+				truncated = truncated or (len(stream) == self.maxlen and stream[0][0] > after)
+				items.extend(item for item in stream if item[0] > after)
+		items.sort(key=lambda item: item[0])
+		return [(event_id, event) for _, event_id, event in items], truncated
+
+	def clear(self) -> None:
+		with self._lock:
+			self._streams.clear()
+
+
+local_stream = LocalEventStream()
+
+
+def append_event(group: str, event: dict) -> str | None:
+	"""把事件寫入 group 的 Stream，回傳事件 id；寫入失敗時回傳 None（仍照常即時推送）。"""
+	client = _redis_client()
+	if client is None:
+		return local_stream.append(group, event)
+
+	key = STREAM_KEY.format(group=group)
+	try:
+		pipe = client.pipeline(transaction=False)
+		pipe.xadd(key, {"e": json.dumps(event, ensure_ascii=False)}, maxlen=STREAM_MAXLEN, approximate=True)
+		pipe.expire(key, STREAM_TTL)
+		event_id, _ = pipe.execute()
+	except RedisError as e:
+		logger.warning(f"通知事件寫入 Stream 失敗 {group}: {e}")
+		return None
+	return _decode(event_id)
+
+
+def _decode(value) -> str:
+	return value.decode() if isinstance(value, bytes) else value
+
+
+async def aread_events_after(groups, last_event_id: str) -> tuple[list[tuple[str, dict]], bool]:
+	"""
+	讀取各 group 中 last_event_id 之後的事件（依 id 排序，最多 REPLAY_LIMIT 筆）。
+
+	Returns:
+		(事件列表, 是否有事件已無法補送)；前端收到後者時應重新載入資料
+	"""
+	after = parse_event_id(last_event_id)
+	groups = list(groups)
+	if after is None or not groups:
+		return [], False
+	# 整個 Stream 可能已因閒置過期
+	expired = after[0] < (time.time() - STREAM_TTL) * 1000
+
+	client = _async_redis()
+	if client is None:
+		events, truncated = local_stream.read_after(groups, after)
+	else:
+		start = "({}-{}".format(*after)
+		try:
+			# 每個 group：補送範圍、最舊一筆與長度（判斷是否已被 MAXLEN 淘汰），一次往返
+			pipe = client.pipeline(transaction=False)
+			for group in groups:
+				key = STREAM_KEY.format(group=group)
+				pipe.xrange(key, min=start, max="+", count=REPLAY_LIMIT + 1)
+				pipe.xrange(key, min="-", max="+", count=1)
+				pipe.xlen(key)
+			results = await pipe.execute()
+		except (RedisError, OSError) as e:
+			logger.warning(f"讀取通知事件 Stream 失敗: {e}")
+			return [], True
+
+		events, truncated = [], False
+		for index in range(0, len(results), 3):
+			entries, oldest, length = results[index : index + 3]
+			truncated = truncated or len(entries) > REPLAY_LIMIT
+			if oldest and length >= STREAM_MAXLEN and parse_event_id(_decode(oldest[0][0])) > after:
+				truncated = True
+			for raw_id, fields in entries:
+				events.append((_decode(raw_id), json.loads(fields.get(b"e") or fields.get("e"))))
+		events.sort(key=lambda item: parse_event_id(item[0]))
+
+	if len(events) > REPLAY_LIMIT:
+		return events[-REPLAY_LIMIT:], True
+	return events, truncated or expired
@@ -0,0 +1,515 @@
+"""
+車輛資料串流匯出引擎。
+
+以 ``values_list(...).iterator(chunk_size=...)`` 逐批讀取資料列，
+不建立 Model instance，記憶體用量不會隨資料筆數成長。
+
+支援格式：
+- csv: UTF-8 (BOM) CSV，可直接用 Excel 開啟
+- csv.gz: gzip 壓縮的 CSV
+- jsonl: 每行一筆 JSON 物件
+- parquet: 以 pyarrow record batch 逐批寫入（pyarrow 已列在 requirements；未安裝時匯出 API 直接回傳 400）
+"""
+
+from __future__ import annotations
+
+import csv
+import gzip
+import hashlib
+import importlib.util
+import json
+import operator
+import os
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Mapping, Sequence
+
+try:
+	import resource
+except ImportError:  # pragma: no cover - Windows 沒有 resource 模組
+	resource = None
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Max
+
+from .cache_keys import CATALOG_VERSION_CACHE_KEY, EXPORT_INFLIGHT_CACHE_KEY, EXPORT_RESULT_CACHE_KEY
+from .caching import catalog_cache
+from .filters import clean_vehicle_filters, filter_vehicles
+from .models import Vehicle
+
+DEFAULT_CHUNK_SIZE = 2000
+EXPORT_PROGRESS_EVERY = 10000
+
+# 已完成的匯出結果保留 1 天（檔案本身由 cleanup_old_exports 於 7 天後清除）
+EXPORT_RESULT_CACHE_TIMEOUT = 60 * 60 * 24
+# 執行中任務的冪等鍵，逾時後允許重新排程（避免 worker 當掉時永久卡住）
+EXPORT_INFLIGHT_TIMEOUT = 60 * 30
+# 目錄版本快取時間（save/delete 會主動失效，此值只影響 update()/bulk_create() 的延遲）
+CATALOG_VERSION_CACHE_TTL = 60
+
+# 預估筆數不超過此值時直接串流下載，不經 Celery
+STREAM_EXPORT_MAX_ROWS = 5000
+# 串流時累積到約 64KB 再送出一個 chunk，攤平每次送出的成本
+STREAM_BUFFER_SIZE = 64 * 1024
+STREAM_CONTENT_TYPES = {
+	"csv": "text/csv; charset=utf-8",
+	"jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+EXPORT_FORMATS = {
+	"csv": ".csv",
+	"csv.gz": ".csv.gz",
+	"jsonl": ".jsonl",
+	"parquet": ".parquet",
+}
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+class ExportError(ValueError):
+	"""匯出參數錯誤（格式或欄位不支援）。"""
+
+
+def _format_years(years_from, years_to) -> str:
+	years = f"{years_from or ''}"
+	if years_to:
+		years = f"{years}-{years_to}" if years else str(years_to)
+	return years
+
+
+@dataclass(frozen=True)
+class ExportColumn:
+	"""匯出欄位定義：對外的 key / CSV 標題 / 需要讀取的 DB 欄位。"""
+
+	key: str
+	header: str
+	fields: tuple[str, ...]
+	kind: str = "int"
+	combine: Callable | None = None
+
+
+EXPORT_COLUMNS: dict[str, ExportColumn] = {
+	column.key: column
+	for column in (
+		ExportColumn("id", "ID", ("id",)),
+		ExportColumn("brand", "Brand", ("brand",), kind="str"),
+		ExportColumn("model", "Model", ("model",), kind="str"),
+		ExportColumn("generation", "Generation", ("generation",), kind="str"),
+		ExportColumn("years", "Years", ("years_from", "years_to"), kind="str", combine=_format_years),
+		ExportColumn("years_from", "Years_from", ("years_from",)),
+		ExportColumn("years_to", "Years_to", ("years_to",)),
+		ExportColumn("displacement_cc", "Displacement_cc", ("displacement_cc",)),
+		ExportColumn("cylinders", "Cylinders", ("cylinders",)),
+		ExportColumn("horsepower_ps", "Horsepower_ps", ("horsepower_ps",)),
+		ExportColumn("msrp_new", "MSRP_new", ("msrp_new",)),
+		ExportColumn("used_price_min", "Used_price_min", ("used_price_min",)),
+		ExportColumn("used_price_max", "Used_price_max", ("used_price_max",)),
+	)
+}
+
+DEFAULT_EXPORT_COLUMNS = (
+	"id",
+	"brand",
+	"model",
+	"generation",
+	"years",
+	"displacement_cc",
+	"cylinders",
+	"horsepower_ps",
+	"msrp_new",
+)
+
+
+def resolve_columns(columns: Sequence[str] | str | None) -> list[ExportColumn]:
+	"""將欄位 key（list 或逗號分隔字串）轉為欄位定義，未指定時使用預設欄位。"""
+	if isinstance(columns, str):
+		columns = [c.strip() for c in columns.split(",") if c.strip()]
+	keys = list(columns or DEFAULT_EXPORT_COLUMNS)
+
+	unknown = [key for key in keys if key not in EXPORT_COLUMNS]
+	if unknown:
+		raise ExportError(f"不支援的匯出欄位：{', '.join(unknown)}")
+	# 保留順序並去除重複
+	return [EXPORT_COLUMNS[key] for key in dict.fromkeys(keys)]
+
+
+def validate_format(fmt: str) -> str:
+	if fmt not in EXPORT_FORMATS:
+		raise ExportError(f"不支援的匯出格式：{fmt}")
+	if fmt == "parquet" and not PARQUET_AVAILABLE:
+		raise ExportError("Parquet 匯出需要安裝 pyarrow")
+	return fmt
+
+
+def export_queryset(filters: Mapping | None = None):
+	"""匯出用的 queryset：套用搜尋條件並固定排序，確保輸出穩定。"""
+	return filter_vehicles(Vehicle.objects.all(), filters or {}).order_by("brand", "model", "id")
+
+
+def _row_builder(columns: list[ExportColumn]) -> tuple[list[str], Callable[[tuple], tuple]]:
+	"""
+	計算需要讀取的 DB 欄位，並產生 raw tuple → 輸出 tuple 的轉換函式。
+
+	沒有衍生欄位時直接以 itemgetter 取值，避免每列多一層 Python 呼叫。
+	"""
+	fields: list[str] = []
+	for column in columns:
+		for field in column.fields:
+			if field not in fields:
+				fields.append(field)
+
+	if all(column.combine is None for column in columns):
+		getter = operator.itemgetter(*[fields.index(column.fields[0]) for column in columns])
+		if len(columns) == 1:
+			return fields, lambda raw: (getter(raw),)
+		return fields, getter
+
+	getters = []
+	for column in columns:
+		indexes = [fields.index(field) for field in column.fields]
+		if column.combine is None:
+			getters.append(operator.itemgetter(indexes[0]))
+		else:
+			getters.append(
+				lambda raw, idx=indexes, combine=column.combine: combine(*(raw[i] for i in idx))
+			)
+	return fields, lambda raw: tuple(get(raw) for get in getters)
+
+
+def iter_export_rows(
+	columns: list[ExportColumn],
+	filters: Mapping | None = None,
+	chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple]:
+	"""逐列產出匯出資料（tuple），不建立 Model instance。"""
+	fields, build_row = _row_builder(columns)
+	rows = export_queryset(filters).values_list(*fields).iterator(chunk_size=chunk_size)
+	for raw in rows:
+		yield build_row(raw)
+
+
+def _chunked(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+	batch: list[tuple] = []
+	for row in rows:
+		batch.append(row)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def _write_csv(rows, columns, fileobj) -> int:
+	writer = csv.writer(fileobj)
+	writer.writerow([column.header for column in columns])
+	count = 0
+	for batch in _chunked(rows, DEFAULT_CHUNK_SIZE):
+		writer.writerows(batch)
+		count += len(batch)
+	return count
+
+
+def encode_jsonl_row(keys: Sequence[str], row: tuple) -> str:
+	return json.dumps(dict(zip(keys, row)), ensure_ascii=False) + "\n"
+
+
+def _write_jsonl(rows, columns, fileobj) -> int:
+	keys = [column.key for column in columns]
+	count = 0
+	for batch in _chunked(rows, DEFAULT_CHUNK_SIZE):
+		fileobj.write("".join(encode_jsonl_row(keys, row) for row in batch))
+		count += len(batch)
+	return count
+
+
+def _write_parquet(rows, columns, path: Path, batch_size: int) -> int:
+	try:
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+	except ImportError as exc:
+		raise ExportError("Parquet 匯出需要安裝 pyarrow") from exc
+
+	schema = pa.schema(
+		[(column.key, pa.int64() if column.kind == "int" else pa.string()) for column in columns]
+	)
+	count = 0
+	with pq.ParquetWriter(path, schema) as writer:
+		for batch in _chunked(rows, batch_size):
+			arrays = [
+				pa.array([row[i] for row in batch], type=schema.field(i).type)
+				for i in range(len(columns))
+			]
+			writer.write_batch(pa.record_batch(arrays, schema=schema))
+			count += len(batch)
+	return count
+
+
+def write_rows(rows: Iterable[tuple], columns: list[ExportColumn], fmt: str, path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+	"""依格式將資料列寫入檔案，回傳寫入筆數。"""
+	validate_format(fmt)
+	if fmt == "csv":
+		with open(path, "w", newline="", encoding="utf-8-sig") as fileobj:
+			return _write_csv(rows, columns, fileobj)
+	if fmt == "csv.gz":
+		with gzip.open(path, "wt", newline="", encoding="utf-8-sig") as fileobj:
+			return _write_csv(rows, columns, fileobj)
+	if fmt == "jsonl":
+		with open(path, "w", encoding="utf-8") as fileobj:
+			return _write_jsonl(rows, columns, fileobj)
+	return _write_parquet(rows, columns, path, chunk_size)
+
+
+def peak_rss_kb() -> int | None:
+	"""
+	目前行程啟動以來的峰值 RSS（KB）。macOS 的 ru_maxrss 單位為 bytes，需換算。
+
+	長時間執行的 worker 會回報歷次任務中的最大值，不代表單次匯出；單次匯出看 ``rss_growth_kb``。
+	"""
+	if resource is None:
+		return None
+	usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		usage //= 1024
+	return int(usage)
+
+
+def rss_growth_kb(before: int | None) -> int | None:
+	"""
+	自 before（開始時的 ``peak_rss_kb()``）以來峰值 RSS 增加的量（KB）。
+
+	0 代表這段工作沒有超過行程先前的峰值，不代表沒有配置記憶體。
+	"""
+	after = peak_rss_kb()
+	if before is None or after is None:
+		return None
+	return after - before
+
+
+def _with_progress(rows: Iterable[tuple], every: int, callback: Callable[[int], None]) -> Iterator[tuple]:
+	count = 0
+	for row in rows:
+		yield row
+		count += 1
+		if count % every == 0:
+			callback(count)
+
+
+def run_export(
+	path: Path,
+	fmt: str = "csv",
+	columns: Sequence[str] | str | None = None,
+	filters: Mapping | None = None,
+	chunk_size: int = DEFAULT_CHUNK_SIZE,
+	progress: Callable[[int], None] | None = None,
+	progress_every: int = EXPORT_PROGRESS_EVERY,
+) -> dict:
+	"""
+	執行一次匯出並回傳統計資料。
+
+	Args:
+		progress: 可選，每處理 progress_every 筆呼叫一次，參數為目前已處理筆數
+
+	Returns:
+		dict: path / format / columns / filters / rows / elapsed_sec / rows_per_sec /
+		rss_growth_kb（本次匯出使峰值 RSS 增加的量）/ peak_rss_kb（行程啟動以來的峰值）
+	"""
+	validate_format(fmt)
+	resolved = resolve_columns(columns)
+	rss_before = peak_rss_kb()
+	started = time.perf_counter()
+	source = iter_export_rows(resolved, filters, chunk_size)
+	if progress is not None:
+		source = _with_progress(source, progress_every, progress)
+	rows = write_rows(source, resolved, fmt, path, chunk_size)
+	elapsed = time.perf_counter() - started
+
+	return {
+		"path": str(path),
+		"format": fmt,
+		"columns": [column.key for column in resolved],
+		"filters": clean_vehicle_filters(filters or {}),
+		"rows": rows,
+		"elapsed_sec": round(elapsed, 3),
+		"rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None,
+		"rss_growth_kb": rss_growth_kb(rss_before),
+		"peak_rss_kb": peak_rss_kb(),
+	}
+
+
+# ==========================================
+# 匯出結果重用（依車輛資料版本做 content-addressed 快取）
+# ==========================================
+
+def catalog_version() -> str:
+	"""
+	車輛資料版本：由 max(updated_at) 與總筆數組成。
+
+	新增/修改會推進 updated_at，刪除會改變筆數；
+	注意 ``QuerySet.update()`` 不會觸發 auto_now，需自行更新 updated_at。
+	結果放在兩層快取中，Vehicle 的 save/delete signal 會使其失效；
+	``update()`` / ``bulk_create()`` 不發 signal，最多延遲 CATALOG_VERSION_CACHE_TTL 秒。
+	"""
+	return catalog_cache.get_or_rebuild(
+		CATALOG_VERSION_CACHE_KEY,
+		_compute_catalog_version,
+		soft_ttl=CATALOG_VERSION_CACHE_TTL,
+	)
+
+
+def _compute_catalog_version() -> str:
+	stats = Vehicle.objects.aggregate(last_updated=Max("updated_at"), total=Count("id"))
+	last_updated = stats["last_updated"].isoformat() if stats["last_updated"] else "-"
+	return f"{last_updated}:{stats['total']}"
+
+
+def export_fingerprint(
+	fmt: str,
+	columns: Sequence[str] | str | None,
+	filters: Mapping | None,
+	version: str | None = None,
+) -> str:
+	"""以（格式, 欄位, 篩選條件, 資料版本）計算匯出內容的雜湊值。"""
+	payload = {
+		"format": validate_format(fmt),
+		"columns": [column.key for column in resolve_columns(columns)],
+		"filters": clean_vehicle_filters(filters or {}),
+		"version": version if version is not None else catalog_version(),
+	}
+	raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+	return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def export_file_url(file_path: str | None) -> str | None:
+	"""將匯出檔案的絕對路徑轉為 MEDIA_URL 底下的網址。"""
+	if file_path and file_path.startswith(str(settings.MEDIA_ROOT)):
+		relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+		return f"{settings.MEDIA_URL}{relative_path}"
+	return file_path
+
+
+def export_filename(digest: str, fmt: str) -> str:
+	return f"vehicle_export_{digest[:16]}{EXPORT_FORMATS[fmt]}"
+
+
+def get_cached_export(digest: str) -> dict | None:
+	"""取得已完成且檔案仍存在的匯出結果；檔案已被清除時一併移除快取。"""
+	key = EXPORT_RESULT_CACHE_KEY.format(digest=digest)
+	stats = cache.get(key)
+	if stats is None:
+		return None
+	if not Path(stats.get("path", "")).exists():
+		cache.delete(key)
+		return None
+	return stats
+
+
+def store_cached_export(digest: str, stats: dict) -> None:
+	cache.set(EXPORT_RESULT_CACHE_KEY.format(digest=digest), stats, EXPORT_RESULT_CACHE_TIMEOUT)
+
+
+def claim_export(digest: str, task_id: str) -> str | None:
+	"""
+	以 ``cache.add``（Redis 為 SET NX）搶占冪等鍵。
+
+	Returns:
+		None 代表搶占成功、呼叫端應排程 task_id；
+		否則回傳已在執行中的 task id。
+	"""
+	key = EXPORT_INFLIGHT_CACHE_KEY.format(digest=digest)
+	if cache.add(key, task_id, EXPORT_INFLIGHT_TIMEOUT):
+		return None
+	return cache.get(key)
+
+
+def release_export(digest: str) -> None:
+	cache.delete(EXPORT_INFLIGHT_CACHE_KEY.format(digest=digest))
+
+
+# ==========================================
+# 小量匯出：直接串流回應（不寫暫存檔、不經 Celery）
+# ==========================================
+
+def estimate_row_count(qs, limit: int) -> int:
+	"""
+	低成本的筆數預估，只用來判斷要串流還是交給背景任務。
+
+	- PostgreSQL：讀取 EXPLAIN 的 Plan Rows（不實際掃描資料）
+	- 其他資料庫：最多只數到 limit + 1 筆的 bounded COUNT
+	"""
+	qs = qs.order_by()
+	if connections[qs.db].vendor == "postgresql":
+		plan = json.loads(qs.explain(format="json"))
+		return int(plan[0]["Plan"]["Plan Rows"])
+	return qs.values("pk")[: limit + 1].count()
+
+
+class _Echo:
+	"""給 csv.writer 使用的假檔案：writerow 直接回傳格式化後的字串。"""
+
+	def write(self, value: str) -> str:
+		return value
+
+
+def iter_stream_chunks(
+	fmt: str,
+	columns: Sequence[str] | str | None = None,
+	filters: Mapping | None = None,
+	chunk_size: int = DEFAULT_CHUNK_SIZE,
+	buffer_size: int = STREAM_BUFFER_SIZE,
+) -> Iterator[bytes]:
+	"""
+	逐段產生匯出內容（bytes），供 StreamingHttpResponse 使用。
+
+	資料列由 server-side cursor 分批讀出，每累積約 buffer_size 才送出一次；
+	下游沒有取用時不會繼續讀取資料庫（由呼叫端拉取驅動）。
+	"""
+	if fmt not in STREAM_CONTENT_TYPES:
+		raise ExportError(f"串流下載僅支援：{', '.join(STREAM_CONTENT_TYPES)}")
+	resolved = resolve_columns(columns)
+
+	if fmt == "csv":
+		writer = csv.writer(_Echo())
+		encode_row = writer.writerow
+		# 加上 BOM，讓 Excel 以 UTF-8 開啟（與背景匯出的 utf-8-sig 一致）
+		header = "\ufeff" + writer.writerow([column.header for column in resolved])
+	else:
+		keys = [column.key for column in resolved]
+		encode_row = lambda row: encode_jsonl_row(keys, row)  # noqa: E731
+		header = ""
+
+	parts = [header] if header else []
+	size = len(header)
+	for row in iter_export_rows(resolved, filters, chunk_size):
+		line = encode_row(row)
+		parts.append(line)
+		size += len(line)
+		if size >= buffer_size:
+			yield "".join(parts).encode("utf-8")
+			parts = []
+			size = 0
+	if parts:
+		yield "".join(parts).encode("utf-8")
+
+
+async def aiter_stream_chunks(*args, **kwargs):
+	"""
+	``iter_stream_chunks`` 的 async 版本，給 ASGI（daphne）使用。
+
+	Django 在 ASGI 下遇到同步 iterator 會先整個讀進記憶體，
+	因此改為每個 chunk 才切換一次執行緒取下一段資料。
+	"""
+	chunks = iter_stream_chunks(*args, **kwargs)
+	next_chunk = sync_to_async(next, thread_sensitive=True)
+	done = object()
+	try:
+		while True:
+			chunk = await next_chunk(chunks, done)
+			if chunk is done:
+				break
+			yield chunk
+	finally:
+		await sync_to_async(chunks.close, thread_sensitive=True)()
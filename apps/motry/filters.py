@@ -0,0 +1,82 @@
+"""
+車輛篩選條件（搜尋頁與匯出共用）。
+
+``search`` 頁面與匯出引擎都接受相同的 GET/POST 參數，
+集中在這裡解析，避免兩邊的條件不一致。
+"""
+
+from __future__ import annotations
+
+from typing import Mapping
+
+from django.db.models import Q, QuerySet
+
+VEHICLE_FILTER_PARAMS = (
+	"query",
+	"brand",
+	"displacement_min",
+	"displacement_max",
+	"hp_min",
+	"hp_max",
+	"cylinders",
+)
+
+
+def clean_vehicle_filters(params: Mapping) -> dict[str, str]:
+	"""取出支援的篩選參數並去除空白，空值一律省略。"""
+	cleaned = {}
+	for name in VEHICLE_FILTER_PARAMS:
+		value = params.get(name)
+		if value is None:
+			continue
+		value = str(value).strip()
+		if value:
+			cleaned[name] = value
+	return cleaned
+
+
+def _int_or_none(value: str | None) -> int | None:
+	if not value:
+		return None
+	try:
+		return int(value)
+	except ValueError:
+		return None
+
+
+def filter_vehicles(qs: QuerySet, params: Mapping) -> QuerySet:
+	"""
+	套用與搜尋頁相同的篩選條件。
+
+	無法解析的數值條件會被忽略（與原本搜尋頁的行為一致）。
+	"""
+	filters = clean_vehicle_filters(params)
+
+	query = filters.get("query")
+	if query:
+		qs = qs.filter(Q(brand__icontains=query) | Q(model__icontains=query))
+	brand = filters.get("brand")
+	if brand:
+		qs = qs.filter(brand__icontains=brand)
+
+	range_lookups = (
+		("displacement_min", "displacement_cc__gte"),
+		("displacement_max", "displacement_cc__lte"),
+		("hp_min", "horsepower_ps__gte"),
+		("hp_max", "horsepower_ps__lte"),
+	)
+	for param, lookup in range_lookups:
+		number = _int_or_none(filters.get(param))
+		if number is not None:
+			qs = qs.filter(**{lookup: number})
+
+	cylinders = filters.get("cylinders")
+	if cylinders:
+		try:
+			cyl_values = [int(c.strip()) for c in cylinders.split(",") if c.strip()]
+		except ValueError:
+			cyl_values = []
+		if cyl_values:
+			qs = qs.filter(cylinders__in=cyl_values)
+
+	return qs
@@ -1,6 +1,19 @@
 from django import forms
+from .cache_keys import TAG_LIST_CACHE_KEY
+from .caching import tag_cache
 from .models import Post, Comment, Tag, Vehicle, UserVehicle, VehicleImage
 
+TAG_LIST_CACHE_TTL = 600  # 10 分鐘；Tag 新增/修改/刪除時由 signal 失效
+
+
+def tag_choices() -> list[tuple[int, str]]:
+	"""標籤選項 (id, name)，經兩層快取，渲染發文表單時不查 DB"""
+	return tag_cache.get_or_rebuild(
+		TAG_LIST_CACHE_KEY,
+		lambda: list(Tag.objects.order_by("name").values_list("id", "name")),
+		soft_ttl=TAG_LIST_CACHE_TTL,
+	)
+
 
 class PostCreateForm(forms.Form):
 	vehicle_id = forms.IntegerField(widget=forms.HiddenInput)
@@ -17,6 +30,11 @@ class PostCreateForm(forms.Form):
 	image_5 = forms.ImageField(required=False, widget=forms.FileInput(attrs={"accept": "image/*"}))
 	image_6 = forms.ImageField(required=False, widget=forms.FileInput(attrs={"accept": "image/*"}))
 
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# 選項改用快取；送出時仍由 queryset 驗證所選 id 是否存在
+		self.fields["tags"].choices = tag_choices()
+
 	def clean_tags(self):
 		tags = self.cleaned_data.get("tags")
 		count = tags.count() if tags is not None else 0
@@ -0,0 +1,134 @@
+"""
+通知 WebSocket 的 frame 編碼。
+
+預設（未指定 subprotocol 的舊前端）為 JSON 文字 frame。前端可在握手時協商 subprotocol 改用二進位 frame：
+
+- ``motry.msgpack.v1``：msgpack 編碼，欄位改用短鍵、事件種類改為整數代碼；
+  車輛不再於每筆事件重複 ``{"id", "name"}``，同一 frame 的車輛名稱集中於 ``v`` 對照表
+- ``motry.msgpack+deflate.v1``：同上，另加 1 byte 標頭，較大的 frame 以 raw deflate 壓縮
+  （每則訊息獨立壓縮，等同 permessage-deflate 的 no_context_takeover）
+- ``motry.json.v1``：與預設相同；前端同時提供多個 subprotocol 時的保底選項
+  （瀏覽器送出 subprotocol 而伺服器未選擇任何一個時會中斷連線）
+
+msgpack frame 一律為 ``{"e": [事件...], "v": {車輛 id: 名稱}, "d": 丟棄數, "t": 補送不完整}``，
+事件欄位見 ``EVENT_KEYS``，None 欄位省略。msgpack 為選用套件，未安裝時只提供 JSON。
+"""
+
+from __future__ import annotations
+
+import json
+import zlib
+
+try:
+	import msgpack
+except ImportError:  # pragma: no cover - msgpack 為選用套件（channels_redis 相依）
+	msgpack = None
+
+JSON_SUBPROTOCOL = "motry.json.v1"
+MSGPACK_SUBPROTOCOL = "motry.msgpack.v1"
+MSGPACK_DEFLATE_SUBPROTOCOL = "motry.msgpack+deflate.v1"
+
+# 小於此大小不壓縮：raw deflate 對短訊息幾乎沒有效果
+DEFLATE_MIN_LENGTH = 256
+DEFLATE_LEVEL = 6
+_RAW, _DEFLATED = 0, 1
+
+EVENT_KEYS = {
+	"type": "k",
+	"event_id": "i",
+	"post_id": "p",
+	"title": "h",
+	"actor": "a",
+	"count": "c",
+	"replayed": "r",
+}
+KIND_CODES = {"new_post": 1, "new_comment": 2, "new_like": 3}
+_EVENT_NAMES = {short: name for name, short in EVENT_KEYS.items()}
+_KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def select_subprotocol(offered) -> str | None:
+	"""依前端提供的順序選出第一個支援的 subprotocol；都不支援時回傳 None（JSON，不回覆 subprotocol）。"""
+	supported = {JSON_SUBPROTOCOL}
+	if msgpack is not None:
+		supported |= {MSGPACK_SUBPROTOCOL, MSGPACK_DEFLATE_SUBPROTOCOL}
+	for name in offered or ():
+		if name in supported:
+			return name
+	return None
+
+
+def is_binary(subprotocol: str | None) -> bool:
+	return subprotocol in (MSGPACK_SUBPROTOCOL, MSGPACK_DEFLATE_SUBPROTOCOL)
+
+
+def encode_frame(frame: dict, subprotocol: str | None) -> str | bytes:
+	"""把 consumer 的 frame（單一事件、batch 或 replay_truncated）編碼為要送出的 text / bytes。"""
+	if not is_binary(subprotocol):
+		return json.dumps(frame)
+	data = msgpack.packb(_compact(frame), use_bin_type=True)
+	if subprotocol != MSGPACK_DEFLATE_SUBPROTOCOL:
+		return data
+	if len(data) >= DEFLATE_MIN_LENGTH:
+		compressed = zlib.compress(data, DEFLATE_LEVEL, wbits=-15)
+		if len(compressed) < len(data):
+			return bytes((_DEFLATED,)) + compressed
+	return bytes((_RAW,)) + data
+
+
+def _compact(frame: dict) -> dict:
+	if frame.get("type") == "replay_truncated":
+		return {"t": True}
+	events = frame["events"] if frame.get("type") == "batch" else [frame]
+	vehicles = {}
+	compact_events = []
+	for event in events:
+		item = {}
+		for name, value in event.items():
+			if value is None:
+				continue
+			if name == "vehicle":
+				vehicles[value["id"]] = value.get("name")
+				item["v"] = value["id"]
+			elif name == "type":
+				item["k"] = KIND_CODES.get(value, value)
+			else:
+				item[EVENT_KEYS.get(name, name)] = value
+		compact_events.append(item)
+	compact = {"e": compact_events}
+	if vehicles:
+		compact["v"] = vehicles
+	if frame.get("dropped"):
+		compact["d"] = frame["dropped"]
+	return compact
+
+
+def decode_frame(data: str | bytes, subprotocol: str | None) -> dict:
+	"""encode_frame 的反向（測試與量測用），回傳與 JSON frame 相同的結構。"""
+	if not is_binary(subprotocol):
+		return json.loads(data)
+	if subprotocol == MSGPACK_DEFLATE_SUBPROTOCOL:
+		flag, data = data[0], data[1:]
+		if flag == _DEFLATED:
+			data = zlib.decompress(data, wbits=-15)
+	compact = msgpack.unpackb(data, raw=False, strict_map_key=False)
+	if compact.get("t"):
+		return {"type": "replay_truncated"}
+	vehicles = compact.get("v", {})
+	events = []
+	for item in compact["e"]:
+		event = {}
+		for short, value in item.items():
+			if short == "v":
+				event["vehicle"] = {"id": value, "name": vehicles.get(value)}
+			elif short == "k":
+				event["type"] = _KIND_NAMES.get(value, value)
+			else:
+				event[_EVENT_NAMES.get(short, short)] = value
+		events.append(event)
+	if len(events) == 1 and "d" not in compact:
+		return events[0]
+	frame = {"type": "batch", "events": events}
+	if "d" in compact:
+		frame["dropped"] = compact["d"]
+	return frame
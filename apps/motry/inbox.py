@@ -0,0 +1,180 @@
+"""
+通知收件匣：分頁列表、批次標記已讀與未讀數計數器。
+
+- 列表依 (created_at, id) 由新到舊做 keyset 分頁，``cursor`` 為上一頁最後一筆的排序鍵；
+  ``unread=1`` 只列未讀（索引 ``motry_notif_user_read_created``）
+- 標記已讀以 id 範圍一次 UPDATE（``min_id`` / ``max_id``，省略時為全部）
+- 未讀數存在快取（Redis 上為原生整數，寫入通知時 INCRBY、標記已讀時扣回），
+  導覽列徽章不需每頁 ``COUNT(*)``；計數器不存在時才查 DB 重建。
+  rollback、直接 UPDATE 等情況可能讓計數器短暫偏差，由定時任務 ``reconcile_unread_counters`` 校正；
+  通知全數被刪除的使用者不在校正範圍內，計數器最晚於 UNREAD_COUNT_TTL 後過期重建
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable, Mapping
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .caching import _redis_client
+from .models import Notification
+from .vehicle_list import VehicleListError, decode_cursor, encode_cursor, parse_updated_since
+
+INBOX_PAGE_SIZE = 20
+INBOX_MAX_PAGE_SIZE = 100
+
+UNREAD_COUNT_CACHE_KEY = "motry:unread:u{user_id}"
+UNREAD_COUNT_TTL = 60 * 60 * 24
+
+INBOX_FIELDS = (
+	"id",
+	"notification_type",
+	"title",
+	"message",
+	"is_read",
+	"created_at",
+	"related_post_id",
+	"related_vehicle_id",
+)
+
+# 計數器存在時才加減；不存在代表尚未建立，下次讀取時自 DB 計算
+_ADJUST_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+	return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+class InboxError(ValueError):
+	"""查詢參數錯誤（回傳 400）"""
+
+
+def parse_optional_int(params: Mapping, name: str) -> int | None:
+	raw = params.get(name)
+	if raw in (None, ""):
+		return None
+	try:
+		return int(raw)
+	except (TypeError, ValueError):
+		raise InboxError(f"{name} 必須為整數")
+
+
+def build_inbox_page(user_id: int, params: Mapping) -> dict:
+	"""依查詢參數組出一頁通知列表。"""
+	limit = parse_optional_int(params, "limit") or INBOX_PAGE_SIZE
+	limit = max(1, min(limit, INBOX_MAX_PAGE_SIZE))
+
+	qs = Notification.objects.filter(user_id=user_id)
+	if params.get("unread") in ("1", "true"):
+		qs = qs.filter(is_read=False)
+
+	cursor = params.get("cursor")
+	if cursor:
+		try:
+			last_created, last_id = decode_cursor(cursor, 2)
+			last_created = parse_updated_since(last_created)
+		except VehicleListError:
+			raise InboxError("cursor 格式錯誤")
+		if not isinstance(last_id, int):
+			raise InboxError("cursor 格式錯誤")
+		qs = qs.filter(Q(created_at__lt=last_created) | Q(created_at=last_created, id__lt=last_id))
+
+	rows = list(qs.order_by("-created_at", "-id").values(*INBOX_FIELDS)[: limit + 1])
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = encode_cursor([rows[-1]["created_at"].isoformat(), rows[-1]["id"]])
+
+	notifications = [
+		{
+			"id": row["id"],
+			"type": row["notification_type"],
+			"title": row["title"],
+			"message": row["message"],
+			"is_read": row["is_read"],
+			"created_at": row["created_at"].isoformat() if isinstance(row["created_at"], datetime) else row["created_at"],
+			"post_id": row["related_post_id"],
+			"vehicle_id": row["related_vehicle_id"],
+		}
+		for row in rows
+	]
+	return {
+		"notifications": notifications,
+		"next_cursor": next_cursor,
+		"unread_count": get_unread_count(user_id),
+	}
+
+
+def mark_read(user_id: int, min_id: int | None = None, max_id: int | None = None) -> int:
+	"""把 id 範圍內（含端點）的未讀通知標為已讀，回傳更新筆數。"""
+	qs = Notification.objects.filter(user_id=user_id, is_read=False)
+	if min_id is not None:
+		qs = qs.filter(id__gte=min_id)
+	if max_id is not None:
+		qs = qs.filter(id__lte=max_id)
+	updated = qs.update(is_read=True)
+	if updated:
+		adjust_unread([user_id], -updated)
+	return updated
+
+
+# ==========================================
+# 未讀數計數器
+# ==========================================
+
+def _counter_key(user_id: int) -> str:
+	return UNREAD_COUNT_CACHE_KEY.format(user_id=user_id)
+
+
+def count_unread(user_id: int) -> int:
+	return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+
+def get_unread_count(user_id: int) -> int:
+	count = cache.get(_counter_key(user_id))
+	if count is None:
+		count = count_unread(user_id)
+		# add：期間若已有其他請求建立計數器（並開始加減），以對方為準
+		cache.add(_counter_key(user_id), count, UNREAD_COUNT_TTL)
+	return max(int(count), 0)
+
+
+def adjust_unread(user_ids: Iterable[int], delta: int) -> None:
+	"""調整多位使用者的未讀數；Redis 上以 pipeline 一次送出。"""
+	user_ids = list(user_ids)
+	if not user_ids or not delta:
+		return
+	client = _redis_client()
+	if client is None:
+		for user_id in user_ids:
+			try:
+				cache.incr(_counter_key(user_id), delta)
+			except ValueError:
+				pass
+		return
+
+	script = client.register_script(_ADJUST_IF_EXISTS_SCRIPT)
+	pipe = client.pipeline(transaction=False)
+	for user_id in user_ids:
+		script(keys=[cache.make_key(_counter_key(user_id))], args=[delta], client=pipe)
+	pipe.execute()
+
+
+def reconcile_unread(user_ids: Iterable[int]) -> int:
+	"""以 DB 的未讀數覆寫這些使用者的計數器，回傳處理人數。"""
+	user_ids = list(user_ids)
+	if not user_ids:
+		return 0
+	counts = dict.fromkeys(user_ids, 0)
+	counts.update(
+		Notification.objects.filter(user_id__in=user_ids, is_read=False)
+		.order_by()
+		.values("user_id")
+		.annotate(unread=Count("id"))
+		.values_list("user_id", "unread")
+	)
+	cache.set_many({_counter_key(user_id): count for user_id, count in counts.items()}, UNREAD_COUNT_TTL)
+	return len(counts)
@@ -0,0 +1,113 @@
+"""
+預先編碼的 JSON 回應。
+
+快取裡直接存放編碼好的 bytes（原始與 gzip 各一份），命中時不需 unpickle 大量 dict、
+也不需再經過 ``JsonResponse`` 重新編碼，直接把 bytes 寫回客戶端。
+
+編碼優先使用 orjson（未安裝時退回標準庫 json，兩者輸出的 bytes 相同）。
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import re
+from typing import Any, Callable
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .caching import get_or_rebuild
+
+try:
+	import orjson
+except ImportError:  # pragma: no cover - orjson 為選用套件
+	orjson = None
+
+# 小於此大小不壓縮：gzip 標頭的額外成本大於節省的傳輸量
+GZIP_MIN_LENGTH = 1024
+GZIP_LEVEL = 6
+
+_QVALUE = re.compile(r"^q\s*=\s*([0-9.]+)$", re.IGNORECASE)
+_django_default = DjangoJSONEncoder().default
+
+
+def dumps(obj: Any) -> bytes:
+	"""
+	編碼為 UTF-8 JSON bytes；datetime / date / time / Decimal / UUID 的格式與 JsonResponse 相同
+	（DjangoJSONEncoder，datetime 截到毫秒）。
+
+	與 JsonResponse 的差異：不跳脫非 ASCII 字元、分隔符號不含空白，bytes 較短但與 JsonResponse 的輸出不同。
+	"""
+	if orjson is not None:
+		# datetime 交給 DjangoJSONEncoder，否則 orjson 會輸出到微秒，與標準庫路徑不一致
+		return orjson.dumps(obj, default=_django_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+	return json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_body(payload: Any) -> dict[str, bytes | None]:
+	"""回傳 {"raw": bytes, "gzip": bytes | None}，供快取保存。"""
+	raw = dumps(payload)
+	compressed = None
+	if len(raw) >= GZIP_MIN_LENGTH:
+		# mtime=0 讓相同內容產生相同 bytes
+		compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+		if len(compressed) >= len(raw):
+			compressed = None
+	return {"raw": raw, "gzip": compressed}
+
+
+def _encoding_qvalues(header: str) -> dict[str, float]:
+	"""解析 Accept-Encoding 為 {coding: q}；q 缺省為 1，無法解析的 q 視為 0。"""
+	qvalues = {}
+	for item in header.split(","):
+		coding, *params = [part.strip() for part in item.split(";")]
+		if not coding:
+			continue
+		q = 1.0
+		for param in params:
+			match = _QVALUE.match(param)
+			if match:
+				try:
+					q = float(match.group(1))
+				except ValueError:
+					q = 0.0
+		qvalues[coding.lower()] = q
+	return qvalues
+
+
+def accepts_gzip(request: HttpRequest) -> bool:
+	"""
+	依 RFC 9110 判斷是否接受 gzip：``gzip;q=0`` 表示拒絕；
+	沒有列出 gzip 時才看 ``*`` 的 q 值。
+	"""
+	qvalues = _encoding_qvalues(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+	for coding in ("gzip", "x-gzip"):
+		if coding in qvalues:
+			return qvalues[coding] > 0
+	return qvalues.get("*", 0) > 0
+
+
+def encoded_json_response(request: HttpRequest, body: dict[str, bytes | None], status: int = 200) -> HttpResponse:
+	"""依 Accept-Encoding 回傳 gzip 或原始 bytes，不做任何重新編碼。"""
+	if body.get("gzip") and accepts_gzip(request):
+		response = HttpResponse(body["gzip"], content_type="application/json", status=status)
+		response["Content-Encoding"] = "gzip"
+	else:
+		response = HttpResponse(body["raw"], content_type="application/json", status=status)
+	if body.get("gzip"):
+		patch_vary_headers(response, ("Accept-Encoding",))
+	return response
+
+
+def cached_json_response(
+	request: HttpRequest,
+	key: str,
+	builder: Callable[[], Any],
+	soft_ttl: float,
+	hard_ttl: float | None = None,
+) -> HttpResponse:
+	"""以 ``get_or_rebuild`` 快取 builder 結果的編碼後 bytes 並回傳。"""
+	body = get_or_rebuild(key, lambda: encode_body(builder()), soft_ttl=soft_ttl, hard_ttl=hard_ttl)
+	return encoded_json_response(request, body)
@@ -0,0 +1,125 @@
+"""
+對執行中的 ASGI 伺服器（daphne）做 HTTP 負載測試：持續請求下的 req/s 與尾端延遲。
+
+使用方式：
+    daphne -b 127.0.0.1 -p 8000 config.asgi:application
+    python manage.py benchmark_asgi --url http://127.0.0.1:8000/api/vehicles/ --concurrency 32 --duration 15
+
+    # 需要登入的端點：帶入瀏覽器中的 sessionid
+    python manage.py benchmark_asgi --url http://127.0.0.1:8000/api/export/status/abc/ --cookie sessionid=...
+
+每個並發連線使用 HTTP/1.1 keep-alive 連續送出 GET，只依賴標準庫 asyncio。
+"""
+
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "以固定並發數持續請求 ASGI 伺服器，量測吞吐量與延遲分佈"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", required=True, help="要測試的完整網址（僅支援 http）")
+        parser.add_argument("--concurrency", type=int, default=32, help="並發連線數（預設 32）")
+        parser.add_argument("--duration", type=float, default=15, help="持續秒數（預設 15）")
+        parser.add_argument("--warmup", type=float, default=2, help="暖身秒數，不列入統計（預設 2）")
+        parser.add_argument("--cookie", default="", help="附加的 Cookie 標頭")
+
+    def handle(self, *args, **options):
+        parts = urlsplit(options["url"])
+        if parts.scheme != "http":
+            raise CommandError("只支援 http:// 網址")
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "Accept-Encoding: gzip\r\n"
+            "Connection: keep-alive\r\n"
+            + (f"Cookie: {options['cookie']}\r\n" if options["cookie"] else "")
+            + "\r\n"
+        ).encode("latin-1")
+
+        stats = asyncio.run(
+            self._run(
+                parts.hostname,
+                parts.port or 80,
+                request,
+                options["concurrency"],
+                options["warmup"],
+                options["duration"],
+            )
+        )
+
+        latencies = sorted(stats["latencies"])
+        if not latencies:
+            raise CommandError(f"沒有成功的請求（錯誤 {stats['errors']} 次）")
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(f"URL：{options['url']}")
+        self.stdout.write(f"並發：{options['concurrency']}，量測 {options['duration']}s")
+        self.stdout.write(f"請求：{len(latencies)}，錯誤：{stats['errors']}，狀態碼：{stats['statuses']}")
+        self.stdout.write(f"吞吐量：{len(latencies) / options['duration']:.1f} req/s")
+        self.stdout.write(
+            "延遲（ms）：p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+                quantiles[49], quantiles[89], quantiles[98], latencies[-1]
+            )
+        )
+
+    async def _run(self, host, port, request, concurrency, warmup, duration):
+        stats = {"latencies": [], "errors": 0, "statuses": {}}
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+        await asyncio.gather(
+            *(self._worker(host, port, request, measure_from, deadline, stats) for _ in range(concurrency))
+        )
+        return stats
+
+    async def _worker(self, host, port, request, measure_from, deadline, stats):
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                sent = time.perf_counter()
+                writer.write(request)
+                status, keep_alive = await self._read_response(reader)
+                elapsed = (time.perf_counter() - sent) * 1000
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                stats["errors"] += 1
+                writer = None
+                await asyncio.sleep(0.01)
+                continue
+            if sent >= measure_from:
+                stats["latencies"].append(elapsed)
+                stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    async def _read_response(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).strip().split(b";")[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers.get("connection", "").lower() != "close"
@@ -0,0 +1,130 @@
+"""
+分片平行匯出效能量測：比較不同 worker 數的耗時與加速比。
+
+使用方式：
+    python manage.py benchmark_export --rows 200000
+    python manage.py benchmark_export --rows 1000000 --workers 1 2 4 8
+
+注意：
+    會在目前設定的資料庫中建立合成資料（品牌為 __bench__），結束後自動刪除；
+    請勿在正式環境執行。加上 --keep 可保留資料重複量測。
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.motry.models import FavoriteVehicle, Like, Post, Rating, UserVehicle, Vehicle
+from apps.motry.signals import muted_signals
+from apps.motry.sharded_export import run_sharded_export
+
+BENCH_BRAND = "__bench__"
+BENCH_USERNAME = "__bench__"
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "以合成資料量測分片平行匯出在不同核心數下的加速比"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=200000,
+            help="合成車款筆數（每台車另建立 1 篇貼文與 1 筆評分，預設 200000）",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            nargs="+",
+            help="要量測的 worker 數，預設為 1 2 4 ... 直到 CPU 核心數",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="量測後保留合成資料",
+        )
+
+    def handle(self, *args, **options):
+        cpu_count = os.cpu_count() or 1
+        workers_list = options.get("workers") or self._default_workers(cpu_count)
+
+        user = self._ensure_synthetic_data(options["rows"])
+        self.stdout.write(f"CPU 核心數：{cpu_count}")
+
+        results = []
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for workers in workers_list:
+                    zip_path = Path(tmpdir) / f"bench_w{workers}.zip"
+                    result = run_sharded_export(zip_path, workers=workers)
+                    results.append(result)
+                    zip_path.unlink(missing_ok=True)
+        finally:
+            if not options["keep"]:
+                self._cleanup(user)
+
+        baseline = results[0]["elapsed_sec"] if results else 0
+        self.stdout.write("")
+        self.stdout.write(f"{'workers':>8} {'shards':>7} {'rows':>10} {'sec':>9} {'rows/s':>12} {'speedup':>8}")
+        for result in results:
+            speedup = baseline / result["elapsed_sec"] if result["elapsed_sec"] else 0
+            self.stdout.write(
+                f"{result['workers']:>8} {result['shards']:>7} {result['total_rows']:>10} "
+                f"{result['elapsed_sec']:>9.2f} {result['rows_per_sec'] or 0:>12.0f} {speedup:>7.2f}x"
+            )
+
+    def _default_workers(self, cpu_count: int) -> list[int]:
+        workers = [1]
+        while workers[-1] * 2 <= cpu_count:
+            workers.append(workers[-1] * 2)
+        if workers[-1] != cpu_count:
+            workers.append(cpu_count)
+        return workers
+
+    def _ensure_synthetic_data(self, rows: int):
+        user, _ = get_user_model().objects.get_or_create(username=BENCH_USERNAME)
+        existing = Vehicle.objects.filter(brand=BENCH_BRAND).count()
+        if existing >= rows:
+            self.stdout.write(f"沿用既有合成資料：{existing} 台車")
+            return user
+
+        self.stdout.write(f"建立合成資料：{rows - existing} 台車 ...")
+        started = time.perf_counter()
+        for offset in range(existing, rows, BATCH_SIZE):
+            size = min(BATCH_SIZE, rows - offset)
+            vehicles = Vehicle.objects.bulk_create(
+                [
+                    Vehicle(
+                        brand=BENCH_BRAND,
+                        model=f"Model {offset + i}",
+                        displacement_cc=125 + (offset + i) % 1200,
+                        horsepower_ps=10 + (offset + i) % 200,
+                        cylinders=1 + (offset + i) % 4,
+                        years_from=2000 + (offset + i) % 25,
+                    )
+                    for i in range(size)
+                ]
+            )
+            # SQLite 等資料庫的 bulk_create 可能不回傳 pk，改以查詢取得本批車輛
+            if vehicles and vehicles[0].pk is None:
+                vehicles = list(Vehicle.objects.filter(brand=BENCH_BRAND).order_by("-id")[:size])
+            Post.objects.bulk_create(
+                [Post(vehicle=v, user=user, body_text=f"Synthetic post for {v.model}") for v in vehicles]
+            )
+            Rating.objects.bulk_create(
+                [Rating(vehicle=v, user=user, score=1 + v.pk % 5) for v in vehicles]
+            )
+        self.stdout.write(f"合成資料建立完成（{time.perf_counter() - started:.1f}s）")
+        return user
+
+    def _cleanup(self, user):
+        self.stdout.write("清除合成資料 ...")
+        # 不逐筆寫墓碑與排相似車款重算（見 muted_signals）
+        with muted_signals(Vehicle, Rating, Like, FavoriteVehicle, UserVehicle):
+            Vehicle.objects.filter(brand=BENCH_BRAND).delete()
+            user.delete()
@@ -0,0 +1,137 @@
+"""
+即時通知 fan-out 量測：全域 group 廣播 vs. 依車輛 / 使用者 group 推送。
+
+使用方式：
+    python manage.py benchmark_fanout --clients 5000 --posts 200
+    python manage.py benchmark_fanout --clients 10000 --vehicles 1000 --subscriptions 3
+
+在 InMemoryChannelLayer（略過過期清理，見 ``BenchChannelLayer``）上模擬大量連線
+（每條連線一個 channel 與一個接收 coroutine），不需要資料庫與 Redis。每個模擬使用者依熱門度（Zipf 分佈）收藏數台車，
+新貼文的車輛也依同一分佈抽樣；「有效訊息」為收到的貼文屬於自己收藏車輛的比例。
+"""
+
+import asyncio
+import random
+import statistics
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from apps.motry.notifications import NOTIFICATION_EVENT_TYPE, user_group, vehicle_group
+
+LEGACY_GROUP = "motry_notifications"
+
+
+class BenchChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer 每次 send / receive 都會掃描全部 channel 與 group 清除過期訊息（O(連線數)），
+    數千條連線時這項成本會蓋過要比較的 fan-out 本身；量測期間訊息不會過期，故略過。
+    """
+
+    def _clean_expired(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = "模擬大量 WebSocket 連線，比較全域廣播與分眾 group 的推送成本"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=5000, help="模擬連線數（預設 5000）")
+        parser.add_argument("--vehicles", type=int, default=500, help="車款數（預設 500）")
+        parser.add_argument("--subscriptions", type=int, default=5, help="每位使用者收藏車款數（預設 5）")
+        parser.add_argument("--posts", type=int, default=200, help="新貼文數（預設 200）")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vehicle_ids = list(range(1, options["vehicles"] + 1))
+        weights = [1 / rank for rank in vehicle_ids]
+        subscriptions = [
+            set(rng.choices(vehicle_ids, weights=weights, k=options["subscriptions"]))
+            for _ in range(options["clients"])
+        ]
+        posts = rng.choices(vehicle_ids, weights=weights, k=options["posts"])
+
+        self.stdout.write(
+            f"連線：{options['clients']}，車款：{options['vehicles']}，"
+            f"每人收藏：{options['subscriptions']}，貼文：{options['posts']}"
+        )
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'mode':<10} {'join s':>8} {'publish s':>10} {'send p50 ms':>12} {'send p99 ms':>12} "
+            f"{'delivered':>10} {'useful %':>9} {'drain s':>8}"
+        )
+        for mode in ("broadcast", "targeted"):
+            result = asyncio.run(self._run(mode, subscriptions, posts))
+            self.stdout.write(
+                f"{mode:<10} {result['join']:>8.2f} {result['publish']:>10.2f} {result['p50']:>12.2f} "
+                f"{result['p99']:>12.2f} {result['delivered']:>10} {result['useful']:>9.1f} {result['drain']:>8.2f}"
+            )
+
+    async def _run(self, mode, subscriptions, posts):
+        layer = BenchChannelLayer(expiry=600, capacity=len(posts) + 10)
+        channels = [await layer.new_channel() for _ in subscriptions]
+        members = {}
+
+        started = time.perf_counter()
+        for user_id, (channel, vehicles) in enumerate(zip(channels, subscriptions), start=1):
+            groups = [LEGACY_GROUP] if mode == "broadcast" else [user_group(user_id)]
+            if mode == "targeted":
+                groups += [vehicle_group(vehicle_id) for vehicle_id in vehicles]
+            for group in groups:
+                await layer.group_add(group, channel)
+                members[group] = members.get(group, 0) + 1
+        join_seconds = time.perf_counter() - started
+
+        targets = [LEGACY_GROUP if mode == "broadcast" else vehicle_group(vehicle_id) for vehicle_id in posts]
+        expected = sum(members.get(group, 0) for group in targets)
+        stats = {"received": 0, "useful": 0}
+        done = asyncio.Event()
+
+        async def receive(channel, vehicles):
+            while True:
+                message = await layer.receive(channel)
+                stats["received"] += 1
+                if message["vehicle"]["id"] in vehicles:
+                    stats["useful"] += 1
+                if stats["received"] >= expected:
+                    done.set()
+
+        receivers = [asyncio.create_task(receive(channel, vehicles)) for channel, vehicles in zip(channels, subscriptions)]
+        await asyncio.sleep(0)
+
+        send_ms = []
+        started = time.perf_counter()
+        for post_id, (group, vehicle_id) in enumerate(zip(targets, posts), start=1):
+            sent = time.perf_counter()
+            await layer.group_send(
+                group,
+                {
+                    "type": NOTIFICATION_EVENT_TYPE,
+                    "kind": "new_post",
+                    "post_id": post_id,
+                    "title": f"post {post_id}",
+                    "vehicle": {"id": vehicle_id, "name": f"vehicle {vehicle_id}"},
+                },
+            )
+            send_ms.append((time.perf_counter() - sent) * 1000)
+        publish_seconds = time.perf_counter() - started
+        if expected:
+            await asyncio.wait_for(done.wait(), timeout=600)
+        drain_seconds = time.perf_counter() - started
+
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+
+        quantiles = statistics.quantiles(send_ms, n=100) if len(send_ms) >= 2 else send_ms * 99
+        return {
+            "join": join_seconds,
+            "publish": publish_seconds,
+            "p50": quantiles[49],
+            "p99": quantiles[98],
+            "delivered": stats["received"],
+            "useful": stats["useful"] * 100 / stats["received"] if stats["received"] else 0.0,
+            "drain": drain_seconds,
+        }
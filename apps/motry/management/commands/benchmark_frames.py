@@ -0,0 +1,91 @@
+"""
+通知 WebSocket frame 編碼量測：JSON vs. msgpack（短鍵）vs. msgpack + deflate。
+
+使用方式：
+    python manage.py benchmark_frames
+    python manage.py benchmark_frames --clients 5000 --batch-sizes 1 5 20
+
+每條連線各自編碼自己的 frame，廣播一則事件給 N 條連線時編碼 CPU 為單次成本 × N；
+輸出每則事件的平均位元組數、單一 frame 的編碼時間，以及推給 --clients 條連線的總編碼 CPU。
+事件內容為合成資料（車名、中文標題、event id），不需要資料庫。
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.motry.frames import (
+    MSGPACK_DEFLATE_SUBPROTOCOL,
+    MSGPACK_SUBPROTOCOL,
+    decode_frame,
+    encode_frame,
+    msgpack,
+)
+
+CODECS = [("json", None), ("msgpack", MSGPACK_SUBPROTOCOL), ("msgpack+deflate", MSGPACK_DEFLATE_SUBPROTOCOL)]
+VEHICLES = ["Yamaha MT-07", "Honda CB650R", "Kawasaki Z900", "Suzuki SV650", "BMW R 1250 GS", "Ducati Monster"]
+TITLES = ["通勤三個月心得", "第一次上山跑山路", "換了排氣管的聲浪", "保養費用整理", "新手選車求建議"]
+
+
+class Command(BaseCommand):
+    help = "量測通知 frame 在 JSON / msgpack / msgpack+deflate 下的大小與編碼 CPU"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 5, 20], help="每個 frame 的事件數")
+        parser.add_argument("--clients", type=int, default=5000, help="廣播的連線數（預設 5000）")
+        parser.add_argument("--repeat", type=int, default=20000, help="每組編碼次數（預設 20000）")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError("未安裝 msgpack")
+        rng = random.Random(options["seed"])
+        self.stdout.write(f"廣播連線數：{options['clients']}，每組編碼 {options['repeat']} 次")
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'events':>6} {'codec':<16} {'bytes/frame':>11} {'bytes/event':>11} {'vs json':>8} "
+            f"{'encode us':>10} {'us/event':>9} {'broadcast CPU ms':>17}"
+        )
+        for size in options["batch_sizes"]:
+            frame = self._frame(rng, size)
+            json_bytes = None
+            for name, subprotocol in CODECS:
+                data = encode_frame(frame, subprotocol)
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                # 確認可還原，避免量到錯誤的編碼
+                decoded = decode_frame(data, subprotocol)
+                assert len(decoded.get("events", [decoded])) == size
+
+                json_bytes = json_bytes or len(data)
+                started = time.process_time()
+                for _ in range(options["repeat"]):
+                    encode_frame(frame, subprotocol)
+                encode_us = (time.process_time() - started) / options["repeat"] * 1e6
+                self.stdout.write(
+                    f"{size:>6} {name:<16} {len(data):>11} {len(data) / size:>11.1f} "
+                    f"{len(data) / json_bytes:>7.0%} {encode_us:>10.1f} {encode_us / size:>9.2f} "
+                    f"{encode_us * options['clients'] / 1000:>17.1f}"
+                )
+
+    def _frame(self, rng, size):
+        events = []
+        for index in range(size):
+            kind = rng.choice(["new_post", "new_comment", "new_like"])
+            vehicle_id = rng.randint(1, len(VEHICLES))
+            post_id = rng.randint(1000, 99999)
+            event = {
+                "type": kind,
+                "event_id": f"{1760000000000 + index * 37}-{index % 3}",
+                "post_id": post_id,
+                "title": f"Post {post_id} on {VEHICLES[vehicle_id - 1]}：{rng.choice(TITLES)}",
+                "vehicle": {"id": vehicle_id, "name": VEHICLES[vehicle_id - 1]},
+                "actor": None if kind == "new_post" else f"rider{rng.randint(1, 500)}",
+            }
+            if kind != "new_post" and rng.random() < 0.3:
+                event["count"] = rng.randint(2, 5)
+            events.append(event)
+        if size == 1:
+            return events[0]
+        return {"type": "batch", "events": events}
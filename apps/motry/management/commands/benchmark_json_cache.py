@@ -0,0 +1,115 @@
+"""
+車輛清單 API 快取命中路徑效能量測：快取 dict + JsonResponse vs. 快取編碼後 bytes。
+
+使用方式：
+    python manage.py benchmark_json_cache --rows 5000
+    python manage.py benchmark_json_cache --rows 20000 --iterations 500
+
+注意：
+    會在目前設定的資料庫中建立合成資料（品牌為 __bench__），結束後自動刪除；
+    請勿在正式環境執行。加上 --keep 可保留資料重複量測。
+    量測使用目前設定的快取後端（正式環境為 Redis，USE_REDIS=0 時為 locmem）。
+"""
+
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from apps.motry import json_response
+from apps.motry.models import FavoriteVehicle, Like, Rating, UserVehicle, Vehicle
+from apps.motry.signals import muted_signals
+from apps.motry.vehicle_list import DEFAULT_VEHICLE_LIST_FIELDS
+
+BENCH_BRAND = "__bench__"
+BATCH_SIZE = 5000
+LEGACY_KEY = "bench:vehicle_list:dict"
+BYTES_KEY = "bench:vehicle_list:body"
+
+
+class Command(BaseCommand):
+    help = "量測車輛清單 API 快取命中時的延遲與 CPU 時間（dict 快取 vs. bytes 快取）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="合成車款筆數（預設 5000）")
+        parser.add_argument("--iterations", type=int, default=200, help="每種方式的量測次數（預設 200）")
+        parser.add_argument("--keep", action="store_true", help="量測後保留合成資料")
+
+    def handle(self, *args, **options):
+        self._ensure_synthetic_data(options["rows"])
+        factory = RequestFactory()
+        plain_request = factory.get("/api/vehicles/")
+        gzip_request = factory.get("/api/vehicles/", HTTP_ACCEPT_ENCODING="gzip")
+
+        try:
+            # 以整份目錄作為單一回應，放大序列化成本的差異
+            vehicles = Vehicle.objects.order_by("brand", "model", "id").values(*DEFAULT_VEHICLE_LIST_FIELDS)
+            payload = {"success": True, "data": {"vehicles": list(vehicles)}}
+            cache.set(LEGACY_KEY, payload, 300)
+            cache.set(BYTES_KEY, json_response.encode_body(payload), 300)
+
+            cases = [
+                ("dict + JsonResponse", self._legacy_hit),
+                ("bytes (raw)", lambda: self._bytes_hit(plain_request)),
+                ("bytes (gzip)", lambda: self._bytes_hit(gzip_request)),
+            ]
+            results = [(name, *self._measure(func, options["iterations"])) for name, func in cases]
+        finally:
+            cache.delete_many([LEGACY_KEY, BYTES_KEY])
+            if not options["keep"]:
+                self._cleanup()
+
+        serializer = "orjson" if json_response.orjson is not None else "json (stdlib)"
+        self.stdout.write(f"車款筆數：{len(payload['data']['vehicles'])}，序列化：{serializer}")
+        self.stdout.write("")
+        self.stdout.write(f"{'path':<22} {'p50 ms':>9} {'p95 ms':>9} {'cpu ms':>9} {'bytes':>10}")
+        for name, p50, p95, cpu, size in results:
+            self.stdout.write(f"{name:<22} {p50:>9.3f} {p95:>9.3f} {cpu:>9.3f} {size:>10}")
+
+    def _legacy_hit(self):
+        return JsonResponse(cache.get(LEGACY_KEY))
+
+    def _bytes_hit(self, request):
+        return json_response.encoded_json_response(request, cache.get(BYTES_KEY))
+
+    def _measure(self, func, iterations):
+        func()  # 暖身
+        wall = []
+        cpu_started = time.process_time()
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = func()
+            wall.append((time.perf_counter() - started) * 1000)
+        cpu_ms = (time.process_time() - cpu_started) * 1000 / iterations
+        p95 = statistics.quantiles(wall, n=20)[-1] if len(wall) >= 2 else wall[0]
+        return statistics.median(wall), p95, cpu_ms, len(response.content)
+
+    def _ensure_synthetic_data(self, rows: int):
+        existing = Vehicle.objects.filter(brand=BENCH_BRAND).count()
+        if existing >= rows:
+            self.stdout.write(f"沿用既有合成資料：{existing} 台車")
+            return
+        self.stdout.write(f"建立合成資料：{rows - existing} 台車 ...")
+        for offset in range(existing, rows, BATCH_SIZE):
+            size = min(BATCH_SIZE, rows - offset)
+            Vehicle.objects.bulk_create(
+                [
+                    Vehicle(
+                        brand=BENCH_BRAND,
+                        model=f"Model {offset + i}",
+                        displacement_cc=125 + (offset + i) % 1200,
+                        horsepower_ps=10 + (offset + i) % 200,
+                        cylinders=1 + (offset + i) % 4,
+                    )
+                    for i in range(size)
+                ]
+            )
+
+    def _cleanup(self):
+        self.stdout.write("清除合成資料 ...")
+        # 不逐筆寫墓碑與排相似車款重算（見 muted_signals）
+        with muted_signals(Vehicle, Rating, Like, FavoriteVehicle, UserVehicle):
+            Vehicle.objects.filter(brand=BENCH_BRAND).delete()
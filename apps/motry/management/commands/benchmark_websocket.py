@@ -0,0 +1,242 @@
+"""
+通知 WebSocket 負載測試：單一行程能撐住多少條連線，以及新貼文推播的送達延遲。
+
+使用方式：
+    python manage.py benchmark_websocket --clients 1000 --posts 50 --rate 5
+    python manage.py benchmark_websocket --layer redis --clients 2000 --batch-window 0
+    python manage.py benchmark_websocket --layer both --cleanup
+
+在同一行程內啟動 ``config.asgi:application``（含 ``AuthMiddlewareStack``），以
+``channels.testing.WebsocketCommunicator`` 開啟 N 條帶 session cookie 的已登入連線，
+每條連線送出 ``{"action": "watch"}`` 加入同一台車的 group；接著以固定速率呼叫
+``publish_new_post``（與 ``fanout_new_post`` 任務相同的推播路徑，含事件紀錄寫入），量測：
+
+- 送達延遲：publish 呼叫開始到 client 收到該貼文的時間（含 consumer 的批次視窗，
+  可用 ``--batch-window 0`` 排除）
+- 每條連線記憶體：連線建立前後 tracemalloc 的差值 / 連線數
+- 遺失：應送達數 - 實際送達數，以及 consumer 佇列溢出丟棄數
+
+不經過真實 socket 與 daphne 的 HTTP/WebSocket 解析，數字為 consumer + channel layer 的上限。
+測試使用者（``wsbench_<n>``）保留供下次重用，``--cleanup`` 時刪除；貼文與車輛不寫入 DB。
+"""
+
+import asyncio
+import json
+import resource
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from apps.motry.consumers import NotificationConsumer, notification_connection_metrics
+from apps.motry.models import Post, Vehicle
+from apps.motry.notifications import publish_new_post
+
+USER_PREFIX = "wsbench_"
+BENCH_VEHICLE_ID = 10_000_000  # 不對應真實車輛，只用於 group 名稱
+LAYERS = {
+    "memory": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    "redis": {"BACKEND": "channels_redis.core.RedisChannelLayer"},
+}
+
+
+class Command(BaseCommand):
+    help = "在行程內開啟大量已登入的通知 WebSocket，量測推播延遲、每連線記憶體與遺失數"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=500, help="連線數（預設 500）")
+        parser.add_argument("--posts", type=int, default=50, help="推播貼文數（預設 50）")
+        parser.add_argument("--rate", type=float, default=5, help="每秒推播貼文數（預設 5）")
+        parser.add_argument("--layer", choices=["memory", "redis", "both"], default="memory")
+        parser.add_argument("--redis-url", default=settings.REDIS_URI, help="Redis channel layer 位址")
+        parser.add_argument(
+            "--batch-window",
+            type=float,
+            default=None,
+            help=f"覆寫 consumer 批次視窗秒數（預設沿用 {NotificationConsumer.batch_window}）",
+        )
+        parser.add_argument("--connect-concurrency", type=int, default=100, help="同時建立的連線數（預設 100）")
+        parser.add_argument("--drain-timeout", type=float, default=30, help="推播結束後等待送達的秒數（預設 30）")
+        parser.add_argument("--cleanup", action="store_true", help="結束後刪除測試使用者")
+
+    def handle(self, *args, **options):
+        if options["clients"] < 1 or options["posts"] < 1 or options["rate"] <= 0:
+            raise CommandError("--clients、--posts 需為正整數，--rate 需大於 0")
+        layers = ["memory", "redis"] if options["layer"] == "both" else [options["layer"]]
+        if "redis" in layers:
+            self._check_redis(options["redis_url"])
+
+        users = self._ensure_users(options["clients"])
+        session_keys = self._create_sessions(users)
+        self.stdout.write(
+            f"連線：{options['clients']}，貼文：{options['posts']}（{options['rate']}/s），"
+            f"批次視窗：{self._batch_window(options)}s"
+        )
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'layer':<7} {'connect s':>9} {'KiB/conn':>9} {'RSS MiB':>8} {'p50 ms':>8} {'p90 ms':>8} "
+            f"{'p99 ms':>8} {'max ms':>8} {'delivered':>10} {'lost':>6} {'q-drop':>7} {'frames':>7}"
+        )
+        try:
+            for name in layers:
+                config = dict(LAYERS[name])
+                if name == "redis":
+                    config["CONFIG"] = {"hosts": [options["redis_url"]]}
+                with override_settings(CHANNEL_LAYERS={"default": config}):
+                    result = asyncio.run(self._run(session_keys, options))
+                self.stdout.write(
+                    f"{name:<7} {result['connect']:>9.2f} {result['kib_per_conn']:>9.1f} {result['rss_mib']:>8.1f} "
+                    f"{result['p50']:>8.1f} {result['p90']:>8.1f} {result['p99']:>8.1f} {result['max']:>8.1f} "
+                    f"{result['delivered']:>10} {result['lost']:>6} {result['queue_dropped']:>7} {result['frames']:>7}"
+                )
+        finally:
+            SessionStore.get_model_class().objects.filter(session_key__in=session_keys).delete()
+            if options["cleanup"]:
+                get_user_model().objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def _batch_window(self, options):
+        window = options["batch_window"]
+        return NotificationConsumer.batch_window if window is None else window
+
+    def _check_redis(self, url):
+        import redis
+
+        try:
+            redis.Redis.from_url(url, socket_connect_timeout=2).ping()
+        except redis.RedisError as e:
+            raise CommandError(f"無法連線 Redis（{url}）：{e}")
+
+    def _ensure_users(self, count):
+        User = get_user_model()
+        names = [f"{USER_PREFIX}{index}" for index in range(count)]
+        existing = set(User.objects.filter(username__in=names).values_list("username", flat=True))
+        missing = []
+        for name in names:
+            if name not in existing:
+                user = User(username=name)
+                user.set_unusable_password()
+                missing.append(user)
+        User.objects.bulk_create(missing, batch_size=1000)
+        return list(User.objects.filter(username__in=names).order_by("id"))
+
+    def _create_sessions(self, users):
+        # 與 django.contrib.auth.login 寫入相同的 session 欄位，連線經 AuthMiddlewareStack 驗證
+        backend = settings.AUTHENTICATION_BACKENDS[0]
+        keys = []
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = backend
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            keys.append(session.session_key)
+        return keys
+
+    async def _run(self, session_keys, options):
+        from config.asgi import application
+
+        window = self._batch_window(options)
+        original_window = NotificationConsumer.batch_window
+        NotificationConsumer.batch_window = window
+        try:
+            return await self._measure(application, session_keys, options)
+        finally:
+            NotificationConsumer.batch_window = original_window
+
+    async def _measure(self, application, session_keys, options):
+        cookie_name = settings.SESSION_COOKIE_NAME
+        semaphore = asyncio.Semaphore(options["connect_concurrency"])
+
+        async def open_client(session_key):
+            async with semaphore:
+                communicator = WebsocketCommunicator(
+                    application,
+                    "/ws/motry/notifications/",
+                    headers=[(b"cookie", f"{cookie_name}={session_key}".encode())],
+                )
+                connected, _ = await communicator.connect(timeout=30)
+                if not connected:
+                    raise CommandError("WebSocket 連線被拒絕（session 驗證失敗？）")
+                await communicator.send_json_to({"action": "watch", "vehicle_id": BENCH_VEHICLE_ID})
+                return communicator
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        clients = await asyncio.gather(*(open_client(key) for key in session_keys))
+        # watch 訊息需由 consumer 處理完（加入車輛 group）才開始推播
+        await asyncio.sleep(0.5)
+        connect_seconds = time.perf_counter() - started
+        traced_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        sent_at = {}
+        latencies = []
+        expected = len(clients) * options["posts"]
+        done = asyncio.Event()
+        stats = {"frames": 0}
+
+        def record(event):
+            if event.get("type") == "new_post" and event.get("post_id") in sent_at:
+                latencies.append((time.perf_counter() - sent_at[event["post_id"]]) * 1000)
+                if len(latencies) >= expected:
+                    done.set()
+
+        async def receive(communicator):
+            while True:
+                message = json.loads(await communicator.receive_from(timeout=3600))
+                stats["frames"] += 1
+                for event in message.get("events", [message]) if message.get("type") == "batch" else [message]:
+                    record(event)
+
+        receivers = [asyncio.create_task(receive(communicator)) for communicator in clients]
+        vehicle = Vehicle(id=BENCH_VEHICLE_ID, brand="Bench", model="WebSocket")
+        interval = 1 / options["rate"]
+        publish_started = time.perf_counter()
+        for index in range(1, options["posts"] + 1):
+            post = Post(id=-index, vehicle=vehicle, user_id=None, body_text="benchmark")
+            sent_at[post.id] = time.perf_counter()
+            await sync_to_async(publish_new_post)(post)
+            delay = publish_started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=options["drain_timeout"])
+        except asyncio.TimeoutError:
+            pass
+
+        metrics = notification_connection_metrics()
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        await asyncio.gather(*(communicator.disconnect() for communicator in clients), return_exceptions=True)
+        layer = get_channel_layer()
+        if hasattr(layer, "close_pools"):
+            await layer.close_pools()
+
+        ordered = sorted(latencies) or [0.0]
+        quantiles = statistics.quantiles(ordered, n=100) if len(ordered) >= 2 else ordered * 99
+        return {
+            "connect": connect_seconds,
+            "kib_per_conn": (traced_after - traced_before) / len(clients) / 1024,
+            # ru_maxrss 在 Linux 為 KiB；只反映峰值增加量
+            "rss_mib": (rss_after - rss_before) / 1024,
+            "p50": quantiles[49],
+            "p90": quantiles[89],
+            "p99": quantiles[98],
+            "max": ordered[-1],
+            "delivered": len(latencies),
+            "lost": expected - len(latencies),
+            "queue_dropped": metrics["dropped"],
+            "frames": stats["frames"],
+        }
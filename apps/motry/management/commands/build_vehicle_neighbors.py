@@ -0,0 +1,65 @@
+"""
+重算規格相似車款（``VehicleNeighbor``）。
+
+使用方式：
+    python manage.py build_vehicle_neighbors                  # 全量重算並寫入 DB
+    python manage.py build_vehicle_neighbors --synthetic 50000  # 只量測計算時間（合成資料，不寫入）
+
+平時車款規格變更後由 ``refresh_pending_vehicle_neighbors`` 合併增量更新，``refresh_vehicle_neighbors`` 每日全量重算；
+此指令用於初次部署或調整特徵權重後立即重建。
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.motry.similarity import SIMILAR_TOP_K, build_spec_matrix, rebuild_neighbors, top_neighbors
+
+
+class Command(BaseCommand):
+    help = "重算每台車的規格相似車款"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=SIMILAR_TOP_K, help=f"每台車保留的鄰居數（預設 {SIMILAR_TOP_K}）")
+        parser.add_argument("--synthetic", type=int, default=0, help="以 N 筆合成車款量測計算時間，不讀寫 DB")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options["synthetic"]:
+            self._benchmark(options["synthetic"], options["k"], options["seed"])
+            return
+        result = rebuild_neighbors(options["k"])
+        self.stdout.write(
+            self.style.SUCCESS(f"已重算 {result['vehicles']} 台車、{result['rows']} 筆鄰居（{result['seconds']}s）")
+        )
+
+    def _benchmark(self, count, k, seed):
+        rng = random.Random(seed)
+        rows = []
+        for vehicle_id in range(1, count + 1):
+            displacement = rng.choice([None, 125, 300, 400, 650, 900, 1000, 1250])
+            year = rng.randint(2005, 2025)
+            rows.append(
+                {
+                    "id": vehicle_id,
+                    "displacement_cc": displacement,
+                    "horsepower_ps": int((displacement or 400) * rng.uniform(0.08, 0.2)),
+                    "cylinders": rng.choice([None, 1, 2, 3, 4]),
+                    "years_from": year,
+                    "years_to": year + rng.randint(0, 5) if rng.random() < 0.5 else None,
+                    "msrp_new": rng.randint(80, 1500) * 1000 if rng.random() < 0.7 else None,
+                    "used_price_min": None,
+                    "used_price_max": None,
+                    "intro_md": f"重量：{rng.randint(110, 260)} kg" if rng.random() < 0.5 else "",
+                }
+            )
+
+        started = time.perf_counter()
+        matrix = build_spec_matrix(rows)
+        built = time.perf_counter()
+        pairs = sum(len(items) for _, items in top_neighbors(matrix, range(len(matrix)), k))
+        finished = time.perf_counter()
+        self.stdout.write(f"車款：{count}，k={k}")
+        self.stdout.write(f"特徵矩陣：{built - started:.2f}s")
+        self.stdout.write(f"鄰居計算：{finished - built:.2f}s（{pairs} 筆，{count * count / (finished - built) / 1e6:.0f}M 距離/s）")
@@ -0,0 +1,305 @@
+"""
+使用者與車輛/貼文的關係（我的最愛、車庫、評分、按讚）批次查詢。
+
+搜尋結果與首頁卡片一次需要幾十到幾百台車的狀態，逐一查詢會變成 N 個請求、N 次查詢。
+``get_membership`` 一次回傳所有狀態：
+
+- 快取：每位使用者一份完整集合（最愛 / 車庫 / 評分 / 按讚），重複呼叫不查 DB；
+  對應資料表寫入時由 signal 刪除
+- 任一集合超過 MEMBERSHIP_CACHE_MAX_ITEMS 時不快取，改以 ``vehicle_id IN (...)`` 查詢
+
+``add_to_collection`` / ``remove_from_collection`` 為最愛、車庫的批次寫入，單筆 API 也走同一路徑，
+查詢次數與筆數無關；``a`` 開頭的版本供 async view 使用。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Mapping
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+
+from .caching import acache_delete
+from .models import FavoriteVehicle, Like, Rating, UserVehicle, Vehicle
+from .notifications import apublish_subscriptions_changed, publish_subscriptions_changed
+from .trending import TRENDING_VEHICLES, record_event_once
+
+MEMBERSHIP_MAX_IDS = 300
+MEMBERSHIP_CACHE_TTL = 60 * 10
+MEMBERSHIP_CACHE_MAX_ITEMS = 5000
+MEMBERSHIP_CACHE_KEY = "motry:membership:u{user_id}"
+
+_OVERSIZED = "oversized"
+
+
+class MembershipError(ValueError):
+	"""查詢參數錯誤（回傳 400）"""
+
+
+def parse_id_list(params: Mapping, name: str) -> list[int]:
+	"""解析 ``?name=1,2,3`` 或 ``?name=1&name=2``，去除重複並限制數量。"""
+	values = params.getlist(name) if hasattr(params, "getlist") else [params.get(name) or ""]
+	ids = []
+	for value in values:
+		for part in str(value).split(","):
+			part = part.strip()
+			if not part:
+				continue
+			try:
+				ids.append(int(part))
+			except ValueError:
+				raise MembershipError(f"{name} 必須為以逗號分隔的整數")
+	ids = list(dict.fromkeys(ids))
+	if len(ids) > MEMBERSHIP_MAX_IDS:
+		raise MembershipError(f"{name} 最多 {MEMBERSHIP_MAX_IDS} 筆")
+	return ids
+
+
+def _query_sets(user_id: int, vehicle_ids: Iterable[int] | None, post_ids: Iterable[int] | None, limit=None) -> dict:
+	"""vehicle_ids / post_ids 為 None 時查詢使用者的完整集合，否則以 IN 限定範圍。"""
+
+	def scoped(qs, field, ids):
+		qs = qs.filter(user_id=user_id).order_by()
+		if ids is not None:
+			qs = qs.filter(**{f"{field}__in": list(ids)})
+		return qs
+
+	def fetch(qs, *fields):
+		rows = qs.values_list(*fields)
+		return list(rows[:limit] if limit else rows)
+
+	favorites = fetch(scoped(FavoriteVehicle.objects, "vehicle_id", vehicle_ids), "vehicle_id")
+	garage = fetch(scoped(UserVehicle.objects, "vehicle_id", vehicle_ids), "vehicle_id", "created_at")
+	ratings = fetch(scoped(Rating.objects, "vehicle_id", vehicle_ids), "vehicle_id", "score")
+	likes = fetch(scoped(Like.objects, "post_id", post_ids), "post_id") if post_ids != [] else []
+	return {
+		"favorites": {vehicle_id for (vehicle_id,) in favorites},
+		"garage": dict(garage),
+		"ratings": dict(ratings),
+		"liked_posts": {post_id for (post_id,) in likes},
+	}
+
+
+def _cached_user_sets(user_id: int) -> dict | None:
+	key = MEMBERSHIP_CACHE_KEY.format(user_id=user_id)
+	sets = cache.get(key)
+	if sets == _OVERSIZED:
+		return None
+	if sets is not None:
+		return sets
+
+	sets = _query_sets(user_id, None, None, limit=MEMBERSHIP_CACHE_MAX_ITEMS + 1)
+	if any(len(values) > MEMBERSHIP_CACHE_MAX_ITEMS for values in sets.values()):
+		cache.set(key, _OVERSIZED, MEMBERSHIP_CACHE_TTL)
+		return None
+	cache.set(key, sets, MEMBERSHIP_CACHE_TTL)
+	return sets
+
+
+def get_membership(user_id: int, vehicle_ids: list[int], post_ids: list[int] | None = None) -> dict:
+	"""
+	回傳指定車輛 / 貼文中，使用者已加入最愛、車庫、評分、按讚的部分。
+
+	Returns:
+		{"favorites": set, "garage": {vehicle_id: 加入時間}, "ratings": {vehicle_id: 分數}, "liked_posts": set}
+	"""
+	post_ids = post_ids or []
+	sets = _cached_user_sets(user_id)
+	if sets is None:
+		return _query_sets(user_id, vehicle_ids, post_ids)
+
+	wanted_vehicles = set(vehicle_ids)
+	wanted_posts = set(post_ids)
+	return {
+		"favorites": sets["favorites"] & wanted_vehicles,
+		"garage": {vid: sets["garage"][vid] for vid in wanted_vehicles if vid in sets["garage"]},
+		"ratings": {vid: sets["ratings"][vid] for vid in wanted_vehicles if vid in sets["ratings"]},
+		"liked_posts": sets["liked_posts"] & wanted_posts,
+	}
+
+
+def subscribed_vehicle_ids(user_id: int) -> set[int]:
+	"""使用者加入最愛或車庫的所有車輛 id（即時通知訂閱用）。"""
+	sets = _cached_user_sets(user_id)
+	if sets is None:
+		favorites = FavoriteVehicle.objects.filter(user_id=user_id).values_list("vehicle_id", flat=True)
+		garage = UserVehicle.objects.filter(user_id=user_id).values_list("vehicle_id", flat=True)
+		return set(favorites.order_by()) | set(garage.order_by())
+	return sets["favorites"] | set(sets["garage"])
+
+
+def membership_as_json(membership: dict) -> dict:
+	return {
+		"favorites": sorted(membership["favorites"]),
+		"garage": sorted(membership["garage"]),
+		"ratings": {str(vehicle_id): score for vehicle_id, score in sorted(membership["ratings"].items())},
+		"liked_posts": sorted(membership["liked_posts"]),
+	}
+
+
+def invalidate_membership(user_id: int) -> None:
+	"""
+	刪除使用者的集合快取。
+
+	立即刪除一次，交易提交後再刪一次：避免提交前其他請求以舊資料重建快取。
+	"""
+	key = MEMBERSHIP_CACHE_KEY.format(user_id=user_id)
+	cache.delete(key)
+	transaction.on_commit(lambda: cache.delete(key))
+
+
+# ==========================================
+# 批次寫入：我的最愛 / 車庫
+# ==========================================
+
+def _record_favorite_heat(user_id: int, vehicle_ids: list[int]) -> None:
+	for vehicle_id in vehicle_ids:
+		record_event_once(TRENDING_VEHICLES, vehicle_id, "favorite", user_id, vehicle_id)
+
+
+def _collection_rows(user_id: int, model_class, vehicle_ids: list[int]):
+	# 一次查詢取得存在的車輛（車名）與使用者已收藏的項目
+	existing_item = model_class.objects.filter(user_id=user_id, vehicle_id=OuterRef("pk")).order_by().values("id")[:1]
+	return (
+		Vehicle.objects.filter(pk__in=vehicle_ids)
+		.order_by()
+		.annotate(existing_id=Subquery(existing_item))
+		.values("id", "brand", "model", "generation", "existing_id")
+	)
+
+
+def _split_rows(rows) -> tuple[dict, dict, list[int]]:
+	labels, existing, to_add = {}, {}, []
+	for row in rows:
+		labels[row["id"]] = str(Vehicle(brand=row["brand"], model=row["model"], generation=row["generation"]))
+		if row["existing_id"]:
+			existing[row["id"]] = row["existing_id"]
+		else:
+			to_add.append(row["id"])
+	return labels, existing, to_add
+
+
+def _new_items(user_id: int, model_class, vehicle_ids: list[int]) -> list:
+	return [model_class(user_id=user_id, vehicle_id=vehicle_id) for vehicle_id in vehicle_ids]
+
+
+# ON CONFLICT (user, vehicle) DO UPDATE（更新為相同值）配合 RETURNING：併發重複點擊由 unique 約束吸收，
+# 且不論新增或撞上剛被別人寫入的項目都會回傳主鍵；ignore_conflicts 則不會回傳主鍵
+_UPSERT_OPTIONS = {"update_conflicts": True, "unique_fields": ["user", "vehicle"], "update_fields": ["vehicle"]}
+
+
+def _result(vehicle_ids: list[int], labels: dict, existing: dict, added: dict) -> dict:
+	return {
+		"added": added,
+		"existing": existing,
+		"missing": [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in labels],
+		"labels": labels,
+	}
+
+
+def add_to_collection(user_id: int, model_class, vehicle_ids: list[int]) -> dict:
+	"""
+	把多台車加入使用者的最愛或車庫（model_class 為 FavoriteVehicle / UserVehicle），共兩次查詢：
+
+	1. 一次查詢取得存在的車輛（車名）與已收藏的項目（Subquery annotation）
+	2. 一次 ``INSERT ... ON CONFLICT DO UPDATE ... RETURNING id`` 寫入其餘項目並取回主鍵
+
+	不合併成一次：回應需要車名與「不存在的車輛」，而把 INSERT 與 SELECT 放進同一句需要
+	含資料修改的 CTE（SQLite 不支援）。
+
+	Returns:
+		{"added": {vehicle_id: item_id}, "existing": {vehicle_id: item_id},
+		 "missing": [vehicle_id], "labels": {vehicle_id: 車名}}
+	"""
+	labels, existing, to_add = _split_rows(_collection_rows(user_id, model_class, vehicle_ids))
+	added = {}
+	if to_add:
+		items = model_class.objects.bulk_create(_new_items(user_id, model_class, to_add), **_UPSERT_OPTIONS)
+		added = {item.vehicle_id: item.pk for item in items}
+		# bulk_create 不會觸發 signal，需自行清除快取、通知連線中的 consumer 並累加收藏熱度
+		invalidate_membership(user_id)
+		publish_subscriptions_changed(user_id)
+		if model_class is FavoriteVehicle:
+			transaction.on_commit(lambda: _record_favorite_heat(user_id, to_add), robust=True)
+	return _result(vehicle_ids, labels, existing, added)
+
+
+def _delete_items(items) -> int:
+	"""
+	以單一 ``DELETE ... WHERE`` 刪除，回傳刪除筆數。
+
+	不走 ``QuerySet.delete()``：這兩張表有 post_delete receiver，Collector 會先把每一列讀出、
+	逐筆送出 signal（每筆一次訂閱重整推播）。指向這些項目的 SET_NULL 外鍵（貼文的 user_vehicle）
+	改以一次 UPDATE 清空；快取與訂閱通知由呼叫端在刪除後各做一次。
+	"""
+	nullable = [relation for relation in items.model._meta.related_objects if relation.on_delete is models.SET_NULL]
+	if not nullable:
+		return items._raw_delete(items.db)
+	with transaction.atomic(using=items.db):
+		for relation in nullable:
+			field = relation.field.name
+			relation.related_model._base_manager.filter(**{f"{field}__in": items}).update(**{field: None})
+		return items._raw_delete(items.db)
+
+
+def remove_from_collection(user_id: int, model_class, vehicle_ids: list[int]) -> dict:
+	"""
+	把多台車自使用者的最愛或車庫移除：一次查詢取得車名，再以單一 ``DELETE ... WHERE vehicle_id IN``
+	刪除（見 ``_delete_items``）；有刪除時才清除快取並送出一次訂閱重整通知。
+
+	Returns:
+		{"removed": [vehicle_id], "missing": [vehicle_id], "labels": {vehicle_id: 車名}}
+	"""
+	items = model_class.objects.filter(user_id=user_id, vehicle_id__in=vehicle_ids)
+	rows = list(items.order_by().values_list("vehicle_id", "vehicle__brand", "vehicle__model", "vehicle__generation"))
+	labels = {
+		vehicle_id: str(Vehicle(brand=brand, model=model, generation=generation))
+		for vehicle_id, brand, model, generation in rows
+	}
+	if labels and _delete_items(items):
+		invalidate_membership(user_id)
+		publish_subscriptions_changed(user_id)
+	return {
+		"removed": sorted(labels),
+		"missing": [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in labels],
+		"labels": labels,
+	}
+
+
+async def ainvalidate_membership(user_id: int) -> None:
+	# async view 不在交易區塊中（Django 不支援 async 交易），刪除一次即可
+	await acache_delete(MEMBERSHIP_CACHE_KEY.format(user_id=user_id))
+
+
+async def aadd_to_collection(user_id: int, model_class, vehicle_ids: list[int]) -> dict:
+	"""``add_to_collection`` 的非同步版本（async ORM）。"""
+	labels, existing, to_add = _split_rows([row async for row in _collection_rows(user_id, model_class, vehicle_ids)])
+	added = {}
+	if to_add:
+		items = await model_class.objects.abulk_create(_new_items(user_id, model_class, to_add), **_UPSERT_OPTIONS)
+		added = {item.vehicle_id: item.pk for item in items}
+		await ainvalidate_membership(user_id)
+		await apublish_subscriptions_changed(user_id)
+		if model_class is FavoriteVehicle:
+			await sync_to_async(_record_favorite_heat)(user_id, to_add)
+	return _result(vehicle_ids, labels, existing, added)
+
+
+async def aremove_from_collection(user_id: int, model_class, vehicle_ids: list[int]) -> dict:
+	"""``remove_from_collection`` 的非同步版本（async ORM）。"""
+	items = model_class.objects.filter(user_id=user_id, vehicle_id__in=vehicle_ids)
+	rows = items.order_by().values_list("vehicle_id", "vehicle__brand", "vehicle__model", "vehicle__generation")
+	labels = {
+		vehicle_id: str(Vehicle(brand=brand, model=model, generation=generation))
+		async for vehicle_id, brand, model, generation in rows
+	}
+	if labels and await sync_to_async(_delete_items)(items):
+		await ainvalidate_membership(user_id)
+		await apublish_subscriptions_changed(user_id)
+	return {
+		"removed": sorted(labels),
+		"missing": [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in labels],
+		"labels": labels,
+	}
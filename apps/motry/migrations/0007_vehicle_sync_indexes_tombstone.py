@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motry', '0006_remove_car_vehicles_and_type_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_id', models.BigIntegerField(db_index=True)),
+                ('deleted_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['deleted_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['brand', 'model', 'id'], name='motry_vehicle_brand_model_id'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['updated_at', 'id'], name='motry_vehicle_updated_id'),
+        ),
+    ]
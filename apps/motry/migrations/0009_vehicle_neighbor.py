@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motry', '0008_notification_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('distance', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='motry.vehicle')),
+                ('vehicle', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='motry.vehicle')),
+            ],
+            options={
+                'ordering': ['vehicle', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'rank'), name='motry_vehicle_neighbor_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motry', '0011_notification_actor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicleneighbor',
+            index=models.Index(fields=['rank', 'vehicle'], name='motry_neighbor_rank_vehicle'),
+        ),
+    ]
@@ -27,16 +27,123 @@ class Vehicle(models.Model):
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			# /api/vehicles/ 的 keyset 分頁：一般模式依 (brand, model, id)，增量同步依 (updated_at, id)
+			models.Index(fields=["brand", "model", "id"], name="motry_vehicle_brand_model_id"),
+			models.Index(fields=["updated_at", "id"], name="motry_vehicle_updated_id"),
+		]
+
+	# 相似車款（``similarity``）使用的規格欄位；這些欄位都沒變的儲存不需重算鄰居
+	SPEC_FIELDS = (
+		"displacement_cc",
+		"horsepower_ps",
+		"cylinders",
+		"years_from",
+		"years_to",
+		"msrp_new",
+		"used_price_min",
+		"used_price_max",
+		"intro_md",
+	)
 
 	def __str__(self) -> str:
 		return f"{self.brand} {self.model} ({self.generation})" if self.generation else f"{self.brand} {self.model}"
 
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# 記下載入時的規格，儲存時比對是否變更（見 signals.schedule_neighbor_refresh）
+		loaded = dict(zip(field_names, values))
+		instance._loaded_spec = {field: loaded[field] for field in cls.SPEC_FIELDS if field in loaded}
+		return instance
+
+	def spec_changed(self) -> bool:
+		"""與載入時（或上次儲存時）相比，規格欄位是否有變更；新建或未知時視為有變更。"""
+		loaded = getattr(self, "_loaded_spec", None)
+		if loaded is None:
+			return True
+		return any(field not in loaded or loaded[field] != getattr(self, field) for field in self.SPEC_FIELDS)
+
 	def get_gallery_images(self):
 		if not hasattr(self, "_gallery_images_cache"):
 			self._gallery_images_cache = [img for img in self.images.all() if getattr(img, "has_real_image", False)]
 		return self._gallery_images_cache
 
 
+class VehicleTombstone(models.Model):
+	"""已刪除車輛的紀錄，供 /api/vehicles/?updated_since= 增量同步回報刪除。"""
+
+	vehicle_id = models.BigIntegerField(db_index=True)
+	deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+	class Meta:
+		ordering = ["deleted_at"]
+
+	def __str__(self) -> str:
+		return f"Vehicle {self.vehicle_id} deleted at {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+class VehicleNeighbor(models.Model):
+	"""預先計算的規格相似車款（每台車前 k 名，見 ``similarity``）；車款頁以 (vehicle, rank) 一次查出。"""
+
+	# (vehicle, rank) 唯一索引已涵蓋 vehicle 查詢，不另建單欄索引
+	vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="neighbors", db_index=False)
+	neighbor = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="+")
+	rank = models.PositiveSmallIntegerField()
+	distance = models.FloatField()
+
+	class Meta:
+		ordering = ["vehicle", "rank"]
+		constraints = [
+			models.UniqueConstraint(fields=["vehicle", "rank"], name="motry_vehicle_neighbor_rank"),
+		]
+		indexes = [
+			# 增量更新時取每台車第 k 名的距離（rank=k）；(vehicle, rank) 唯一索引無法用於只依 rank 的查詢
+			models.Index(fields=["rank", "vehicle"], name="motry_neighbor_rank_vehicle"),
+		]
+
+	def __str__(self) -> str:
+		return f"Vehicle {self.vehicle_id} #{self.rank}: {self.neighbor_id}"
+
+
+class RelatedVehicle(models.Model):
+	"""協同過濾的「車友也喜歡」：與此車被同一批使用者收藏 / 入庫 / 高分評價的車款（見 ``recommendations``）。"""
+
+	vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="related_vehicles", db_index=False)
+	related = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="+")
+	rank = models.PositiveSmallIntegerField()
+	score = models.FloatField()
+
+	class Meta:
+		ordering = ["vehicle", "rank"]
+		constraints = [
+			models.UniqueConstraint(fields=["vehicle", "rank"], name="motry_related_vehicle_rank"),
+		]
+
+	def __str__(self) -> str:
+		return f"Vehicle {self.vehicle_id} #{self.rank}: {self.related_id}"
+
+
+class UserRecommendation(models.Model):
+	"""預先計算的個人化推薦車款；首頁以 (user, rank) 一次查出。"""
+
+	user = models.ForeignKey(
+		settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="vehicle_recommendations", db_index=False
+	)
+	vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="+")
+	rank = models.PositiveSmallIntegerField()
+	score = models.FloatField()
+
+	class Meta:
+		ordering = ["user", "rank"]
+		constraints = [
+			models.UniqueConstraint(fields=["user", "rank"], name="motry_user_recommendation_rank"),
+		]
+
+	def __str__(self) -> str:
+		return f"User {self.user_id} #{self.rank}: {self.vehicle_id}"
+
+
 class VehicleImage(models.Model):
 	"""車輛圖片（外鍵一對多示範）。"""
 
@@ -263,11 +370,28 @@ class Notification(models.Model):
 	related_vehicle = models.ForeignKey(
 		Vehicle, null=True, blank=True, on_delete=models.CASCADE, related_name="notifications"
 	)
+	# 觸發通知的使用者（留言 / 按讚者）；按讚通知依 (貼文, actor) 只保留一筆
+	actor = models.ForeignKey(
+		settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+	)
 	is_read = models.BooleanField(default=False, db_index=True)
 	created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			# 收件匣依 (created_at, id) keyset 分頁；未讀篩選與未讀數校正走 (user, is_read, created_at)
+			models.Index(fields=["user", "is_read", "created_at"], name="motry_notif_user_read_created"),
+			models.Index(fields=["user", "created_at", "id"], name="motry_notif_user_created_id"),
+		]
+		constraints = [
+			# 收回讚再按讚不會重複通知
+			models.UniqueConstraint(
+				fields=["related_post", "actor", "notification_type"],
+				condition=models.Q(notification_type="new_like"),
+				name="motry_notif_like_once",
+			),
+		]
 
 	def __str__(self) -> str:
 		return f"Notification for {self.user}: {self.title}"
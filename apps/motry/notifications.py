@@ -0,0 +1,202 @@
+"""
+即時通知的 Channels group 路由。
+
+原本所有連線都加入同一個 ``motry_notifications`` group，每篇新貼文推給全部在線使用者，
+再由前端丟掉不相關的訊息。改為依受眾推送：
+
+- ``motry_vehicle_<id>``：車輛 group，成員為把該車加入最愛 / 車庫的使用者，以及正在瀏覽該車頁面的連線
+  （前端連線後送出 ``{"action": "watch", "vehicle_id": ...}``）；新貼文只推到這裡
+- ``motry_user_<id>``：使用者 group，自己貼文收到的留言 / 按讚，以及訂閱變更
+  （加入 / 移除最愛、車庫後，連線中的 consumer 重新計算要加入的車輛 group）
+
+通知事件同時寫入各 group 的事件紀錄（見 ``event_stream``），斷線重連時可補送。
+
+新貼文的 fan-out 不在請求中執行：交易提交後才排入 Celery 任務 ``fanout_new_post``，
+由任務分批寫入訂閱者的 ``Notification`` 再推播，Redis / DB 延遲不影響發文請求，
+也不會在交易 rollback 時送出不存在的貼文。
+"""
+
+from __future__ import annotations
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .event_stream import append_event
+from .inbox import adjust_unread
+from .models import FavoriteVehicle, Notification, UserVehicle
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_EVENT_TYPE = "motry.notification"
+SUBSCRIPTIONS_EVENT_TYPE = "motry.subscriptions"
+
+# 每批寫入的 Notification 筆數
+NOTIFICATION_CHUNK_SIZE = 1000
+
+# 單一連線最多加入的車輛 group 數（Redis channel layer 每個 group 各需一次 ZADD）
+MAX_SUBSCRIBED_VEHICLES = 500
+
+
+def vehicle_group(vehicle_id: int) -> str:
+	return f"motry_vehicle_{vehicle_id}"
+
+
+def user_group(user_id: int) -> str:
+	return f"motry_user_{user_id}"
+
+
+def _group_send(group: str, event: dict) -> None:
+	channel_layer = get_channel_layer()
+	if not channel_layer:
+		return
+	try:
+		async_to_sync(channel_layer.group_send)(group, event)
+	except Exception as e:
+		# 推播失敗不影響寫入本身
+		logger.warning(f"通知推播失敗 {group}: {e}")
+
+
+def _publish(group: str, event: dict) -> None:
+	"""寫入 group 的事件紀錄（供重連補送）後推播；事件附上紀錄 id。"""
+	event_id = append_event(group, event)
+	if event_id:
+		event = {**event, "event_id": event_id}
+	_group_send(group, event)
+
+
+def _post_payload(post) -> dict:
+	return {
+		"post_id": post.id,
+		"title": str(post),
+		"vehicle": {"id": post.vehicle_id, "name": str(post.vehicle)},
+	}
+
+
+def interested_user_ids(vehicle_id: int, exclude_user_id: int | None = None):
+	"""收藏或擁有該車的使用者 id（UNION 去除重複），以 iterator 逐批讀取。"""
+	favorites = FavoriteVehicle.objects.filter(vehicle_id=vehicle_id)
+	owners = UserVehicle.objects.filter(vehicle_id=vehicle_id)
+	if exclude_user_id:
+		favorites = favorites.exclude(user_id=exclude_user_id)
+		owners = owners.exclude(user_id=exclude_user_id)
+	user_ids = favorites.order_by().values_list("user_id", flat=True).union(
+		owners.order_by().values_list("user_id", flat=True)
+	)
+	return user_ids.iterator(chunk_size=NOTIFICATION_CHUNK_SIZE)
+
+
+def create_post_notifications(post) -> int:
+	"""
+	為新貼文寫入訂閱者的 Notification，每 NOTIFICATION_CHUNK_SIZE 筆一次 ``bulk_create``。
+
+	已收到此貼文通知的使用者會略過，任務重試時不會重複寫入。
+	"""
+	already = set(
+		Notification.objects.filter(
+			related_post=post, notification_type=Notification.NotificationType.NEW_POST
+		).values_list("user_id", flat=True)
+	)
+	title = f"{post.vehicle} 有新貼文"[:100]
+	message = str(post)[:500]
+	created = 0
+	chunk = []
+	for user_id in interested_user_ids(post.vehicle_id, exclude_user_id=post.user_id):
+		if user_id in already:
+			continue
+		chunk.append(
+			Notification(
+				user_id=user_id,
+				notification_type=Notification.NotificationType.NEW_POST,
+				title=title,
+				message=message,
+				related_post=post,
+				related_vehicle_id=post.vehicle_id,
+			)
+		)
+		if len(chunk) >= NOTIFICATION_CHUNK_SIZE:
+			created += _insert_chunk(chunk)
+			chunk = []
+	if chunk:
+		created += _insert_chunk(chunk)
+	return created
+
+
+def _insert_chunk(chunk: list[Notification]) -> int:
+	Notification.objects.bulk_create(chunk)
+	adjust_unread([notification.user_id for notification in chunk], 1)
+	return len(chunk)
+
+
+def publish_new_post(post) -> None:
+	"""新貼文推送到車輛 group；作者本人由 consumer 略過。"""
+	_publish(
+		vehicle_group(post.vehicle_id),
+		{
+			"type": NOTIFICATION_EVENT_TYPE,
+			"kind": Notification.NotificationType.NEW_POST,
+			"actor_id": post.user_id,
+			**_post_payload(post),
+		},
+	)
+
+
+def publish_post_activity(post, kind: str, actor) -> None:
+	"""
+	留言 / 按讚通知貼文作者；自己對自己的貼文互動不通知。
+
+	只有一位收件者，Notification 直接在目前交易中寫入，推播則等交易提交後才送出。
+	同一位使用者對同一篇貼文的按讚只通知一次（收回讚再按讚不會再寫入 / 推播，見 ``motry_notif_like_once``）。
+	"""
+	actor_id = getattr(actor, "pk", None)
+	if not post.user_id or post.user_id == actor_id:
+		return
+	actor_name = str(actor) if actor else ""
+	if kind == Notification.NotificationType.NEW_COMMENT:
+		title = f"{actor_name} 留言了你的貼文"
+	else:
+		title = f"{actor_name} 對你的貼文按讚"
+	fields = {
+		"user_id": post.user_id,
+		"title": title[:100],
+		"message": str(post)[:500],
+		"related_vehicle_id": post.vehicle_id,
+	}
+	if kind == Notification.NotificationType.NEW_LIKE and actor_id:
+		_, created = Notification.objects.get_or_create(
+			related_post=post, actor_id=actor_id, notification_type=kind, defaults=fields
+		)
+		if not created:
+			return
+	else:
+		Notification.objects.create(related_post=post, actor_id=actor_id, notification_type=kind, **fields)
+	event = {
+		"type": NOTIFICATION_EVENT_TYPE,
+		"kind": kind,
+		"actor_id": actor_id,
+		"actor": actor_name,
+		**_post_payload(post),
+	}
+	def after_commit():
+		adjust_unread([post.user_id], 1)
+		_publish(user_group(post.user_id), event)
+
+	# 推播失敗（Redis 暫時無法連線）只記錄，不影響已提交的留言 / 按讚
+	transaction.on_commit(after_commit, robust=True)
+
+
+def publish_subscriptions_changed(user_id: int) -> None:
+	# consumer 收到後會重新查詢訂閱，需等交易提交後才送出
+	transaction.on_commit(lambda: _group_send(user_group(user_id), {"type": SUBSCRIPTIONS_EVENT_TYPE}))
+
+
+async def apublish_subscriptions_changed(user_id: int) -> None:
+	channel_layer = get_channel_layer()
+	if not channel_layer:
+		return
+	try:
+		await channel_layer.group_send(user_group(user_id), {"type": SUBSCRIPTIONS_EVENT_TYPE})
+	except Exception as e:
+		logger.warning(f"通知推播失敗 {user_group(user_id)}: {e}")
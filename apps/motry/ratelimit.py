@@ -0,0 +1,246 @@
+"""
+速率限制裝飾器。
+
+與 ``django_ratelimit.decorators.ratelimit`` 相同的參數（group / key / rate / method / block），
+另外支援 async view：django_ratelimit 的裝飾器只會產生同步 wrapper，套在 async view 上會讓
+Django 把整個 view 當成同步執行。
+
+計數方式為 GCRA（Generic Cell Rate Algorithm）：每個 key 只存一個「理論到達時間」（TAT），
+``rate='10/m'`` 代表每 6 秒補回一次額度、最多連續 10 次。
+
+- Redis：整個判斷寫成一支 Lua script（讀 TAT → 比較 → ``SET PX``），一次往返、原子執行；
+  django_ratelimit 原本是 ``add`` + ``incr`` 兩次往返，且固定視窗在邊界可連續通過兩倍流量
+- async view 透過 redis.asyncio 直接執行 script，不需切換執行緒
+- 非 Redis 後端（locmem）或 Redis 連線失敗時改用行程內的 ``LocalGCRA``，
+  多個 worker 時各自計算（限制會變寬鬆），但不會因為 Redis 中斷讓所有寫入請求都被擋下
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from django_ratelimit import ALL, UNSAFE
+from django_ratelimit.core import _ACCESSOR_KEYS, _SIMPLE_KEYS, _method_match, _split_rate
+from django_ratelimit.exceptions import Ratelimited
+from redis.exceptions import RedisError
+
+from .caching import _async_redis, _redis_client
+
+__all__ = ["LocalGCRA", "ais_ratelimited", "is_ratelimited", "ratelimit"]
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]：計數 key；ARGV[1]：補回一次額度的間隔（ms）；ARGV[2]：容許的突發量（ms，= 間隔 × 次數）
+# 回傳 {是否通過, 需再等待的 ms}；時間取自 Redis TIME，各 worker 的時鐘誤差不影響結果
+GCRA_SCRIPT = """
+local now = redis.call('TIME')
+now = now[1] * 1000 + math.floor(now[2] / 1000)
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+	tat = now
+end
+local new_tat = tat + emission
+if new_tat - now > tolerance then
+	return {0, math.ceil(new_tat - tolerance - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return {1, 0}
+"""
+
+_sync_script = None
+
+
+class LocalGCRA:
+	"""行程內的 GCRA 計數（Redis 無法使用時的備援）。"""
+
+	def __init__(self, max_keys: int = 10000):
+		self.max_keys = max_keys
+		self._tats: dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def hit(self, key: str, limit: int, period: float) -> tuple[bool, float]:
+		"""記錄一次請求，回傳 (是否通過, 需再等待的秒數)。"""
+		emission = period / limit
+		now = time.monotonic()
+		with self._lock:
+			tat = max(self._tats.get(key, now), now)
+			new_tat = tat + emission
+			if new_tat - now > period:
+				return False, new_tat - period - now
+			if key not in self._tats and len(self._tats) >= self.max_keys:
+				self._prune(now)
+			self._tats[key] = new_tat
+			return True, 0.0
+
+	def _prune(self, now: float) -> None:
+		expired = [key for key, tat in self._tats.items() if tat <= now]
+		for key in expired:
+			del self._tats[key]
+		if len(self._tats) >= self.max_keys:
+			# 仍然太多時清掉最舊的一半（dict 保持插入順序）
+			for key in list(self._tats)[: len(self._tats) // 2]:
+				del self._tats[key]
+
+	def clear(self) -> None:
+		with self._lock:
+			self._tats.clear()
+
+
+local_limiter = LocalGCRA()
+
+
+def _resolve(request, group, fn, key, rate, method):
+	"""
+	依 django_ratelimit 的規則解析 group / rate / key。
+
+	Returns:
+		(計數 key, 次數, 秒數)；不需限制時回傳 None
+	"""
+	if group is None and fn is None:
+		raise ImproperlyConfigured("ratelimit 需要 group 或 fn 參數")
+	if not getattr(settings, "RATELIMIT_ENABLE", True) or not _method_match(request, method):
+		return None
+
+	if group is None:
+		if isinstance(fn, functools.partial):
+			fn = fn.func
+		group = ".".join(filter(None, [getattr(fn, "__module__", None), fn.__qualname__]))
+
+	if callable(rate):
+		rate = rate(group, request)
+	elif isinstance(rate, str) and "." in rate:
+		rate = import_string(rate)(group, request)
+	if rate is None:
+		return None
+	limit, period = _split_rate(rate)
+	if period <= 0:
+		raise ImproperlyConfigured("Ratelimit period must be greater than 0")
+
+	if not key:
+		raise ImproperlyConfigured("Ratelimit key must be specified")
+	if callable(key):
+		value = key(group, request)
+	elif key in _SIMPLE_KEYS:
+		value = _SIMPLE_KEYS[key](request)
+	elif ":" in key:
+		accessor, name = key.split(":", 1)
+		if accessor not in _ACCESSOR_KEYS:
+			raise ImproperlyConfigured(f"Unknown ratelimit key: {key}")
+		value = _ACCESSOR_KEYS[accessor](request, name)
+	elif "." in key:
+		value = import_string(key)(group, request)
+	else:
+		raise ImproperlyConfigured(f"Could not understand ratelimit key: {key}")
+
+	if method == ALL:
+		methods = ""
+	elif isinstance(method, (list, tuple)):
+		methods = "".join(sorted(m.upper() for m in method))
+	else:
+		methods = str(method).upper()
+	prefix = getattr(settings, "RATELIMIT_CACHE_PREFIX", "rl:")
+	digest = hashlib.sha256(f"{group}{limit}/{period}s{value}{methods}".encode("utf-8")).hexdigest()
+	return f"{prefix}gcra:{digest}", limit, period
+
+
+def _script_args(limit: int, period: int) -> list:
+	emission = period * 1000 / limit
+	return [repr(emission), repr(emission * limit)]
+
+
+def _local_hit(cache_key: str, limit: int, period: int) -> bool:
+	allowed, _ = local_limiter.hit(cache_key, limit, period)
+	return not allowed
+
+
+def is_ratelimited(request, group=None, fn=None, key=None, rate=None, method=ALL) -> bool:
+	"""記錄一次請求並回傳是否超過限制。"""
+	global _sync_script
+	resolved = _resolve(request, group, fn, key, rate, method)
+	if resolved is None:
+		return False
+	cache_key, limit, period = resolved
+
+	try:
+		client = _redis_client()
+		if client is None:
+			return _local_hit(cache_key, limit, period)
+		if _sync_script is None:
+			_sync_script = client.register_script(GCRA_SCRIPT)
+		allowed, _ = _sync_script(keys=[cache.make_key(cache_key)], args=_script_args(limit, period), client=client)
+	except RedisError:
+		logger.warning("Redis 無法使用，速率限制改用行程內計數", exc_info=True)
+		return _local_hit(cache_key, limit, period)
+	return not allowed
+
+
+async def ais_ratelimited(request, group=None, fn=None, key=None, rate=None, method=ALL) -> bool:
+	"""``is_ratelimited`` 的非同步版本；request.user 需已由 ``auser()`` 載入。"""
+	resolved = _resolve(request, group, fn, key, rate, method)
+	if resolved is None:
+		return False
+	cache_key, limit, period = resolved
+
+	client = _async_redis()
+	if client is None:
+		return _local_hit(cache_key, limit, period)
+	try:
+		# AsyncScript 以 EVALSHA 執行，遇到 NOSCRIPT 才送出完整 script
+		script = client.register_script(GCRA_SCRIPT)
+		allowed, _ = await script(keys=[cache.make_key(cache_key)], args=_script_args(limit, period))
+	except (RedisError, OSError):
+		logger.warning("Redis 無法使用，速率限制改用行程內計數", exc_info=True)
+		return _local_hit(cache_key, limit, period)
+	return not allowed
+
+
+def _raise_ratelimited():
+	cls = getattr(settings, "RATELIMIT_EXCEPTION_CLASS", Ratelimited)
+	raise (import_string(cls) if isinstance(cls, str) else cls)()
+
+
+def ratelimit(group=None, key=None, rate=None, method=ALL, block=True):
+	def decorator(fn):
+		if iscoroutinefunction(fn):
+
+			@wraps(fn)
+			async def _async_wrapped(request, *args, **kwargs):
+				# 先以 auser() 取得使用者（login_required 已查過時直接沿用），
+				# key='user' 時不必再透過 request.user 同步查詢
+				if hasattr(request, "auser"):
+					request.user = await request.auser()
+				limited = await ais_ratelimited(request, group=group, fn=fn, key=key, rate=rate, method=method)
+				request.limited = limited or getattr(request, "limited", False)
+				if limited and block:
+					_raise_ratelimited()
+				return await fn(request, *args, **kwargs)
+
+			return _async_wrapped
+
+		@wraps(fn)
+		def _wrapped(request, *args, **kwargs):
+			limited = is_ratelimited(request, group=group, fn=fn, key=key, rate=rate, method=method)
+			request.limited = limited or getattr(request, "limited", False)
+			if limited and block:
+				_raise_ratelimited()
+			return fn(request, *args, **kwargs)
+
+		return _wrapped
+
+	return decorator
+
+
+ratelimit.ALL = ALL
+ratelimit.UNSAFE = UNSAFE
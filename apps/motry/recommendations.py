@@ -0,0 +1,260 @@
+"""
+協同過濾推薦：以收藏、車庫與評分的共現關係離線計算「車友也喜歡」與個人化推薦。
+
+- 互動矩陣：使用者 × 車款的 scipy.sparse 矩陣，權重見 ``INTERACTION_WEIGHTS`` / ``RATING_WEIGHTS``
+  （評分 3 分以上才算正向訊號）；同一使用者對同一車款有多種互動時取最大值
+- 車款相似度：欄向量正規化後 ``Xᵀ·X`` 即 cosine 相似度；逐區塊計算，每台車只保留前 ITEM_TOP_K 名、
+  共同使用者至少 MIN_CO_USERS 位（避免單一使用者造成的巧合），不會產生 n × n 的稠密矩陣
+- 個人推薦：使用者的互動列 × 截斷後的相似度矩陣，排除已互動的車款後取前 USER_TOP_N 名
+- 結果依車款 / 使用者分批取代 ``RelatedVehicle`` / ``UserRecommendation`` 的舊資料，由 Celery beat 定時重算；
+  首頁讀取走與隨機推薦相同的快取（``personal_picks``），快取未命中也只是一次 (user, rank) 索引查詢
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .caching import get_or_rebuild
+from .cards import VehicleCard, vehicle_card
+from .models import FavoriteVehicle, Rating, RelatedVehicle, UserRecommendation, UserVehicle
+
+ITEM_TOP_K = 20
+USER_TOP_N = 12
+MIN_CO_USERS = 2
+MIN_SIMILARITY = 0.01
+BLOCK_ROWS = 2000
+INSERT_BATCH_SIZE = 5000
+
+INTERACTION_WEIGHTS = {"garage": 3.0, "favorite": 2.0}
+RATING_WEIGHTS = {5: 2.5, 4: 1.5, 3: 0.5}
+
+PERSONAL_PICKS_CACHE_KEY = "home:personal_cards:{user_id}"
+PERSONAL_PICKS_CACHE_TIMEOUT = 300
+PERSONAL_PICKS_CACHE_HARD_TIMEOUT = 600
+
+
+@dataclass
+class InteractionMatrix:
+	"""使用者 × 車款的互動矩陣（CSR）與列 / 欄對應的 id。"""
+
+	user_ids: np.ndarray
+	vehicle_ids: np.ndarray
+	matrix: sparse.csr_matrix
+
+
+def _interactions():
+	for user_id, vehicle_id in UserVehicle.objects.values_list("user_id", "vehicle_id").iterator(chunk_size=5000):
+		yield user_id, vehicle_id, INTERACTION_WEIGHTS["garage"]
+	for user_id, vehicle_id in FavoriteVehicle.objects.values_list("user_id", "vehicle_id").iterator(chunk_size=5000):
+		yield user_id, vehicle_id, INTERACTION_WEIGHTS["favorite"]
+	ratings = Rating.objects.filter(score__in=list(RATING_WEIGHTS)).values_list("user_id", "vehicle_id", "score")
+	for user_id, vehicle_id, score in ratings.iterator(chunk_size=5000):
+		yield user_id, vehicle_id, RATING_WEIGHTS[score]
+
+
+def build_interaction_matrix(interactions=None) -> InteractionMatrix:
+	"""讀取（或使用傳入的）(user_id, vehicle_id, 權重) 組成稀疏矩陣。"""
+	if interactions is None:
+		interactions = _interactions()
+	strongest: dict[tuple[int, int], float] = {}
+	for user_id, vehicle_id, weight in interactions:
+		key = (user_id, vehicle_id)
+		if weight > strongest.get(key, 0.0):
+			strongest[key] = weight
+
+	if not strongest:
+		empty = np.zeros(0, dtype=np.int64)
+		return InteractionMatrix(empty, empty, sparse.csr_matrix((0, 0)))
+	pairs = np.array(list(strongest), dtype=np.int64)
+	user_ids, user_rows = np.unique(pairs[:, 0], return_inverse=True)
+	vehicle_ids, vehicle_columns = np.unique(pairs[:, 1], return_inverse=True)
+	matrix = sparse.csr_matrix(
+		(np.fromiter(strongest.values(), dtype=float, count=len(strongest)), (user_rows, vehicle_columns)),
+		shape=(len(user_ids), len(vehicle_ids)),
+	)
+	return InteractionMatrix(user_ids, vehicle_ids, matrix)
+
+
+def _top_per_row(block: sparse.csr_matrix, k: int, diagonal: int | None = None):
+	"""
+	逐列產生 (列, 欄陣列, 值陣列)，只保留前 k 大且不小於 MIN_SIMILARITY 的值，依值遞減。
+
+	diagonal 為區塊第一列在整個相似度矩陣中的位置，用來排除自己。
+	"""
+	for index in range(block.shape[0]):
+		start, end = block.indptr[index], block.indptr[index + 1]
+		columns, values = block.indices[start:end], block.data[start:end]
+		keep = values >= MIN_SIMILARITY
+		if diagonal is not None:
+			keep &= columns != diagonal + index
+		columns, values = columns[keep], values[keep]
+		if len(values) > k:
+			top = np.argpartition(values, -k)[-k:]
+			columns, values = columns[top], values[top]
+		order = np.argsort(-values, kind="stable")
+		yield index, columns[order], values[order]
+
+
+def item_similarity(interactions: InteractionMatrix, k: int = ITEM_TOP_K) -> sparse.csr_matrix:
+	"""截斷後的車款相似度矩陣（每列前 k 名，不含自己）。"""
+	matrix = interactions.matrix.tocsc()
+	n = matrix.shape[1]
+	norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+	norms[norms == 0] = 1.0
+	normalized = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+	binary = (matrix > 0).astype(np.float32).tocsc()
+
+	rows, columns, values = [], [], []
+	for start in range(0, n, BLOCK_ROWS):
+		end = min(start + BLOCK_ROWS, n)
+		similarity = (normalized[:, start:end].T @ normalized).tocsr()
+		co_users = (binary[:, start:end].T @ binary).tocsr()
+		similarity = similarity.multiply(co_users >= MIN_CO_USERS).tocsr()
+		for index, top_columns, top_values in _top_per_row(similarity, k, diagonal=start):
+			rows.append(np.full(len(top_columns), start + index))
+			columns.append(top_columns)
+			values.append(top_values)
+	if not rows:
+		return sparse.csr_matrix((n, n))
+	return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(n, n))
+
+
+def user_scores(interactions: InteractionMatrix, similarity: sparse.csr_matrix, n: int = USER_TOP_N):
+	"""逐區塊產生 (使用者列, 車款欄陣列, 分數陣列)，排除使用者已互動的車款。"""
+	matrix = interactions.matrix
+	for start in range(0, matrix.shape[0], BLOCK_ROWS):
+		block = matrix[start : start + BLOCK_ROWS]
+		scores = (block @ similarity).tocsr()
+		# 已互動的車款歸零後移除（稀疏運算，不需逐列比對）
+		scores = (scores - scores.multiply(block > 0)).tocsr()
+		scores.eliminate_zeros()
+		for index, columns, values in _top_per_row(scores, n):
+			yield start + index, columns, values
+
+
+def _related_rows(similarity: sparse.csr_matrix, vehicle_ids: np.ndarray):
+	"""逐台車產生 (vehicle_id, RelatedVehicle 清單)；沒有相似車款的車也會產生空清單。"""
+	for row in range(similarity.shape[0]):
+		start, end = similarity.indptr[row], similarity.indptr[row + 1]
+		order = np.argsort(-similarity.data[start:end], kind="stable")
+		vehicle_id = int(vehicle_ids[row])
+		yield vehicle_id, [
+			RelatedVehicle(
+				vehicle_id=vehicle_id,
+				related_id=int(vehicle_ids[similarity.indices[start + position]]),
+				rank=rank,
+				score=float(similarity.data[start + position]),
+			)
+			for rank, position in enumerate(order, start=1)
+		]
+
+
+def _recommendation_rows(interactions: InteractionMatrix, similarity: sparse.csr_matrix, n: int):
+	"""逐位使用者產生 (user_id, UserRecommendation 清單)；沒有推薦的使用者也會產生空清單。"""
+	user_ids, vehicle_ids = interactions.user_ids, interactions.vehicle_ids
+	for row, columns, scores in user_scores(interactions, similarity, n):
+		user_id = int(user_ids[row])
+		yield user_id, [
+			UserRecommendation(user_id=user_id, vehicle_id=int(vehicle_ids[column]), rank=rank, score=float(score))
+			for rank, (column, score) in enumerate(zip(columns, scores), start=1)
+		]
+
+
+def _replace_rows(model, owner_field: str, owner_ids: list[int], rows: list) -> None:
+	# 同一批擁有者的舊資料刪除與新資料寫入在同一個短交易內，讀取端不會看到某人的清單只寫了一半
+	with transaction.atomic():
+		model.objects.filter(**{f"{owner_field}__in": owner_ids}).delete()
+		model.objects.bulk_create(rows)
+
+
+def _write_per_owner(model, owner_field: str, groups) -> tuple[set[int], int]:
+	"""
+	依擁有者（車款 / 使用者）分批取代資料，回傳 (本次出現的擁有者 id, 寫入筆數)。
+
+	每累積約 INSERT_BATCH_SIZE 筆就寫入一批，記憶體中只保留一批的模型實例。
+	"""
+	seen: set[int] = set()
+	owners, rows, written = [], [], 0
+	for owner_id, owner_rows in groups:
+		seen.add(owner_id)
+		owners.append(owner_id)
+		rows.extend(owner_rows)
+		if len(rows) >= INSERT_BATCH_SIZE or len(owners) >= INSERT_BATCH_SIZE:
+			_replace_rows(model, owner_field, owners, rows)
+			written += len(rows)
+			owners, rows = [], []
+	if owners:
+		_replace_rows(model, owner_field, owners, rows)
+		written += len(rows)
+	return seen, written
+
+
+def _delete_absent_owners(model, owner_field: str, seen: set[int]) -> None:
+	"""刪除本次重算沒有出現的擁有者（已無互動）的舊資料；依 id 遞增分頁掃描，不一次載入整張表。"""
+	column = f"{owner_field}_id"
+	queryset = model.objects.order_by(column).values_list(column, flat=True).distinct()
+	last = 0
+	while True:
+		page = list(queryset.filter(**{f"{column}__gt": last})[:INSERT_BATCH_SIZE])
+		if not page:
+			return
+		absent = [owner_id for owner_id in page if owner_id not in seen]
+		if absent:
+			model.objects.filter(**{f"{column}__in": absent}).delete()
+		last = page[-1]
+
+
+def rebuild_recommendations(item_k: int = ITEM_TOP_K, user_n: int = USER_TOP_N) -> dict:
+	"""
+	重算「車友也喜歡」與每位使用者的推薦清單。
+
+	結果邊算邊依擁有者分批取代（見 ``_write_per_owner``），不在記憶體中堆出全部資料列，
+	也不以單一大交易鎖住整張表；重算期間讀取端看到的是新舊混合、但每位使用者各自完整的清單。
+	最後刪除本次沒有出現的擁有者的舊資料。
+	"""
+	started = time.perf_counter()
+	interactions = build_interaction_matrix()
+	similarity = item_similarity(interactions, item_k)
+
+	vehicles, related = _write_per_owner(
+		RelatedVehicle, "vehicle", _related_rows(similarity, interactions.vehicle_ids)
+	)
+	_delete_absent_owners(RelatedVehicle, "vehicle", vehicles)
+	users, recommendations = _write_per_owner(
+		UserRecommendation, "user", _recommendation_rows(interactions, similarity, user_n)
+	)
+	_delete_absent_owners(UserRecommendation, "user", users)
+	return {
+		"users": len(interactions.user_ids),
+		"vehicles": len(interactions.vehicle_ids),
+		"related": related,
+		"recommendations": recommendations,
+		"seconds": round(time.perf_counter() - started, 3),
+	}
+
+
+def _load_personal_picks(user_id: int, count: int) -> list[VehicleCard]:
+	rows = (
+		UserRecommendation.objects.filter(user_id=user_id)
+		.select_related("vehicle")
+		.prefetch_related("vehicle__images")
+		.order_by("rank")[:count]
+	)
+	return [vehicle_card(row.vehicle) for row in rows]
+
+
+def personal_picks(user, count: int = 4) -> list[VehicleCard]:
+	"""登入使用者的個人化推薦卡片（快取 5 分鐘，與首頁隨機推薦相同的 single-flight 快取）；沒有推薦時回傳空清單。"""
+	if not user.is_authenticated:
+		return []
+	return get_or_rebuild(
+		PERSONAL_PICKS_CACHE_KEY.format(user_id=user.id),
+		lambda: _load_personal_picks(user.id, count),
+		soft_ttl=PERSONAL_PICKS_CACHE_TIMEOUT,
+		hard_ttl=PERSONAL_PICKS_CACHE_HARD_TIMEOUT,
+	)
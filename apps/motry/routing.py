@@ -4,4 +4,5 @@ from . import consumers
 
 websocket_urlpatterns = [
 	path("ws/motry/notifications/", consumers.NotificationConsumer.as_asgi()),
+	path("ws/motry/tasks/", consumers.TaskEventConsumer.as_asgi()),
 ]
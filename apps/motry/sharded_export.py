@@ -0,0 +1,203 @@
+"""
+分片平行匯出：車款目錄 + 社群資料（貼文、評分）。
+
+依 id 區間把每個資料集切成多個分片，各分片獨立寫出 CSV（不含標題列），
+最後依序串接成單一 zip（每個資料集一個 CSV 檔）。
+
+兩種執行方式共用同一組 ``plan_shards`` / ``write_shard`` / ``merge_shards``：
+- Celery chord：``tasks.export_catalog_sharded``，分片分散到多個 worker
+- ProcessPoolExecutor：``run_sharded_export``，供 ``benchmark_export`` 指令量測加速比
+  （Celery prefork worker 為 daemon process，不能再開子行程，因此 worker 內改用 chord）
+"""
+
+from __future__ import annotations
+
+import csv
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from django.db import connections
+from django.db.models import Count, Max, Min, QuerySet
+
+from .exports import DEFAULT_CHUNK_SIZE, peak_rss_kb, rss_growth_kb
+from .models import Post, Rating, Vehicle
+
+
+@dataclass(frozen=True)
+class Dataset:
+	name: str
+	fields: tuple[str, ...]
+	get_queryset: Callable[[], QuerySet]
+
+
+DATASETS: dict[str, Dataset] = {
+	dataset.name: dataset
+	for dataset in (
+		Dataset(
+			"vehicles",
+			(
+				"id",
+				"brand",
+				"model",
+				"generation",
+				"years_from",
+				"years_to",
+				"displacement_cc",
+				"cylinders",
+				"horsepower_ps",
+				"msrp_new",
+				"used_price_min",
+				"used_price_max",
+				"updated_at",
+			),
+			lambda: Vehicle.objects.all(),
+		),
+		Dataset(
+			"posts",
+			("id", "vehicle_id", "user_id", "user_vehicle_id", "body_text", "created_at"),
+			lambda: Post.objects.filter(is_deleted=False),
+		),
+		Dataset(
+			"ratings",
+			("id", "vehicle_id", "user_id", "score", "created_at"),
+			lambda: Rating.objects.all(),
+		),
+	)
+}
+
+
+@dataclass(frozen=True)
+class Shard:
+	"""單一分片：資料集中 id 介於 [lo, hi) 的資料列。"""
+
+	dataset: str
+	index: int
+	lo: int
+	hi: int
+
+	@property
+	def filename(self) -> str:
+		return f"{self.dataset}.part{self.index:04d}.csv"
+
+
+def plan_shards(shards: int, datasets: tuple[str, ...] | None = None) -> list[Shard]:
+	"""
+	依 id 範圍把每個資料集切成最多 shards 份。
+
+	以 (max_id - min_id) 等寬切分，只需要一次 aggregate 查詢；
+	id 大致連續時各分片筆數接近。
+	"""
+	plan: list[Shard] = []
+	for name in datasets or tuple(DATASETS):
+		stats = DATASETS[name].get_queryset().aggregate(lo=Min("id"), hi=Max("id"), total=Count("id"))
+		if not stats["total"]:
+			continue
+		lo, hi = stats["lo"], stats["hi"] + 1
+		parts = max(1, min(shards, stats["total"]))
+		width = -(-(hi - lo) // parts)  # ceil division
+		for index in range(parts):
+			start = lo + index * width
+			if start >= hi:
+				break
+			plan.append(Shard(name, index, start, min(start + width, hi)))
+	return plan
+
+
+def write_shard(shard: Shard, out_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+	"""寫出單一分片（不含標題列），回傳檔案路徑與筆數。"""
+	dataset = DATASETS[shard.dataset]
+	path = Path(out_dir) / shard.filename
+	rows = (
+		dataset.get_queryset()
+		.filter(id__gte=shard.lo, id__lt=shard.hi)
+		.order_by("id")
+		.values_list(*dataset.fields)
+		.iterator(chunk_size=chunk_size)
+	)
+	count = 0
+	with open(path, "w", newline="", encoding="utf-8") as fileobj:
+		writer = csv.writer(fileobj)
+		batch = []
+		for row in rows:
+			batch.append(row)
+			if len(batch) >= chunk_size:
+				writer.writerows(batch)
+				count += len(batch)
+				batch = []
+		writer.writerows(batch)
+		count += len(batch)
+	return {"dataset": shard.dataset, "index": shard.index, "path": str(path), "rows": count}
+
+
+def merge_shards(parts: list[dict], zip_path: Path) -> dict:
+	"""
+	依資料集與分片順序串接各分片，寫入單一 zip。
+
+	分片以串流方式複製進 zip entry，不會整份讀進記憶體。
+	"""
+	by_dataset: dict[str, list[dict]] = {}
+	for part in sorted(parts, key=lambda p: (p["dataset"], p["index"])):
+		by_dataset.setdefault(part["dataset"], []).append(part)
+
+	rows = {name: 0 for name in DATASETS}
+	with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+		for name, dataset_parts in by_dataset.items():
+			with archive.open(f"{name}.csv", "w") as entry:
+				header = ",".join(DATASETS[name].fields) + "\r\n"
+				entry.write(header.encode("utf-8"))
+				for part in dataset_parts:
+					with open(part["path"], "rb") as source:
+						shutil.copyfileobj(source, entry, 1024 * 1024)
+					rows[name] += part["rows"]
+	return {"path": str(zip_path), "rows": rows, "total_rows": sum(rows.values())}
+
+
+def _init_worker() -> None:
+	"""子行程初始化：spawn 模式下需重新載入 Django；fork 模式下為 no-op。"""
+	import django
+
+	django.setup()
+
+
+def run_sharded_export(zip_path: Path, workers: int = 4, shards: int | None = None) -> dict:
+	"""
+	以 ProcessPoolExecutor 平行寫出分片後合併。
+
+	workers <= 1 時在目前行程依序執行，作為量測加速比的基準。
+	rss_growth_kb / peak_rss_kb 只計目前行程（合併與依序執行），不含 worker 子行程。
+	"""
+	rss_before = peak_rss_kb()
+	started = time.perf_counter()
+	plan = plan_shards(shards or workers)
+	parts_dir = Path(zip_path).with_suffix(".parts")
+	parts_dir.mkdir(parents=True, exist_ok=True)
+
+	try:
+		if workers <= 1:
+			parts = [write_shard(shard, str(parts_dir)) for shard in plan]
+		else:
+			# fork 前關閉連線，避免子行程共用父行程的資料庫 socket
+			connections.close_all()
+			with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+				parts = list(pool.map(write_shard, plan, [str(parts_dir)] * len(plan)))
+		result = merge_shards(parts, Path(zip_path))
+	finally:
+		shutil.rmtree(parts_dir, ignore_errors=True)
+
+	elapsed = time.perf_counter() - started
+	result.update(
+		{
+			"workers": workers,
+			"shards": len(plan),
+			"elapsed_sec": round(elapsed, 3),
+			"rows_per_sec": round(result["total_rows"] / elapsed, 1) if elapsed > 0 else None,
+			"rss_growth_kb": rss_growth_kb(rss_before),
+			"peak_rss_kb": peak_rss_kb(),
+		}
+	)
+	return result
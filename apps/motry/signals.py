@@ -1,37 +1,159 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from django.core.cache import cache
-from django.db.models.signals import post_delete, post_save
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from .cache_keys import BRAND_MAP_CACHE_KEY
-from .models import Post, Vehicle
+from .cache_keys import BRAND_MAP_CACHE_KEY, CATALOG_VERSION_CACHE_KEY, TAG_LIST_CACHE_KEY
+from .caching import catalog_cache, tag_cache
+from .membership import invalidate_membership
+from .models import (
+	Comment,
+	FavoriteVehicle,
+	Like,
+	Notification,
+	Post,
+	PostTag,
+	Rating,
+	Tag,
+	UserVehicle,
+	Vehicle,
+	VehicleNeighbor,
+	VehicleTombstone,
+)
+from .notifications import publish_post_activity, publish_subscriptions_changed
+from .tasks import fanout_new_post, queue_neighbor_refresh
+from .trending import EVENT_WEIGHTS, TRENDING_TAGS, TRENDING_VEHICLES, record_event, record_event_once
+
+# 影響熱門趨勢的事件：model → (事件, 趨勢種類, 取得車款 / 標籤 id)
+TRENDING_EVENTS = {
+	Post: ("post", TRENDING_VEHICLES, lambda instance: instance.vehicle_id),
+	Comment: ("comment", TRENDING_VEHICLES, lambda instance: instance.post.vehicle_id),
+	Like: ("like", TRENDING_VEHICLES, lambda instance: instance.post.vehicle_id),
+	Rating: ("rating", TRENDING_VEHICLES, lambda instance: instance.vehicle_id),
+	FavoriteVehicle: ("favorite", TRENDING_VEHICLES, lambda instance: instance.vehicle_id),
+	PostTag: ("tag", TRENDING_TAGS, lambda instance: instance.tag_id),
+}
+# 可反覆取消再做的事件：同一使用者對同一目標只計一次（model → 取得貼文 / 車款 id）
+TRENDING_ONCE_PER_USER = {
+	Like: lambda instance: instance.post_id,
+	FavoriteVehicle: lambda instance: instance.vehicle_id,
+}
+
+
+@contextmanager
+def muted_signals(*senders):
+	"""
+	暫停 senders 的 post_save / pre_delete / post_delete receivers，供基準測試大量刪除合成資料使用：
+	不逐筆寫墓碑、排相似車款重算或失效快取；沒有 receiver 的 model 由 Collector 直接以批次 DELETE 串聯刪除。
+	結束後恢復 receivers 並失效目錄快取一次。
+	"""
+	sender_keys = {id(sender) for sender in senders}
+	saved = {}
+	for signal in (post_save, pre_delete, post_delete):
+		with signal.lock:
+			saved[signal] = signal.receivers
+			signal.receivers = [entry for entry in signal.receivers if entry[0][1] not in sender_keys]
+			signal.sender_receivers_cache.clear()
+	try:
+		yield
+	finally:
+		for signal, receivers in saved.items():
+			with signal.lock:
+				signal.receivers = receivers
+				signal.sender_receivers_cache.clear()
+		catalog_cache.invalidate(BRAND_MAP_CACHE_KEY, CATALOG_VERSION_CACHE_KEY)
 
 
 @receiver([post_save, post_delete], sender=Vehicle)
 def clear_brand_map_cache(**kwargs):
-	cache.delete(BRAND_MAP_CACHE_KEY)
+	catalog_cache.invalidate(BRAND_MAP_CACHE_KEY, CATALOG_VERSION_CACHE_KEY)
+
+
+@receiver(post_save, sender=Vehicle)
+def schedule_neighbor_refresh(sender, instance: Vehicle, created: bool, update_fields=None, **kwargs):
+	"""規格變更後（交易提交才）排入相似車款的增量重算；只改名稱、封面等欄位的儲存略過。"""
+	if not created:
+		if update_fields is not None and not set(update_fields) & set(Vehicle.SPEC_FIELDS):
+			return
+		if not instance.spec_changed():
+			return
+	instance._loaded_spec = {field: getattr(instance, field) for field in Vehicle.SPEC_FIELDS}
+	vehicle_id = instance.pk
+	transaction.on_commit(lambda: queue_neighbor_refresh([vehicle_id]), robust=True)
+
+
+@receiver(pre_delete, sender=Vehicle)
+def schedule_neighbor_refresh_on_delete(sender, instance: Vehicle, **kwargs):
+	"""刪除前記下以此車為鄰居的車（CASCADE 會先移除這些列，之後就查不到），提交後一併重算。"""
+	vehicle_ids = [
+		instance.pk,
+		*VehicleNeighbor.objects.filter(neighbor_id=instance.pk).values_list("vehicle_id", flat=True),
+	]
+	transaction.on_commit(lambda: queue_neighbor_refresh(vehicle_ids), robust=True)
+
+
+@receiver(post_delete, sender=Vehicle)
+def record_vehicle_tombstone(sender, instance: Vehicle, **kwargs):
+	"""記錄刪除，讓 /api/vehicles/?updated_since= 的客戶端能同步移除。"""
+	VehicleTombstone.objects.create(vehicle_id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def clear_tag_list_cache(**kwargs):
+	tag_cache.invalidate(TAG_LIST_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender=FavoriteVehicle)
+@receiver([post_save, post_delete], sender=UserVehicle)
+@receiver([post_save, post_delete], sender=Rating)
+@receiver([post_save, post_delete], sender=Like)
+def clear_membership_cache(sender, instance, **kwargs):
+	invalidate_membership(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=FavoriteVehicle)
+@receiver([post_save, post_delete], sender=UserVehicle)
+def refresh_notification_subscriptions(sender, instance, **kwargs):
+	"""最愛 / 車庫變更後，讓使用者連線中的 consumer 重新加入車輛 group。"""
+	publish_subscriptions_changed(instance.user_id)
 
 
 @receiver(post_save, sender=Post)
 def notify_new_post(sender, instance: Post, created: bool, **kwargs):
-	"""Week 12 WebSocket 範例：新增貼文時透過 Channels 推播通知。"""
-	if not created:
-		return
+	"""Week 12 WebSocket 範例：新增貼文時通知該車輛的訂閱者（交易提交後交給 Celery）。"""
+	if created:
+		post_id = instance.pk
+		# broker 無法連線時 delay() 會拋出例外；貼文已提交，只記錄錯誤而不讓發文請求回傳 500
+		transaction.on_commit(lambda: fanout_new_post.delay(post_id), robust=True)
 
-	channel_layer = get_channel_layer()
-	if not channel_layer:
-		return
 
-	async_to_sync(channel_layer.group_send)(
-		"motry_notifications",
-		{
-			"type": "motry_notification",
-			"post_id": instance.id,
-			"title": str(instance),
-			"vehicle": {
-				"id": instance.vehicle_id,
-				"name": str(instance.vehicle),
-			},
-		},
-	)
+@receiver(post_save, sender=Comment)
+def notify_new_comment(sender, instance: Comment, created: bool, **kwargs):
+	if created:
+		publish_post_activity(instance.post, Notification.NotificationType.NEW_COMMENT, instance.user)
+
+
+@receiver(post_save, sender=Like)
+def notify_new_like(sender, instance: Like, created: bool, **kwargs):
+	if created:
+		publish_post_activity(instance.post, Notification.NotificationType.NEW_LIKE, instance.user)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Rating)
+@receiver(post_save, sender=FavoriteVehicle)
+@receiver(post_save, sender=PostTag)
+def record_trending_event(sender, instance, created: bool, **kwargs):
+	"""新增時累加車款 / 標籤的熱度；交易 rollback 的事件不計入。"""
+	if not created:
+		return
+	event, kind, member = TRENDING_EVENTS[sender]
+	member_id = member(instance)
+	if sender in TRENDING_ONCE_PER_USER:
+		user_id, target_id = instance.user_id, TRENDING_ONCE_PER_USER[sender](instance)
+		transaction.on_commit(lambda: record_event_once(kind, member_id, event, user_id, target_id), robust=True)
+	else:
+		transaction.on_commit(lambda: record_event(kind, member_id, EVENT_WEIGHTS[event]), robust=True)
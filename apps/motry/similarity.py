@@ -0,0 +1,252 @@
+"""
+規格相似車款：離線計算每台車的前 k 名鄰近車款，存入 ``VehicleNeighbor``。
+
+車款頁若即時計算，需把該車與整個目錄逐一比較；改為批次任務預先算好，頁面只需一次
+``(vehicle, rank)`` 索引查詢。
+
+- 特徵：排氣量、馬力、缸數、年份、價格，以及自簡介解析的重量 / 扭力 / 座高 / 油箱與
+  純電 / 油電 / 四驅 / 渦輪標記（見 ``parse_extras``）；數值取 log 後以 z-score 標準化
+- 缺值不補：距離只在兩車都有的欄位上計算（加權均方根），共同規格欄位的權重和不足
+  MIN_SHARED_WEIGHT 時視為不相似
+- 計算：整個目錄組成 NumPy 矩陣，每次取一個區塊的列與全部車款做矩陣乘法得到距離，
+  區塊大小依目錄規模調整（單一區塊最多 BLOCK_ELEMENTS 個距離），``argpartition`` 取前 k 名
+- 增量更新：車款新增 / 規格修改 / 刪除後只重算受影響的車——變更的車本身、清單中含有變更車款的車，
+  以及變更後距離比自己第 k 名更近的車（鄰居不足 k 台的車門檻為無限大，只要變更車款與它可比較就重算）；
+  刪除時 CASCADE 會先移除以該車為鄰居的列，這些車由 signal 在刪除前一併排入。
+  變更先記在待重算集合，合併成一個延遲執行的任務（見 ``tasks.queue_neighbor_refresh``），
+  整批同步目錄時不會每台車各跑一次全目錄計算
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from django.db import transaction
+
+from .models import Vehicle, VehicleNeighbor
+
+SIMILAR_TOP_K = 6
+BLOCK_ELEMENTS = 4_000_000  # 單一區塊的距離數（float64 約 32 MB）
+MIN_SHARED_WEIGHT = 2.0
+INSERT_BATCH_SIZE = 5000
+
+# (欄位, 權重, 是否為規格數值)；標記欄位兩車一定都有，不計入共同規格權重
+FEATURES = [
+	("displacement", 1.0, True),
+	("horsepower", 1.5, True),
+	("cylinders", 0.5, True),
+	("year", 0.5, True),
+	("price", 1.0, True),
+	("weight", 0.5, True),
+	("torque", 0.5, True),
+	("seat_height", 0.25, True),
+	("fuel_capacity", 0.25, True),
+	("electric", 1.0, False),
+	("hybrid", 0.5, False),
+	("awd", 0.5, False),
+	("turbo", 0.5, False),
+]
+_LOG_FEATURES = {"displacement", "horsepower", "price", "weight", "torque"}
+_COLUMNS = {name: index for index, (name, _, _) in enumerate(FEATURES)}
+_WEIGHTS = np.array([weight for _, weight, _ in FEATURES])
+_SPEC = np.array([spec for _, _, spec in FEATURES], dtype=float)
+
+_EXTRA_PATTERNS = {
+	"weight": re.compile(r"(?:重量|車重)\s*[:：]?\s*([\d.]+)\s*kg", re.IGNORECASE),
+	"torque": re.compile(r"([\d.]+)\s*N[·.\s]?m", re.IGNORECASE),
+	"seat_height": re.compile(r"座高\s*[:：]?\s*([\d.]+)\s*mm", re.IGNORECASE),
+	"fuel_capacity": re.compile(r"油箱\s*[:：]?\s*([\d.]+)\s*(?:l|公升)", re.IGNORECASE),
+}
+_FLAG_PATTERNS = {
+	"electric": re.compile(r"純電|電動|\bEV\b|kWh", re.IGNORECASE),
+	"hybrid": re.compile(r"油電|hybrid", re.IGNORECASE),
+	"awd": re.compile(r"四驅|全輪驅動|xDrive|quattro|4MATIC|AWD", re.IGNORECASE),
+	"turbo": re.compile(r"渦輪|turbo", re.IGNORECASE),
+}
+
+_SPEC_FIELDS = ("id", *Vehicle.SPEC_FIELDS)
+
+
+def parse_extras(intro: str) -> dict[str, float]:
+	"""自簡介文字解析額外規格（sync_motorcycles 寫入的「重量：190 kg」等格式與一般敘述）。"""
+	extras = {}
+	for name, pattern in _EXTRA_PATTERNS.items():
+		match = pattern.search(intro or "")
+		if match:
+			try:
+				extras[name] = float(match.group(1))
+			except ValueError:
+				continue
+	for name, pattern in _FLAG_PATTERNS.items():
+		extras[name] = 1.0 if pattern.search(intro or "") else 0.0
+	return extras
+
+
+def _row_features(row: dict) -> dict[str, float]:
+	years = [year for year in (row["years_from"], row["years_to"]) if year]
+	prices = [price for price in (row["used_price_min"], row["used_price_max"]) if price]
+	features = {
+		"displacement": row["displacement_cc"],
+		"horsepower": row["horsepower_ps"],
+		"cylinders": row["cylinders"],
+		"year": sum(years) / len(years) if years else None,
+		"price": row["msrp_new"] or (sum(prices) / len(prices) if prices else None),
+		**parse_extras(row["intro_md"]),
+	}
+	flags = {name for name, _, spec in FEATURES if not spec}
+	# 規格欄位缺值（None / 0）不列入；標記欄位一定有值
+	return {name: float(value) for name, value in features.items() if name in flags or value}
+
+
+@dataclass
+class SpecMatrix:
+	"""標準化後的特徵矩陣；缺值位置為 0 且 mask 為 0。"""
+
+	ids: np.ndarray
+	values: np.ndarray
+	mask: np.ndarray
+
+	def __post_init__(self):
+		# distance_block 每個區塊共用的右側矩陣，只建立一次
+		self.stacked = np.ascontiguousarray(np.hstack([self.mask, self.values * self.values, self.values]).T)
+		self.mask_t = np.ascontiguousarray(self.mask.T)
+
+	def __len__(self) -> int:
+		return len(self.ids)
+
+
+def build_spec_matrix(rows=None) -> SpecMatrix:
+	"""讀取（或使用傳入的）車款規格，組成標準化矩陣。"""
+	if rows is None:
+		rows = Vehicle.objects.order_by("id").values(*_SPEC_FIELDS).iterator(chunk_size=2000)
+	ids, values, mask = [], [], []
+	for row in rows:
+		features = _row_features(row)
+		vector = np.zeros(len(FEATURES))
+		present = np.zeros(len(FEATURES))
+		for name, value in features.items():
+			column = _COLUMNS[name]
+			vector[column] = math.log1p(value) if name in _LOG_FEATURES else value
+			present[column] = 1.0
+		ids.append(row["id"])
+		values.append(vector)
+		mask.append(present)
+
+	if not ids:
+		empty = np.zeros((0, len(FEATURES)))
+		return SpecMatrix(np.zeros(0, dtype=np.int64), empty, empty)
+	values = np.array(values)
+	mask = np.array(mask)
+	# z-score：平均與標準差只計算有值的列
+	counts = np.maximum(mask.sum(axis=0), 1)
+	mean = (values * mask).sum(axis=0) / counts
+	std = np.sqrt((((values - mean) * mask) ** 2).sum(axis=0) / counts)
+	std[std == 0] = 1.0
+	values = (values - mean) / std * mask
+	return SpecMatrix(np.array(ids, dtype=np.int64), values, mask)
+
+
+def distance_block(matrix: SpecMatrix, rows: np.ndarray) -> np.ndarray:
+	"""
+	rows 這幾台車對全部車款的距離（len(rows) × n）。
+
+	兩車共同欄位的加權平方差總和展開為矩陣乘法：
+	Σ w·m_i·m_j·(x_i - x_j)² = (w·x_i²)·m_j + (w·m_i)·x_j² - 2·(w·x_i)·x_j（缺值處 x = 0），
+	三項併成一次 ``[w·x², w·m, -2·w·x] @ [m, x², x]ᵀ``；共同欄位權重和（全部 / 僅規格欄位）上下疊成一次 ``@ mᵀ``。
+	"""
+	values, mask = matrix.values[rows], matrix.mask[rows]
+	numerator = np.hstack([values * values * _WEIGHTS, mask * _WEIGHTS, -2 * values * _WEIGHTS]) @ matrix.stacked
+	shared = np.vstack([mask * _WEIGHTS, mask * _WEIGHTS * _SPEC]) @ matrix.mask_t
+	shared, shared_spec = shared[: len(rows)], shared[len(rows) :]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		distances = np.sqrt(np.maximum(numerator, 0) / shared)
+	distances[shared_spec < MIN_SHARED_WEIGHT] = np.inf
+	distances[np.arange(len(rows)), rows] = np.inf
+	return distances
+
+
+def _block_size(n: int) -> int:
+	return max(1, BLOCK_ELEMENTS // max(n, 1))
+
+
+def top_neighbors(matrix: SpecMatrix, rows, k: int = SIMILAR_TOP_K):
+	"""逐區塊產生 (列, [(鄰居列, 距離), ...])，只包含有限距離。"""
+	rows = np.asarray(rows, dtype=np.int64)
+	n = len(matrix)
+	k = min(k, n - 1)
+	if k <= 0:
+		return
+	size = _block_size(n)
+	for start in range(0, len(rows), size):
+		block = rows[start : start + size]
+		distances = distance_block(matrix, block)
+		nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+		nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+		order = np.argsort(nearest_distances, axis=1)
+		nearest = np.take_along_axis(nearest, order, axis=1)
+		nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+		for row, columns, values in zip(block, nearest, nearest_distances):
+			yield row, [(column, value) for column, value in zip(columns, values) if np.isfinite(value)]
+
+
+def _store(matrix: SpecMatrix, results, replace_all: bool = False) -> int:
+	vehicle_ids = []
+	neighbors = []
+	for row, items in results:
+		vehicle_id = int(matrix.ids[row])
+		vehicle_ids.append(vehicle_id)
+		neighbors.extend(
+			VehicleNeighbor(vehicle_id=vehicle_id, neighbor_id=int(matrix.ids[column]), rank=rank, distance=float(distance))
+			for rank, (column, distance) in enumerate(items, start=1)
+		)
+	with transaction.atomic():
+		if replace_all:
+			VehicleNeighbor.objects.all().delete()
+		else:
+			VehicleNeighbor.objects.filter(vehicle_id__in=vehicle_ids).delete()
+		VehicleNeighbor.objects.bulk_create(neighbors, batch_size=INSERT_BATCH_SIZE)
+	return len(neighbors)
+
+
+def rebuild_neighbors(k: int = SIMILAR_TOP_K) -> dict:
+	"""重算整個目錄的相似車款。"""
+	started = time.perf_counter()
+	matrix = build_spec_matrix()
+	stored = _store(matrix, top_neighbors(matrix, range(len(matrix)), k), replace_all=True)
+	return {"vehicles": len(matrix), "rows": stored, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def refresh_neighbors(vehicle_ids, k: int = SIMILAR_TOP_K) -> dict:
+	"""車款變更後只重算受影響的車（見模組說明）；vehicle_ids 可包含已刪除的車。"""
+	started = time.perf_counter()
+	vehicle_ids = {int(vehicle_id) for vehicle_id in vehicle_ids}
+	matrix = build_spec_matrix()
+	index = {int(vehicle_id): row for row, vehicle_id in enumerate(matrix.ids)}
+	limit = min(k, len(matrix) - 1)
+
+	affected = {vehicle_id for vehicle_id in vehicle_ids if vehicle_id in index}
+	# 清單中含有變更車款的車：變更後可能已不相似
+	affected.update(VehicleNeighbor.objects.filter(neighbor_id__in=vehicle_ids).values_list("vehicle_id", flat=True))
+
+	# 變更的車比某台車目前的第 k 名更近：該車需要重算（距離對稱，只需算變更車款這幾列）；
+	# 沒有第 k 名（鄰居不足）的車門檻為無限大，只有與變更車款可比較時才重算
+	kth = dict(VehicleNeighbor.objects.filter(rank=limit).values_list("vehicle_id", "distance"))
+	threshold = np.array([kth.get(int(vehicle_id), np.inf) for vehicle_id in matrix.ids])
+	changed_rows = np.array([index[vehicle_id] for vehicle_id in vehicle_ids if vehicle_id in index], dtype=np.int64)
+	size = _block_size(len(matrix))
+	for start in range(0, len(changed_rows), size):
+		distances = distance_block(matrix, changed_rows[start : start + size])
+		closer = (distances < threshold).any(axis=0)
+		affected.update(int(vehicle_id) for vehicle_id in matrix.ids[closer])
+
+	rows = sorted(index[vehicle_id] for vehicle_id in affected if vehicle_id in index)
+	stored = _store(matrix, top_neighbors(matrix, rows, k))
+	return {
+		"vehicles": len(rows),
+		"rows": stored,
+		"seconds": round(time.perf_counter() - started, 3),
+	}
@@ -43,15 +43,165 @@
     }, 3200);
   }
 
+  function bumpBadge() {
+    const badge = document.querySelector("[data-notification-badge]");
+    const count = badge && badge.querySelector("[data-notification-count]");
+    if (!count) return;
+    count.textContent = String((parseInt(count.textContent, 10) || 0) + 1);
+    badge.hidden = false;
+  }
+
+  // 最後收到的事件 id（<毫秒>-<序號>）：重連時帶給伺服器補送斷線期間的事件
+  let lastEventId = null;
+  let retryDelay = 1000;
+
+  function isNewerEventId(a, b) {
+    if (!b) return true;
+    const [am, as] = a.split("-").map(Number);
+    const [bm, bs] = b.split("-").map(Number);
+    return am > bm || (am === bm && as > bs);
+  }
+
+  // 二進位 frame（msgpack + 短鍵，見 apps/motry/frames.py）；不支援時伺服器選 JSON
+  const SUBPROTOCOLS = [
+    ...(typeof DecompressionStream !== "undefined" ? ["motry.msgpack+deflate.v1"] : []),
+    "motry.msgpack.v1",
+    "motry.json.v1",
+  ];
+  const EVENT_KEYS = { k: "type", i: "event_id", p: "post_id", h: "title", a: "actor", c: "count", r: "replayed" };
+  const KIND_NAMES = { 1: "new_post", 2: "new_comment", 3: "new_like" };
+  const utf8 = new TextDecoder();
+
+  // 只實作伺服器會用到的 msgpack 型別（nil / bool / 整數 / 浮點 / 字串 / 陣列 / map）
+  function unpack(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let offset = 0;
+    const str = (length) => {
+      const value = utf8.decode(bytes.subarray(offset, offset + length));
+      offset += length;
+      return value;
+    };
+    const array = (length) => Array.from({ length }, () => read());
+    const map = (length) => {
+      const result = {};
+      for (let i = 0; i < length; i += 1) {
+        const key = read();
+        result[key] = read();
+      }
+      return result;
+    };
+    const take = (size, getter) => {
+      const value = getter.call(view, offset);
+      offset += size;
+      return value;
+    };
+    function read() {
+      const byte = bytes[offset++];
+      if (byte <= 0x7f) return byte;
+      if (byte >= 0xe0) return byte - 0x100;
+      if ((byte & 0xf0) === 0x80) return map(byte & 0x0f);
+      if ((byte & 0xf0) === 0x90) return array(byte & 0x0f);
+      if ((byte & 0xe0) === 0xa0) return str(byte & 0x1f);
+      switch (byte) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xca: return take(4, view.getFloat32);
+        case 0xcb: return take(8, view.getFloat64);
+        case 0xcc: return take(1, view.getUint8);
+        case 0xcd: return take(2, view.getUint16);
+        case 0xce: return take(4, view.getUint32);
+        case 0xcf: return Number(take(8, view.getBigUint64));
+        case 0xd0: return take(1, view.getInt8);
+        case 0xd1: return take(2, view.getInt16);
+        case 0xd2: return take(4, view.getInt32);
+        case 0xd3: return Number(take(8, view.getBigInt64));
+        case 0xd9: return str(take(1, view.getUint8));
+        case 0xda: return str(take(2, view.getUint16));
+        case 0xdb: return str(take(4, view.getUint32));
+        case 0xdc: return array(take(2, view.getUint16));
+        case 0xdd: return array(take(4, view.getUint32));
+        case 0xde: return map(take(2, view.getUint16));
+        case 0xdf: return map(take(4, view.getUint32));
+        default: throw new Error(`unsupported msgpack type 0x${byte.toString(16)}`);
+      }
+    }
+    return read();
+  }
+
+  async function inflateRaw(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate-raw"));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+  }
+
+  // 還原成與 JSON frame 相同的結構
+  function expandFrame(compact) {
+    if (compact.t) return { type: "replay_truncated" };
+    const vehicles = compact.v || {};
+    const events = (compact.e || []).map((item) => {
+      const event = {};
+      Object.entries(item).forEach(([key, value]) => {
+        if (key === "v") event.vehicle = { id: value, name: vehicles[value] };
+        else if (key === "k") event.type = KIND_NAMES[value] || value;
+        else event[EVENT_KEYS[key] || key] = value;
+      });
+      return event;
+    });
+    return { type: "batch", events, dropped: compact.d };
+  }
+
+  async function decodeFrame(data, protocol) {
+    if (typeof data === "string") return JSON.parse(data || "{}");
+    let bytes = new Uint8Array(data);
+    if (protocol === "motry.msgpack+deflate.v1") {
+      bytes = bytes[0] === 1 ? await inflateRaw(bytes.subarray(1)) : bytes.subarray(1);
+    }
+    return expandFrame(unpack(bytes));
+  }
+
+  // 解壓縮是非同步的，依序處理以維持事件順序
+  let decoding = Promise.resolve();
+
   function handleMessage(event) {
-    try {
-      const data = JSON.parse(event.data || "{}");
-      if (data.type === "new_post") {
-        const vehicle = data.vehicle?.name || "車輛";
-        showToast(`新貼文：${vehicle} — ${data.title || "新分享"}`);
+    const protocol = event.target.protocol;
+    decoding = decoding
+      .then(() => decodeFrame(event.data, protocol))
+      .then(dispatch)
+      .catch((err) => console.warn("[Motry] 無法解析 WebSocket 訊息", err));
+  }
+
+  function dispatch(data) {
+    // 伺服器在短時間內收到多筆事件時合併成一個 batch frame
+    if (data.type === "batch") {
+      (data.events || []).forEach(handleEvent);
+      if (data.dropped) {
+        showToast("通知過多，部分通知未顯示，請重新整理頁面查看最新內容");
       }
-    } catch (err) {
-      console.warn("[Motry] 無法解析 WebSocket 訊息", err);
+      return;
+    }
+    handleEvent(data);
+  }
+
+  function handleEvent(data) {
+    if (data.type === "replay_truncated") {
+      showToast("離線期間的通知較多，請重新整理頁面查看最新內容");
+      return;
+    }
+    if (data.event_id && isNewerEventId(data.event_id, lastEventId)) {
+      lastEventId = data.event_id;
+    }
+    if (["new_post", "new_comment", "new_like"].includes(data.type)) {
+      bumpBadge();
+    }
+    const vehicle = data.vehicle?.name || "車輛";
+    // 同一篇貼文的多筆留言 / 按讚會合併，count 為合併筆數
+    const actor = (data.actor || "有人") + (data.count > 1 ? ` 等 ${data.count} 則` : "");
+    if (data.type === "new_post") {
+      showToast(`新貼文：${vehicle} — ${data.title || "新分享"}`);
+    } else if (data.type === "new_comment") {
+      showToast(`${actor} 留言了你的貼文：${data.title || vehicle}`);
+    } else if (data.type === "new_like") {
+      showToast(`${actor} 對你的貼文按讚：${data.title || vehicle}`);
     }
   }
 
@@ -60,13 +210,30 @@
       console.warn("[Motry] 瀏覽器不支援 WebSocket，略過即時通知。");
       return;
     }
+    // 未登入（導覽列沒有通知徽章）時不連線
+    if (!document.querySelector("[data-notification-badge]")) return;
 
     try {
-      const socket = new WebSocket(WS_PATH);
+      const url = lastEventId ? `${WS_PATH}?last_event_id=${encodeURIComponent(lastEventId)}` : WS_PATH;
+      const socket = new WebSocket(url, SUBPROTOCOLS);
+      socket.binaryType = "arraybuffer";
       socket.onmessage = handleMessage;
+      socket.onopen = () => {
+        retryDelay = 1000;
+        // 車輛頁面：訂閱該車的新貼文（最愛 / 車庫的車輛由伺服器端自動訂閱）
+        const page = document.querySelector("[data-notify-vehicle]");
+        const vehicleId = page ? parseInt(page.dataset.notifyVehicle, 10) : NaN;
+        if (!Number.isNaN(vehicleId)) {
+          socket.send(JSON.stringify({ action: "watch", vehicle_id: vehicleId, last_event_id: lastEventId }));
+        }
+      };
       socket.onerror = (e) => console.warn("[Motry] 通知 WebSocket 錯誤", e);
-      socket.onclose = () =>
-        console.warn("[Motry] 通知 WebSocket 已關閉，稍後可重新整理再試。");
+      socket.onclose = (e) => {
+        if (e.code === 4001) return; // 未登入
+        // 斷線後以指數退避重連，重連時補送期間的事件
+        setTimeout(initWebSocket, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, 30000);
+      };
     } catch (err) {
       console.warn("[Motry] 無法建立 WebSocket 連線", err);
     }
@@ -0,0 +1,144 @@
+"""
+背景任務事件推播（取代前端輪詢 export_task_status）。
+
+Celery 任務透過 Channels 將進度 / 完成 / 失敗事件推送到
+發起者專屬的 group（``motry_tasks_u<user_id>``），由 ``TaskEventConsumer`` 轉送給瀏覽器。
+``/api/export/status/<task_id>/`` 仍保留作為 WebSocket 不可用時的備援。
+
+只有帶 ``user_id`` kwarg 的任務會推播（目前為 export_vehicles_to_csv）。其他使用者以相同條件
+匯出、經冪等鍵共用同一個 task id 時，會以 ``add_task_subscriber`` 登記，事件同時推送到他們的 group。
+"""
+
+from __future__ import annotations
+
+import logging
+
+from asgiref.sync import async_to_sync
+from celery.signals import task_failure, task_success
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache_keys import TASK_SUBSCRIBERS_CACHE_KEY
+from .caching import _redis_client
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENT_TYPE = "task.event"
+TASK_STATS_TIMEOUT = 60 * 60 * 24 * 2
+TASK_SUBSCRIBERS_TIMEOUT = 60 * 60  # 需長於匯出冪等鍵（EXPORT_INFLIGHT_TIMEOUT）
+
+# 每日計數器：比較 WebSocket 推播與輪詢次數，觀察輪詢負載是否下降
+TASK_STATUS_POLLS = "task-status-polls"
+TASK_EVENTS_PUSHED = "task-events-pushed"
+
+
+def task_events_group(user_id: int) -> str:
+	return f"motry_tasks_u{user_id}"
+
+
+def _counter_key(name: str, day: str | None = None) -> str:
+	day = day or timezone.localdate().strftime("%Y%m%d")
+	return f"motry:stats:{name}:{day}"
+
+
+def bump_counter(name: str) -> None:
+	key = _counter_key(name)
+	if cache.add(key, 1, TASK_STATS_TIMEOUT):
+		return
+	try:
+		cache.incr(key)
+	except ValueError:
+		# 計數器剛好過期：重新建立即可，統計值允許少量誤差
+		cache.set(key, 1, TASK_STATS_TIMEOUT)
+
+
+def get_counters(day: str | None = None) -> dict[str, int]:
+	names = (TASK_STATUS_POLLS, TASK_EVENTS_PUSHED)
+	return {name: cache.get(_counter_key(name, day)) or 0 for name in names}
+
+
+def add_task_subscriber(task_id: str, user_id: int) -> None:
+	"""登記共用同一個 task 的使用者（Redis 為 SADD，locmem 為讀改寫）。"""
+	key = TASK_SUBSCRIBERS_CACHE_KEY.format(task_id=task_id)
+	client = _redis_client()
+	if client is not None:
+		redis_key = cache.make_key(key)
+		pipe = client.pipeline()
+		pipe.sadd(redis_key, user_id)
+		pipe.expire(redis_key, TASK_SUBSCRIBERS_TIMEOUT)
+		pipe.execute()
+		return
+	subscribers = cache.get(key) or set()
+	subscribers.add(user_id)
+	cache.set(key, subscribers, TASK_SUBSCRIBERS_TIMEOUT)
+
+
+def task_subscribers(task_id: str) -> set[int]:
+	key = TASK_SUBSCRIBERS_CACHE_KEY.format(task_id=task_id)
+	client = _redis_client()
+	if client is not None:
+		return {int(member) for member in client.smembers(cache.make_key(key))}
+	return set(cache.get(key) or ())
+
+
+def publish_task_event(user_id: int | None, task_id: str, status: str, **payload) -> None:
+	"""推送任務事件到發起者與其他登記者的 group；沒有 channel layer 或接收者時略過。"""
+	channel_layer = get_channel_layer()
+	if not channel_layer:
+		return
+	try:
+		recipients = task_subscribers(task_id)
+	except Exception as e:
+		logger.warning(f"讀取任務訂閱者失敗 {task_id}: {e}")
+		recipients = set()
+	if user_id:
+		recipients.add(user_id)
+	if not recipients:
+		return
+
+	message = {
+		"type": TASK_EVENT_TYPE,
+		"task_id": task_id,
+		"status": status,
+		**payload,
+	}
+	for recipient in sorted(recipients):
+		try:
+			async_to_sync(channel_layer.group_send)(task_events_group(recipient), message)
+		except Exception as e:
+			# 推播失敗不影響任務本身，前端仍可輪詢狀態端點
+			logger.warning(f"任務事件推播失敗 {task_id}: {e}")
+			continue
+		bump_counter(TASK_EVENTS_PUSHED)
+
+
+def _task_user_id(sender) -> int | None:
+	request = getattr(sender, "request", None)
+	kwargs = getattr(request, "kwargs", None) or {}
+	return kwargs.get("user_id")
+
+
+@task_success.connect
+def push_task_success(sender=None, result=None, **kwargs):
+	user_id = _task_user_id(sender)
+	if not user_id:
+		return
+
+	payload = {"result": result}
+	if isinstance(result, dict) and "path" in result:
+		from .exports import export_file_url
+
+		payload = {
+			"result": export_file_url(result["path"]),
+			"stats": {k: v for k, v in result.items() if k != "path"},
+		}
+	publish_task_event(user_id, sender.request.id, "SUCCESS", **payload)
+
+
+@task_failure.connect
+def push_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+	user_id = _task_user_id(sender)
+	if not user_id:
+		return
+	publish_task_event(user_id, task_id, "FAILURE", result=str(exception))
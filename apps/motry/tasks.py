@@ -2,89 +2,190 @@
 Celery 任務定義（Week 13）
 
 提供背景任務與定時任務：
-- export_vehicles_to_csv: 匯出車輛清單 CSV（背景任務）
+- export_vehicles_to_csv: 串流匯出車輛清單 CSV / JSONL / Parquet（背景任務）
+- export_catalog_sharded: 分片平行匯出車款 + 貼文 + 評分為 zip（Celery chord）
 - cleanup_old_exports: 清理過期匯出檔案（定時任務）
 - refresh_brand_cache: 重新整理品牌快取（定時任務）
+- purge_vehicle_tombstones: 清理過期的車輛刪除紀錄（定時任務）
+- fanout_new_post: 新貼文通知寫入訂閱者收件匣並推播（背景任務）
+- reconcile_unread_counters: 以 DB 校正通知未讀數計數器（定時任務）
+- renormalize_trending_scores: 熱門趨勢分數換算與修剪（定時任務）
+- refresh_vehicle_neighbors: 重算規格相似車款（每日全量，或指定車款增量）
+- refresh_pending_vehicle_neighbors: 合併一段時間內變更的車款後增量重算相似車款（背景任務）
+- rebuild_recommendations: 重算協同過濾推薦（定時任務）
 - sync_motorcycles_task: 同步機車資料（定時任務）
 """
 
-import csv
 import logging
 import os
+import shutil
+from dataclasses import asdict
 from datetime import timedelta
 from io import StringIO
 from pathlib import Path
 
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
 from django.core.cache import cache
 from django.core.management import call_command
 from django.utils import timezone
 
-from .models import Vehicle
+from .cache_keys import NEIGHBOR_REFRESH_PENDING_KEY, NEIGHBOR_REFRESH_SCHEDULED_KEY
+from .caching import _redis_client
+
+from .exports import (
+	DEFAULT_CHUNK_SIZE,
+	EXPORT_FORMATS,
+	export_filename,
+	release_export,
+	run_export,
+	store_cached_export,
+	validate_format,
+)
+from .sharded_export import Shard, merge_shards, plan_shards, write_shard
+from .task_events import publish_task_event
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True)
-def export_vehicles_to_csv(self, user_id: int | None = None) -> str:
+def export_vehicles_to_csv(
+	self,
+	user_id: int | None = None,
+	fmt: str = "csv",
+	columns: list[str] | None = None,
+	filters: dict | None = None,
+	chunk_size: int = DEFAULT_CHUNK_SIZE,
+	digest: str | None = None,
+) -> dict:
 	"""
-	匯出車輛列表為 CSV 檔案，交由 Celery Worker 背景執行。
+	匯出車輛列表，交由 Celery Worker 背景執行。
+
+	以串流方式讀取資料（不建立 Model instance），支援 csv / csv.gz / jsonl / parquet。
 
 	Args:
 		self: Celery task instance（因為 bind=True，可存取 request/id）
 		user_id: 可選，發起匯出請求的使用者 ID（暫供記錄）
+		fmt: 匯出格式，見 ``exports.EXPORT_FORMATS``
+		columns: 匯出欄位 key，預設為 ``exports.DEFAULT_EXPORT_COLUMNS``
+		filters: 與搜尋頁相同的篩選條件（query / brand / displacement_min ...）
+		chunk_size: 每批自資料庫讀取的筆數
+		digest: 可選，``exports.export_fingerprint`` 的結果；提供時檔名依內容命名，
+			完成後寫入結果快取並釋放執行中的冪等鍵
 
 	Returns:
-		str: 產出的檔案絕對路徑
+		dict: 產出的檔案路徑與統計資料（rows / rows_per_sec / rss_growth_kb ...）
+
+	進度與完成事件會推送到發起者的 WebSocket group（見 ``task_events``）。
 	"""
+	validate_format(fmt)
 
 	export_dir = Path(settings.MEDIA_ROOT) / "exports"
 	export_dir.mkdir(parents=True, exist_ok=True)
 
-	timestamp = timezone.localtime(timezone.now()).strftime("%Y%m%d_%H%M%S")
-	filename = f"vehicle_report_{timestamp}.csv"
-	if user_id:
-		filename = f"vehicle_report_u{user_id}_{timestamp}.csv"
+	if digest:
+		filename = export_filename(digest, fmt)
+	else:
+		timestamp = timezone.localtime(timezone.now()).strftime("%Y%m%d_%H%M%S")
+		filename = f"vehicle_report_{timestamp}{EXPORT_FORMATS[fmt]}"
+		if user_id:
+			filename = f"vehicle_report_u{user_id}_{timestamp}{EXPORT_FORMATS[fmt]}"
+
+	def report_progress(rows: int) -> None:
+		# 同時更新 result backend（輪詢備援）並透過 WebSocket 推播
+		if self.request.id:
+			self.update_state(state="PROGRESS", meta={"rows": rows})
+		publish_task_event(user_id, self.request.id, "PROGRESS", rows=rows)
 
 	file_path = export_dir / filename
+	try:
+		stats = run_export(
+			file_path,
+			fmt=fmt,
+			columns=columns,
+			filters=filters,
+			chunk_size=chunk_size,
+			progress=report_progress,
+		)
+		stats["path"] = os.fspath(file_path)
+		if digest:
+			stats["task_id"] = self.request.id
+			store_cached_export(digest, stats)
+	finally:
+		if digest:
+			release_export(digest)
+
+	logger.info(
+		f"車輛匯出完成: {stats['rows']} 筆, {stats['rows_per_sec']} rows/s, "
+		f"peak RSS +{stats['rss_growth_kb']} KB (worker peak {stats['peak_rss_kb']} KB)"
+	)
+	return stats
 
-	headers = [
-		"ID",
-		"Brand",
-		"Model",
-		"Generation",
-		"Years",
-		"Displacement_cc",
-		"Cylinders",
-		"Horsepower_ps",
-		"MSRP_new",
-	]
-
-	with open(file_path, "w", newline="", encoding="utf-8-sig") as csvfile:
-		writer = csv.writer(csvfile)
-		writer.writerow(headers)
-
-		for vehicle in Vehicle.objects.order_by("brand", "model").iterator():
-			years = f"{vehicle.years_from or ''}"
-			if vehicle.years_to:
-				years = f"{years}-{vehicle.years_to}" if years else str(vehicle.years_to)
-
-			writer.writerow(
-				[
-					vehicle.id,
-					vehicle.brand,
-					vehicle.model,
-					vehicle.generation,
-					years,
-					vehicle.displacement_cc,
-					vehicle.cylinders,
-					vehicle.horsepower_ps,
-					vehicle.msrp_new,
-				]
-			)
 
-	return os.fspath(file_path)
+@shared_task
+def export_catalog_shard(shard: dict, parts_dir: str) -> dict:
+	"""chord header：寫出單一分片（見 ``sharded_export.write_shard``）。"""
+	return write_shard(Shard(**shard), parts_dir)
+
+
+@shared_task
+def merge_catalog_shards(parts: list[dict], parts_dir: str, zip_path: str, user_id: int | None = None) -> dict:
+	"""chord body：串接所有分片為 zip，並清除分片暫存目錄。"""
+	try:
+		missing = [part["path"] for part in parts if not Path(part["path"]).exists()]
+		if missing:
+			# 分片寫在其他 worker 的本機磁碟：MEDIA_ROOT 未在 worker 之間共用
+			raise FileNotFoundError(f"找不到 {len(missing)} 個分片檔（MEDIA_ROOT 需為所有 worker 共用的儲存空間）：{missing[0]}")
+		result = merge_shards(parts, Path(zip_path))
+	finally:
+		shutil.rmtree(parts_dir, ignore_errors=True)
+	logger.info(f"分片匯出完成: {result['total_rows']} 筆, {len(parts)} 個分片")
+	return result
+
+
+@shared_task(bind=True)
+def export_catalog_sharded(
+	self,
+	user_id: int | None = None,
+	shards: int = 4,
+	merge_task_id: str | None = None,
+) -> dict:
+	"""
+	分片平行匯出車款目錄與社群資料（貼文、評分）。
+
+	依 id 區間切分後以 Celery chord 分派給多個 worker 同時寫出，
+	最後由 merge_catalog_shards 串接成 zip。
+
+	分片以本機路徑寫在 ``MEDIA_ROOT/exports/<job>.parts``，合併任務再從同一路徑讀取：
+	所有執行這三個任務的 worker 必須共用同一個 MEDIA_ROOT（同一台主機，或掛載相同的 NFS / 共用 volume）。
+	不符合時合併任務會以 FileNotFoundError 失敗，不會產生缺少分片的 zip。
+
+	Args:
+		user_id: 可選，發起者 ID；完成事件會推播到其 WebSocket group
+		shards: 每個資料集的分片數
+		merge_task_id: 可選，預先指定合併任務的 task id，讓前端直接追蹤最終結果
+
+	Returns:
+		dict: 合併任務的 task id 與分片數
+	"""
+	export_dir = Path(settings.MEDIA_ROOT) / "exports"
+	job = f"catalog_{timezone.localtime(timezone.now()).strftime('%Y%m%d_%H%M%S')}_{self.request.id or 'local'}"
+	parts_dir = export_dir / f"{job}.parts"
+	parts_dir.mkdir(parents=True, exist_ok=True)
+	zip_path = export_dir / f"{job}.zip"
+
+	plan = plan_shards(shards)
+	merge = merge_catalog_shards.s(os.fspath(parts_dir), os.fspath(zip_path), user_id=user_id)
+	if merge_task_id:
+		merge = merge.set(task_id=merge_task_id)
+
+	if plan:
+		header = [export_catalog_shard.s(asdict(shard), os.fspath(parts_dir)) for shard in plan]
+		merge_result = chord(header)(merge)
+	else:
+		merge_result = merge.apply_async(args=([],))
+
+	return {"merge_task_id": merge_result.id, "shards": len(plan)}
 
 
 @shared_task
@@ -106,7 +207,9 @@ def cleanup_old_exports(days: int = 7) -> dict:
 	deleted_count = 0
 	error_count = 0
 
-	for file_path in export_dir.glob("*.csv"):
+	for file_path in export_dir.iterdir():
+		if not file_path.is_file() or not file_path.name.endswith((*EXPORT_FORMATS.values(), ".zip")):
+			continue
 		try:
 			# 取得檔案修改時間
 			mtime = timezone.datetime.fromtimestamp(
@@ -128,6 +231,177 @@ def cleanup_old_exports(days: int = 7) -> dict:
 	}
 
 
+@shared_task
+def purge_vehicle_tombstones(days: int | None = None) -> dict:
+	"""
+	定時任務：刪除超過保留期限的車輛刪除紀錄。
+
+	updated_since 早於保留期限的客戶端會收到 full_resync_required，因此可以安全刪除。
+	"""
+	from .models import VehicleTombstone
+	from .vehicle_list import TOMBSTONE_RETENTION_DAYS
+
+	cutoff = timezone.now() - timedelta(days=days or TOMBSTONE_RETENTION_DAYS)
+	deleted, _ = VehicleTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+	logger.info(f"已清理 {deleted} 筆車輛刪除紀錄")
+	return {"deleted": deleted}
+
+
+@shared_task
+def fanout_new_post(post_id: int) -> dict:
+	"""
+	背景任務：新貼文通知。
+
+	由 ``signals.notify_new_post`` 在交易提交後排入；分批寫入收藏 / 擁有該車使用者的
+	Notification，再推播到車輛 group。
+	"""
+	from .models import Post
+	from .notifications import create_post_notifications, publish_new_post
+
+	post = Post.objects.select_related("vehicle").filter(pk=post_id, is_deleted=False).first()
+	if post is None:
+		return {"post_id": post_id, "notified": 0}
+
+	notified = create_post_notifications(post)
+	publish_new_post(post)
+	logger.info(f"貼文 {post_id} 已通知 {notified} 位使用者")
+	return {"post_id": post_id, "notified": notified}
+
+
+@shared_task
+def reconcile_unread_counters(days: int = 7, batch_size: int = 1000) -> dict:
+	"""
+	定時任務：以 DB 覆寫通知未讀數計數器。
+
+	對象為近 days 天收到通知或仍有未讀通知的使用者（走 (user, is_read, created_at) 索引）。
+	"""
+	from django.db.models import Q
+
+	from .inbox import reconcile_unread
+	from .models import Notification
+
+	cutoff = timezone.now() - timedelta(days=days)
+	user_ids = (
+		Notification.objects.filter(Q(created_at__gte=cutoff) | Q(is_read=False))
+		.order_by("user_id")
+		.values_list("user_id", flat=True)
+		.distinct()
+	)
+	users = 0
+	batch = []
+	for user_id in user_ids.iterator(chunk_size=batch_size):
+		batch.append(user_id)
+		if len(batch) >= batch_size:
+			users += reconcile_unread(batch)
+			batch = []
+	users += reconcile_unread(batch)
+	logger.info(f"已校正 {users} 位使用者的未讀通知數")
+	return {"users": users}
+
+
+@shared_task
+def renormalize_trending_scores() -> dict:
+	"""
+	定時任務：把熱門趨勢分數換算回目前時間並移除冷門成員。
+
+	sorted set 不存在（Redis 清空、初次部署）時以最近一週的 DB 資料重建。
+	"""
+	from .trending import TRENDING_KINDS, renormalize_trending
+
+	result = {kind: renormalize_trending(kind) for kind in TRENDING_KINDS}
+	logger.info(f"熱門趨勢分數已更新: {result}")
+	return result
+
+
+@shared_task
+def refresh_vehicle_neighbors(vehicle_ids: list[int] | None = None) -> dict:
+	"""
+	重算規格相似車款（見 ``similarity``）。
+
+	Args:
+		vehicle_ids: 變更（新增 / 修改 / 刪除）的車款；省略時重算整個目錄（每日定時任務）
+	"""
+	from .similarity import rebuild_neighbors, refresh_neighbors
+
+	result = refresh_neighbors(vehicle_ids) if vehicle_ids else rebuild_neighbors()
+	logger.info(f"相似車款已更新: {result}")
+	return result
+
+
+# 車款變更後等待多久才重算相似車款；期間的變更合併成一次（sync_motorcycles 一次更新整個目錄）
+NEIGHBOR_REFRESH_DELAY = 120
+NEIGHBOR_REFRESH_PENDING_TIMEOUT = 60 * 60 * 24
+
+
+def queue_neighbor_refresh(vehicle_ids) -> None:
+	"""
+	把變更的車款加入待重算集合（Redis 為 SADD，locmem 為讀改寫），
+	目前沒有排定的任務時才排一個延遲 NEIGHBOR_REFRESH_DELAY 秒的 ``refresh_pending_vehicle_neighbors``。
+	"""
+	vehicle_ids = [int(vehicle_id) for vehicle_id in vehicle_ids]
+	if not vehicle_ids:
+		return
+	client = _redis_client()
+	if client is not None:
+		redis_key = cache.make_key(NEIGHBOR_REFRESH_PENDING_KEY)
+		pipe = client.pipeline()
+		pipe.sadd(redis_key, *vehicle_ids)
+		pipe.expire(redis_key, NEIGHBOR_REFRESH_PENDING_TIMEOUT)
+		pipe.execute()
+	else:
+		pending = cache.get(NEIGHBOR_REFRESH_PENDING_KEY) or set()
+		pending.update(vehicle_ids)
+		cache.set(NEIGHBOR_REFRESH_PENDING_KEY, pending, NEIGHBOR_REFRESH_PENDING_TIMEOUT)
+
+	if not cache.add(NEIGHBOR_REFRESH_SCHEDULED_KEY, 1, NEIGHBOR_REFRESH_PENDING_TIMEOUT):
+		return
+	try:
+		refresh_pending_vehicle_neighbors.apply_async(countdown=NEIGHBOR_REFRESH_DELAY)
+	except Exception:
+		# 排程失敗時釋放標記，下一次變更會再嘗試；每日全量重算也會補上
+		cache.delete(NEIGHBOR_REFRESH_SCHEDULED_KEY)
+		raise
+
+
+def _drain_pending_neighbors() -> set[int]:
+	client = _redis_client()
+	if client is not None:
+		redis_key = cache.make_key(NEIGHBOR_REFRESH_PENDING_KEY)
+		pipe = client.pipeline(transaction=True)
+		pipe.smembers(redis_key)
+		pipe.delete(redis_key)
+		members, _ = pipe.execute()
+		return {int(member) for member in members}
+	pending = cache.get(NEIGHBOR_REFRESH_PENDING_KEY) or set()
+	cache.delete(NEIGHBOR_REFRESH_PENDING_KEY)
+	return set(pending)
+
+
+@shared_task
+def refresh_pending_vehicle_neighbors() -> dict:
+	"""取出待重算集合中的車款，一次增量重算相似車款（見 ``queue_neighbor_refresh``）。"""
+	from .similarity import refresh_neighbors
+
+	# 先清除排程標記：重算期間的新變更會排入下一個任務
+	cache.delete(NEIGHBOR_REFRESH_SCHEDULED_KEY)
+	vehicle_ids = _drain_pending_neighbors()
+	if not vehicle_ids:
+		return {"vehicles": 0, "rows": 0}
+	result = refresh_neighbors(vehicle_ids)
+	logger.info(f"相似車款已增量更新（{len(vehicle_ids)} 台變更）: {result}")
+	return result
+
+
+@shared_task
+def rebuild_recommendations() -> dict:
+	"""定時任務：以收藏 / 車庫 / 評分重算「車友也喜歡」與個人化推薦（見 ``recommendations``）。"""
+	from .recommendations import rebuild_recommendations as rebuild
+
+	result = rebuild()
+	logger.info(f"推薦清單已更新: {result}")
+	return result
+
+
 @shared_task
 def refresh_brand_cache() -> dict:
 	"""
@@ -139,11 +413,12 @@ def refresh_brand_cache() -> dict:
 		dict: 快取更新結果
 	"""
 	from .cache_keys import BRAND_MAP_CACHE_KEY
-	from .context_processors import _build_brand_list, BRAND_MAP_CACHE_TTL
+	from .caching import set_fresh
+	from .context_processors import _build_brand_list, BRAND_MAP_CACHE_HARD_TTL, BRAND_MAP_CACHE_TTL
 
 	try:
 		brand_list = _build_brand_list()
-		cache.set(BRAND_MAP_CACHE_KEY, brand_list, BRAND_MAP_CACHE_TTL)
+		set_fresh(BRAND_MAP_CACHE_KEY, brand_list, BRAND_MAP_CACHE_TTL, BRAND_MAP_CACHE_HARD_TTL)
 
 		brand_count = len(brand_list)
 
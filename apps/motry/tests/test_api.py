@@ -4,10 +4,20 @@ API 端點測試
 測試所有 AJAX API 端點的回應格式、狀態碼、權限控制。
 """
 
+import datetime
+import gzip
 import json
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from apps.motry.models import (
@@ -16,8 +26,30 @@ from apps.motry.models import (
     Comment,
     UserVehicle,
     FavoriteVehicle,
+    Like,
     Rating,
+    Notification,
+    PostTag,
+    Tag,
+    RelatedVehicle,
+    UserRecommendation,
+    VehicleTombstone,
 )
+from apps.core.tasks import refresh_home_document
+from apps.motry.inbox import get_unread_count
+from apps.motry.json_response import accepts_gzip, dumps
+from apps.motry.recommendations import rebuild_recommendations
+from apps.motry.tasks import reconcile_unread_counters, renormalize_trending_scores
+from apps.motry.trending import (
+    EVENT_WEIGHTS,
+    TRENDING_HALF_LIFE,
+    TRENDING_VEHICLES,
+    LocalTrending,
+    local_trending,
+    top_trending,
+)
+from apps.motry.ratelimit import LocalGCRA, is_ratelimited, local_limiter
+from apps.motry.signals import muted_signals
 
 User = get_user_model()
 
@@ -27,6 +59,7 @@ class VehicleListAPITests(TestCase):
 
     def setUp(self):
         self.client = Client()
+        cache.clear()
         # 創建測試車輛
         Vehicle.objects.create(brand="Toyota", model="Camry")
         Vehicle.objects.create(brand="Honda", model="Accord")
@@ -60,6 +93,166 @@ class VehicleListAPITests(TestCase):
         for field in expected_fields:
             self.assertIn(field, vehicle)
 
+    def test_vehicle_list_api_gzip(self):
+        """測試支援 gzip 的客戶端直接拿到快取中的壓縮內容"""
+        Vehicle.objects.bulk_create(
+            [Vehicle(brand="Kawasaki", model=f"Ninja {i}") for i in range(30)]
+        )
+        plain = self.client.get(reverse("api_vehicle_list"))
+        compressed = self.client.get(reverse("api_vehicle_list"), HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(compressed["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(len(json.loads(plain.content)["data"]["vehicles"]), 33)
+
+        refused = self.client.get(reverse("api_vehicle_list"), HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+        self.assertNotIn("Content-Encoding", refused)
+        self.assertEqual(refused.content, plain.content)
+
+    def test_accepts_gzip_qvalues(self):
+        """測試 Accept-Encoding 的 q 值解析"""
+        factory = RequestFactory()
+        cases = {
+            "gzip": True,
+            "gzip, deflate, br": True,
+            "GZIP;q=0.5": True,
+            "gzip;q=0": False,
+            "gzip; q=0.000": False,
+            "br, gzip;q=0": False,
+            "*": True,
+            "*;q=0": False,
+            "gzip;q=0, *": False,
+            "identity": False,
+            "": False,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertIs(accepts_gzip(factory.get("/", HTTP_ACCEPT_ENCODING=header)), expected)
+
+    def test_dumps_matches_stdlib_fallback(self):
+        """測試 orjson 與標準庫路徑輸出相同的 bytes（datetime 截到毫秒，與 JsonResponse 相同）"""
+        payload = {
+            "at": datetime.datetime(2024, 5, 1, 8, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2024, 5, 1),
+            "price": Decimal("12.50"),
+            "id": uuid.UUID(int=1),
+            "name": "重機",
+        }
+        encoded = dumps(payload)
+        with mock.patch("apps.motry.json_response.orjson", None):
+            self.assertEqual(encoded, dumps(payload))
+        self.assertEqual(json.loads(encoded)["at"], "2024-05-01T08:30:15.123Z")
+
+    def test_vehicle_list_api_served_from_cache(self):
+        """測試命中快取時不查詢資料庫"""
+        self.client.get(reverse("api_vehicle_list"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("api_vehicle_list"))
+        self.assertEqual(response.status_code, 200)
+
+
+class VehicleListPaginationTests(TestCase):
+    """車輛列表 API 分頁、欄位選擇與增量同步測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("api_vehicle_list")
+        self.vehicles = [
+            Vehicle.objects.create(brand=brand, model=model, horsepower_ps=hp)
+            for brand, model, hp in [
+                ("Honda", "CB650R", 95),
+                ("Honda", "Rebel 500", 47),
+                ("Kawasaki", "Ninja 400", 45),
+                ("Yamaha", "MT-07", 73),
+                ("Yamaha", "R1", 200),
+            ]
+        ]
+
+    def _get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["data"]
+
+    def test_cursor_pagination_walks_all_pages(self):
+        """測試依 next_cursor 取完所有頁面，順序與筆數正確且不重複"""
+        seen = []
+        data = self._get(limit=2)
+        while True:
+            seen.extend((v["brand"], v["model"]) for v in data["vehicles"])
+            if not data["next_cursor"]:
+                break
+            data = self._get(limit=2, cursor=data["next_cursor"])
+
+        self.assertEqual(seen, sorted((v.brand, v.model) for v in self.vehicles))
+
+    def test_fields_projection(self):
+        """測試 fields 只回傳指定欄位（id 一律包含）"""
+        data = self._get(fields="brand,horsepower_ps", limit=1)
+        self.assertEqual(set(data["vehicles"][0]), {"id", "brand", "horsepower_ps"})
+
+    def test_filters_match_search(self):
+        """測試篩選條件與搜尋頁相同"""
+        data = self._get(brand="yamaha", hp_min=100)
+        self.assertEqual([v["model"] for v in data["vehicles"]], ["R1"])
+
+    def test_invalid_params_return_400(self):
+        """測試錯誤參數回傳 400"""
+        for params in ({"fields": "intro_md"}, {"cursor": "not-a-cursor"}, {"updated_since": "yesterday"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertFalse(json.loads(response.content)["success"])
+
+    def test_delta_sync_returns_changes_and_tombstones(self):
+        """測試 updated_since 只回傳之後變動的車輛與被刪除的 id"""
+        since = self._get(updated_since="2000-01-01T00:00:00+00:00")["server_time"]
+
+        changed = self.vehicles[0]
+        changed.horsepower_ps = 100
+        changed.save()
+        deleted_id = self.vehicles[1].id
+        self.vehicles[1].delete()
+
+        data = self._get(updated_since=since)
+        self.assertEqual([v["id"] for v in data["vehicles"]], [changed.id])
+        self.assertEqual(data["deleted"], [deleted_id])
+        self.assertFalse(data["full_resync_required"])
+
+    def test_delta_sync_pages_tombstones(self):
+        """測試刪除紀錄與變動車輛一起依 next_cursor 分頁，每頁不超過 limit"""
+        since = self._get(updated_since="2000-01-01T00:00:00+00:00")["server_time"]
+        deleted_ids = [vehicle.id for vehicle in self.vehicles[:3]]
+        for vehicle in self.vehicles[:3]:
+            vehicle.delete()
+
+        deleted, pages = [], 0
+        data = self._get(updated_since=since, limit=2)
+        while True:
+            pages += 1
+            self.assertLessEqual(len(data["deleted"]), 2)
+            deleted.extend(data["deleted"])
+            if not data["next_cursor"]:
+                break
+            data = self._get(updated_since=since, limit=2, cursor=data["next_cursor"])
+
+        self.assertEqual(sorted(deleted), sorted(deleted_ids))
+        self.assertEqual(pages, 2)
+
+    def test_muted_signals_skip_tombstones(self):
+        """測試基準測試清除合成資料時不寫墓碑"""
+        with muted_signals(Vehicle):
+            Vehicle.objects.filter(brand="Yamaha").delete()
+        self.assertFalse(VehicleTombstone.objects.exists())
+        self.vehicles[0].delete()
+        self.assertEqual(VehicleTombstone.objects.count(), 1)
+
+    def test_cache_invalidated_on_vehicle_change(self):
+        """測試車輛變動後快取的頁面不再回傳舊資料"""
+        self.assertEqual(len(self._get()["vehicles"]), 5)
+        Vehicle.objects.create(brand="Suzuki", model="GSX-8S")
+        self.assertEqual(len(self._get()["vehicles"]), 6)
+
 
 class GarageAPITests(TestCase):
     """車庫 API 測試"""
@@ -220,6 +413,144 @@ class FavoriteAPITests(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class CollectionBatchAPITests(TestCase):
+    """最愛 / 車庫批次寫入 API 測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="batchuser", password="testpass123")
+        self.vehicles = [Vehicle.objects.create(brand="Yamaha", model=f"XSR{i}") for i in range(3)]
+        self.client.login(username="batchuser", password="testpass123")
+
+    def _ids(self, vehicles):
+        return ",".join(str(v.id) for v in vehicles)
+
+    def test_batch_add_reports_added_existing_missing(self):
+        """測試批次加入回報新增、已存在與不存在的車輛"""
+        FavoriteVehicle.objects.create(user=self.user, vehicle=self.vehicles[0])
+        response = self.client.post(
+            reverse("api_favorite_batch_add"),
+            {"vehicle_ids": f"{self._ids(self.vehicles)},999999"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(data["added"], [self.vehicles[1].id, self.vehicles[2].id])
+        self.assertEqual(data["existing"], [self.vehicles[0].id])
+        self.assertEqual(data["missing"], [999999])
+        self.assertEqual(FavoriteVehicle.objects.filter(user=self.user).count(), 3)
+
+    def test_batch_add_query_count(self):
+        """測試批次加入的查詢次數與筆數無關"""
+        with self.assertNumQueries(4):  # session + user + 車輛/既有項目 + bulk insert
+            self.client.post(reverse("api_garage_batch_add"), {"vehicle_ids": self._ids(self.vehicles)})
+        self.assertEqual(UserVehicle.objects.filter(user=self.user).count(), 3)
+
+    def test_single_add_query_count(self):
+        """測試單筆加入只有查詢車輛/既有項目與一次 INSERT ... RETURNING，回應帶有新項目 id"""
+        with self.assertNumQueries(4):  # session + user + 車輛/既有項目 + insert returning
+            response = self.client.post(reverse("api_favorite_add", kwargs={"vehicle_id": self.vehicles[0].id}))
+        self.assertEqual(response.status_code, 201)
+        favorite = FavoriteVehicle.objects.get(user=self.user, vehicle=self.vehicles[0])
+        self.assertEqual(json.loads(response.content)["favorite_id"], favorite.id)
+
+    def test_batch_remove(self):
+        """測試批次移除，指向車庫項目的貼文保留但解除關聯"""
+        entries = [UserVehicle.objects.create(user=self.user, vehicle=vehicle) for vehicle in self.vehicles[:2]]
+        post = Post.objects.create(vehicle=self.vehicles[0], user=self.user, user_vehicle=entries[0], body_text="hi")
+        response = self.client.post(
+            reverse("api_garage_batch_remove"),
+            {"vehicle_ids": self._ids(self.vehicles)},
+        )
+        data = json.loads(response.content)
+        self.assertEqual(data["removed"], [self.vehicles[0].id, self.vehicles[1].id])
+        self.assertEqual(data["missing"], [self.vehicles[2].id])
+        self.assertFalse(UserVehicle.objects.filter(user=self.user).exists())
+        post.refresh_from_db()
+        self.assertIsNone(post.user_vehicle_id)
+
+    def test_batch_remove_single_delete_and_notification(self):
+        """測試批次移除以單一 DELETE 完成，快取清除與訂閱重整通知各一次"""
+        for vehicle in self.vehicles:
+            FavoriteVehicle.objects.create(user=self.user, vehicle=vehicle)
+        layer = mock.Mock(group_send=mock.AsyncMock())
+        with (
+            mock.patch("apps.motry.notifications.get_channel_layer", return_value=layer),
+            self.captureOnCommitCallbacks(execute=True),
+            self.assertNumQueries(4),  # session + user + 車名 + DELETE
+        ):
+            response = self.client.post(reverse("api_favorite_batch_remove"), {"vehicle_ids": self._ids(self.vehicles)})
+        self.assertEqual(json.loads(response.content)["removed"], sorted(v.id for v in self.vehicles))
+        self.assertEqual(layer.group_send.await_count, 1)
+        self.assertFalse(FavoriteVehicle.objects.filter(user=self.user).exists())
+
+        # 沒有刪除任何項目時不通知
+        layer.group_send.reset_mock()
+        with mock.patch("apps.motry.notifications.get_channel_layer", return_value=layer):
+            self.client.post(reverse("api_favorite_batch_remove"), {"vehicle_ids": self._ids(self.vehicles)})
+        layer.group_send.assert_not_awaited()
+
+    def test_batch_requires_ids(self):
+        """測試未提供 vehicle_ids 回傳 400"""
+        response = self.client.post(reverse("api_favorite_batch_remove"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_single_add_missing_vehicle_returns_404(self):
+        """測試單筆加入不存在的車輛回傳 404"""
+        response = self.client.post(reverse("api_favorite_add", kwargs={"vehicle_id": 999999}))
+        self.assertEqual(response.status_code, 404)
+
+
+class MembershipAPITests(TestCase):
+    """批次狀態查詢 API 測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="memberuser", password="testpass123")
+        self.vehicles = [Vehicle.objects.create(brand="Honda", model=f"CB{i}") for i in range(4)]
+        self.post = Post.objects.create(vehicle=self.vehicles[0], user=self.user, body_text="hi")
+        FavoriteVehicle.objects.create(user=self.user, vehicle=self.vehicles[0])
+        UserVehicle.objects.create(user=self.user, vehicle=self.vehicles[1])
+        Rating.objects.create(user=self.user, vehicle=self.vehicles[2], score=4)
+        Like.objects.create(user=self.user, post=self.post)
+        self.url = reverse("api_membership")
+        self.ids = ",".join(str(v.id) for v in self.vehicles)
+        self.client.login(username="memberuser", password="testpass123")
+
+    def test_membership_requires_login(self):
+        """測試需要登入"""
+        self.client.logout()
+        response = self.client.get(self.url, {"vehicle_ids": self.ids})
+        self.assertEqual(response.status_code, 302)
+
+    def test_membership_returns_all_states(self):
+        """測試一次回傳最愛、車庫、評分與按讚狀態"""
+        response = self.client.get(self.url, {"vehicle_ids": self.ids, "post_ids": self.post.id})
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)["data"]
+        self.assertEqual(data["favorites"], [self.vehicles[0].id])
+        self.assertEqual(data["garage"], [self.vehicles[1].id])
+        self.assertEqual(data["ratings"], {str(self.vehicles[2].id): 4})
+        self.assertEqual(data["liked_posts"], [self.post.id])
+
+    def test_membership_cached_and_invalidated(self):
+        """測試重複查詢命中快取，寫入後快取失效"""
+        self.client.get(self.url, {"vehicle_ids": self.ids})
+        with self.assertNumQueries(2):  # session + user
+            self.client.get(self.url, {"vehicle_ids": self.ids})
+
+        FavoriteVehicle.objects.create(user=self.user, vehicle=self.vehicles[3])
+        data = json.loads(self.client.get(self.url, {"vehicle_ids": self.ids}).content)["data"]
+        self.assertEqual(data["favorites"], [self.vehicles[0].id, self.vehicles[3].id])
+
+    def test_membership_rejects_bad_ids(self):
+        """測試非整數或超過上限的 id 回傳 400"""
+        self.assertEqual(self.client.get(self.url, {"vehicle_ids": "1,abc"}).status_code, 400)
+        too_many = ",".join(str(i) for i in range(1, 302))
+        self.assertEqual(self.client.get(self.url, {"vehicle_ids": too_many}).status_code, 400)
+
+
 class RatingAjaxAPITests(TestCase):
     """評分 AJAX API 測試"""
 
@@ -383,11 +714,325 @@ class CommentAjaxAPITests(TestCase):
         self.assertFalse(data["success"])
 
 
+class NotificationInboxAPITests(TestCase):
+    """通知收件匣 API 與未讀數計數器測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="inboxuser", password="testpass123")
+        self.other = User.objects.create_user(username="otherinbox", password="testpass123")
+        self.notifications = [
+            Notification.objects.create(user=self.user, title=f"通知 {i}", message="內容") for i in range(5)
+        ]
+        Notification.objects.create(user=self.other, title="別人的通知", message="內容")
+        self.client.login(username="inboxuser", password="testpass123")
+
+    def test_inbox_keyset_pagination(self):
+        """測試依 (created_at, id) 由新到舊分頁，不重複也不遺漏"""
+        url = reverse("api_notifications")
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            data = self.client.get(url, params).json()["data"]
+            seen += [item["id"] for item in data["notifications"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted((n.id for n in self.notifications), reverse=True))
+        self.assertEqual(data["unread_count"], 5)
+
+        response = self.client.get(url, {"cursor": "???"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_mark_read_by_range_updates_counter(self):
+        """測試依 id 範圍標記已讀，未讀數同步扣除且不查 DB"""
+        self.assertEqual(get_unread_count(self.user.id), 5)
+        ids = [n.id for n in self.notifications]
+        response = self.client.post(reverse("api_notifications_read"), {"min_id": ids[1], "max_id": ids[2]})
+        self.assertEqual(response.json()["updated"], 2)
+        self.assertEqual(response.json()["unread_count"], 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.user.id), 3)
+        unread = self.client.get(reverse("api_notifications"), {"unread": "1"}).json()["data"]["notifications"]
+        self.assertEqual({item["id"] for item in unread}, {ids[0], ids[3], ids[4]})
+
+        # 省略範圍：全部標記已讀，且不影響其他使用者
+        self.assertEqual(self.client.post(reverse("api_notifications_read")).json()["updated"], 3)
+        self.assertFalse(Notification.objects.get(user=self.other).is_read)
+
+    def test_badge_reads_counter(self):
+        """測試導覽列徽章使用計數器，計數器存在時不執行 COUNT"""
+        get_unread_count(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("search"))
+        self.assertContains(response, "data-notification-badge")
+        self.assertFalse([q for q in queries.captured_queries if "motry_notification" in q["sql"]])
+
+    def test_reconcile_fixes_drift(self):
+        """測試定時任務以 DB 校正偏差的計數器"""
+        get_unread_count(self.user.id)
+        # 繞過 mark_read 直接更新（例如後台批次操作）不會調整計數器
+        Notification.objects.filter(pk__in=[n.pk for n in self.notifications[:2]]).update(is_read=True)
+        self.assertEqual(get_unread_count(self.user.id), 5)
+
+        reconcile_unread_counters()
+        self.assertEqual(get_unread_count(self.user.id), 3)
+        self.assertEqual(get_unread_count(self.other.id), 1)
+
+
+class RateLimitTests(TestCase):
+    """速率限制（GCRA，locmem 時使用行程內計數）測試"""
+
+    def setUp(self):
+        local_limiter.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="limited", password="testpass123")
+        self.vehicle = Vehicle.objects.create(brand="Mazda", model="MX-5")
+
+    def tearDown(self):
+        local_limiter.clear()
+
+    def test_local_gcra_allows_burst_then_blocks(self):
+        """測試連續請求達上限後被擋下，並回傳需等待的時間"""
+        limiter = LocalGCRA()
+        results = [limiter.hit("k", 3, 60) for _ in range(4)]
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertAlmostEqual(results[-1][1], 20, delta=1)
+        # 其他 key 不受影響
+        self.assertTrue(limiter.hit("other", 3, 60)[0])
+
+    def test_is_ratelimited_uses_key_and_method(self):
+        """測試 key / method 語意與 django_ratelimit 相同"""
+        factory = RequestFactory()
+        request = factory.post("/")
+        request.user = self.user
+        for _ in range(2):
+            self.assertFalse(is_ratelimited(request, group="g", key="user", rate="2/m", method="POST"))
+        self.assertTrue(is_ratelimited(request, group="g", key="user", rate="2/m", method="POST"))
+        # 不符合的 method 不計數
+        self.assertFalse(is_ratelimited(factory.get("/"), group="g", key="user", rate="2/m", method="POST"))
+        # 不同使用者分開計數
+        request.user = User.objects.create_user(username="other", password="testpass123")
+        self.assertFalse(is_ratelimited(request, group="g", key="user", rate="2/m", method="POST"))
+
+    def test_async_view_blocked_after_limit(self):
+        """測試 async view（AJAX 評分，30/m）超過次數後回傳 403"""
+        self.client.login(username="limited", password="testpass123")
+        url = reverse("rate_vehicle_ajax", kwargs={"id": self.vehicle.id})
+        for _ in range(30):
+            self.assertEqual(self.client.post(url, {"score": "4"}).status_code, 200)
+        self.assertEqual(self.client.post(url, {"score": "4"}).status_code, 403)
+
+
+class TrendingTests(TestCase):
+    """熱門趨勢（時間衰減分數，locmem 時使用行程內計數）測試"""
+
+    def setUp(self):
+        cache.clear()
+        local_trending.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="trendy", password="testpass123")
+        self.fans = [User.objects.create_user(username=f"fan{i}", password="testpass123") for i in range(3)]
+        self.hot = Vehicle.objects.create(brand="Ducati", model="Monster")
+        self.warm = Vehicle.objects.create(brand="Triumph", model="Trident 660")
+        self.cold = Vehicle.objects.create(brand="Suzuki", model="SV650")
+
+    def tearDown(self):
+        local_trending.clear()
+
+    def _activity(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(vehicle=self.hot, user=self.user, body_text="跑山")
+            for fan in self.fans:
+                Like.objects.create(post=post, user=fan)
+            Comment.objects.create(post=post, user=self.fans[0], body_text="帥")
+            FavoriteVehicle.objects.create(user=self.user, vehicle=self.warm)
+            Post.objects.create(vehicle=self.warm, user=self.user, body_text="通勤")
+
+    def test_api_orders_by_decayed_score(self):
+        """測試發文 / 按讚 / 留言 / 收藏累加熱度，API 依熱度排序"""
+        self._activity()
+        data = self.client.get(reverse("api_trending"), {"limit": 5}).json()["data"]
+        self.assertEqual(data["kind"], "vehicles")
+        self.assertEqual([item["id"] for item in data["results"]], [self.hot.id, self.warm.id])
+        # 貼文 3 + 按讚 1×3 + 留言 2；剛發生的事件幾乎沒有衰減
+        self.assertAlmostEqual(data["results"][0]["score"], 8, places=2)
+        self.assertAlmostEqual(data["results"][1]["score"], 6, places=2)
+
+        self.assertEqual(self.client.get(reverse("api_trending"), {"kind": "cars"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("api_trending"), {"limit": "x"}).status_code, 400)
+
+    def test_rolled_back_events_are_not_counted(self):
+        """測試交易 rollback 的事件不計入熱度"""
+        with self.captureOnCommitCallbacks(execute=False):
+            Post.objects.create(vehicle=self.cold, user=self.user, body_text="草稿")
+        self.assertEqual(top_trending(TRENDING_VEHICLES), [])
+
+    def test_favorite_api_adds_heat_once(self):
+        """測試透過 API 加入最愛（bulk 寫入、不觸發 signal）也會累加熱度，移除後再加入不重複計分"""
+        self.client.login(username="trendy", password="testpass123")
+        add_url = reverse("api_favorite_add", kwargs={"vehicle_id": self.warm.id})
+        remove_url = reverse("api_favorite_remove", kwargs={"vehicle_id": self.warm.id})
+        self.assertEqual(self.client.post(add_url).status_code, 201)
+        self.client.post(remove_url)
+        self.client.post(add_url)
+
+        [(member, score)] = top_trending(TRENDING_VEHICLES)
+        self.assertEqual(member, self.warm.id)
+        self.assertAlmostEqual(score, EVENT_WEIGHTS["favorite"], places=2)
+
+    def test_like_toggle_counts_once(self):
+        """測試收回讚再按讚不會重複累加熱度"""
+        post = Post.objects.create(vehicle=self.cold, user=self.user, body_text="跑山")
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=post, user=self.fans[0]).delete()
+            Like.objects.create(post=post, user=self.fans[0]).delete()
+            Like.objects.create(post=post, user=self.fans[0])
+            Like.objects.create(post=post, user=self.fans[1])
+
+        [(member, score)] = top_trending(TRENDING_VEHICLES)
+        self.assertAlmostEqual(score, EVENT_WEIGHTS["like"] * 2, places=2)
+
+    def test_old_events_decay(self):
+        """測試一個半衰期前的事件權重剩一半，換算後排名不變"""
+        trending = LocalTrending()
+        with mock.patch("apps.motry.trending.time.time", return_value=1_000_000.0):
+            trending.incr(TRENDING_VEHICLES, self.cold.id, 4)
+        later = 1_000_000.0 + TRENDING_HALF_LIFE
+        with mock.patch("apps.motry.trending.time.time", return_value=later):
+            trending.incr(TRENDING_VEHICLES, self.warm.id, 3)
+            self.assertEqual(
+                [(member, round(score, 6)) for member, score in trending.top(TRENDING_VEHICLES, 5)],
+                [(self.warm.id, 3.0), (self.cold.id, 2.0)],
+            )
+            self.assertEqual(trending.renormalize(TRENDING_VEHICLES), 2)
+            self.assertEqual(
+                [(member, round(score, 6)) for member, score in trending.top(TRENDING_VEHICLES, 5)],
+                [(self.warm.id, 3.0), (self.cold.id, 2.0)],
+            )
+
+    def test_renormalize_task_rebuilds_from_db(self):
+        """測試分數不存在時（Redis 清空）定時任務以最近一週的 DB 資料重建，含標籤"""
+        self._activity()
+        tag = Tag.objects.create(name="跑山")
+        PostTag.objects.create(post=Post.objects.filter(vehicle=self.hot).first(), tag=tag)
+        local_trending.clear()
+
+        result = renormalize_trending_scores()
+        self.assertEqual(result, {"vehicles": 2, "tags": 1})
+        ranked = top_trending(TRENDING_VEHICLES)
+        self.assertEqual([vehicle_id for vehicle_id, _ in ranked], [self.hot.id, self.warm.id])
+        self.assertAlmostEqual(ranked[0][1], 8, places=2)
+        tags = self.client.get(reverse("api_trending"), {"kind": "tags"}).json()["data"]["results"]
+        self.assertEqual([item["name"] for item in tags], ["跑山"])
+
+    def test_home_uses_trending(self):
+        """測試首頁推薦改為本週熱門，沒有熱度資料時退回隨機推薦"""
+        response = self.client.get(reverse("core:home"))
+        self.assertFalse(response.context["recommended_trending"])
+
+        self._activity()
+        # 首頁讀取預先算好的文件：本週熱門區塊由 beat 任務更新
+        refresh_home_document(force=True)
+        response = self.client.get(reverse("core:home"))
+        self.assertTrue(response.context["recommended_trending"])
+        self.assertEqual([vehicle.id for vehicle in response.context["recommended_vehicles"]], [self.hot.id, self.warm.id])
+        self.assertContains(response, "本週熱門")
+
+
+class RecommendationTests(TestCase):
+    """協同過濾推薦（收藏 / 車庫 / 評分共現）測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.mt07 = Vehicle.objects.create(brand="Yamaha", model="MT-07")
+        self.sv650 = Vehicle.objects.create(brand="Suzuki", model="SV650")
+        self.z900 = Vehicle.objects.create(brand="Kawasaki", model="Z900")
+        self.riders = [User.objects.create_user(username=f"rider{i}", password="testpass123") for i in range(4)]
+        UserVehicle.objects.create(user=self.riders[0], vehicle=self.mt07)
+        FavoriteVehicle.objects.create(user=self.riders[0], vehicle=self.sv650)
+        FavoriteVehicle.objects.create(user=self.riders[1], vehicle=self.mt07)
+        Rating.objects.create(user=self.riders[1], vehicle=self.sv650, score=5)
+        # 只有一位使用者同時喜歡 MT-07 與 Z900：共同使用者不足，不列入
+        FavoriteVehicle.objects.create(user=self.riders[2], vehicle=self.mt07)
+        FavoriteVehicle.objects.create(user=self.riders[2], vehicle=self.z900)
+        # 低分評價不算正向訊號
+        Rating.objects.create(user=self.riders[3], vehicle=self.z900, score=2)
+
+        self.newcomer = User.objects.create_user(username="newcomer", password="testpass123")
+        FavoriteVehicle.objects.create(user=self.newcomer, vehicle=self.mt07)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_rebuild_related_and_user_lists(self):
+        """測試車友也喜歡需要足夠的共同使用者，個人推薦排除已互動的車款"""
+        result = rebuild_recommendations()
+        self.assertEqual(result["users"], 4)
+
+        related = RelatedVehicle.objects.filter(vehicle=self.mt07)
+        self.assertEqual([row.related_id for row in related], [self.sv650.id])
+        self.assertFalse(RelatedVehicle.objects.filter(vehicle=self.z900).exists())
+
+        picks = UserRecommendation.objects.filter(user=self.newcomer)
+        self.assertEqual([row.vehicle_id for row in picks], [self.sv650.id])
+        self.assertFalse(UserRecommendation.objects.filter(user=self.riders[0]).exists())
+        self.assertFalse(UserRecommendation.objects.filter(user=self.riders[3]).exists())
+
+        # 重算會取代舊資料
+        FavoriteVehicle.objects.filter(user=self.riders[0]).delete()
+        rebuild_recommendations()
+        self.assertFalse(RelatedVehicle.objects.exists())
+        self.assertFalse(UserRecommendation.objects.exists())
+
+    def test_rebuild_replaces_rows_per_owner_in_batches(self):
+        """測試分批寫入的結果與一次寫入相同，且已無互動的使用者 / 車款的舊資料會被刪除"""
+        gone = User.objects.create_user(username="gone", password="testpass123")
+        UserRecommendation.objects.create(user=gone, vehicle=self.z900, rank=1, score=1.0)
+        RelatedVehicle.objects.create(vehicle=self.z900, related=self.mt07, rank=1, score=1.0)
+
+        with mock.patch("apps.motry.recommendations.INSERT_BATCH_SIZE", 1):
+            result = rebuild_recommendations()
+        self.assertEqual(result["related"], RelatedVehicle.objects.count())
+        self.assertEqual(result["recommendations"], UserRecommendation.objects.count())
+        self.assertFalse(UserRecommendation.objects.filter(user=gone).exists())
+        self.assertFalse(RelatedVehicle.objects.filter(vehicle=self.z900).exists())
+        picks = UserRecommendation.objects.filter(user=self.newcomer)
+        self.assertEqual([row.vehicle_id for row in picks], [self.sv650.id])
+
+    def test_home_and_detail_show_recommendations(self):
+        """測試首頁為登入使用者顯示個人化推薦，車款頁顯示車友也喜歡"""
+        rebuild_recommendations()
+        response = self.client.get(reverse("core:home"))
+        self.assertFalse(response.context["recommended_personal"])
+
+        self.client.login(username="newcomer", password="testpass123")
+        response = self.client.get(reverse("core:home"))
+        self.assertTrue(response.context["recommended_personal"])
+        self.assertEqual([vehicle.id for vehicle in response.context["recommended_vehicles"]], [self.sv650.id])
+
+        # 命中快取時不再查詢推薦資料表
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("core:home"))
+        self.assertFalse(any("motry_userrecommendation" in query["sql"] for query in queries.captured_queries))
+
+        response = self.client.get(reverse("vehicle_detail", args=[self.mt07.id]))
+        self.assertEqual(response.context["related_vehicles"], [self.sv650])
+        self.assertContains(response, "車友也喜歡")
+
+
 class ExportAPITests(TestCase):
     """匯出 API 測試"""
 
     def setUp(self):
         self.client = Client()
+        # 匯出任務（eager）寫到暫存目錄，不留在專案的 media/
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=tmpdir))
         self.user = User.objects.create_user(
             username="normaluser",
             password="testpass123",
@@ -0,0 +1,227 @@
+"""
+快取輔助函式測試
+
+測試 single-flight 重建、stale-while-revalidate、分散式鎖與兩層快取。
+"""
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django_redis.cache import RedisCache
+
+from apps.motry import caching
+from apps.motry.caching import (
+    CacheLock,
+    LocalLRU,
+    TwoTierCache,
+    aclose_async_redis,
+    aget_or_rebuild,
+    get_or_rebuild,
+    set_fresh,
+)
+
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "motry-caching-tests",
+    }
+}
+
+
+class CountingBuilder:
+    """記錄被呼叫次數的重建函式，sleep 模擬耗時查詢"""
+
+    def __init__(self, value, delay=0.2):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.value
+
+
+def run_concurrently(func, count=10):
+    results = []
+    barrier = threading.Barrier(count)
+
+    def worker():
+        barrier.wait()
+        results.append(func())
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrRebuildTests(SimpleTestCase):
+    """get_or_rebuild 併發測試"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_single_rebuild_on_cold_cache(self):
+        """測試快取為空時併發請求只重建一次"""
+        builder = CountingBuilder(["Honda", "Yamaha"])
+        results = run_concurrently(lambda: get_or_rebuild("brands", builder, soft_ttl=60))
+
+        self.assertEqual(builder.calls, 1)
+        self.assertEqual(results, [["Honda", "Yamaha"]] * 10)
+
+    def test_single_rebuild_per_expiry(self):
+        """測試過期後只有一個請求重建，其餘回傳舊值"""
+        set_fresh("brands", "old", soft_ttl=0.01, hard_ttl=60)
+        time.sleep(0.02)
+
+        builder = CountingBuilder("new")
+        results = run_concurrently(lambda: get_or_rebuild("brands", builder, soft_ttl=60))
+
+        self.assertEqual(builder.calls, 1)
+        self.assertEqual(results.count("new"), 1)
+        self.assertEqual(results.count("old"), 9)
+        self.assertEqual(get_or_rebuild("brands", builder, soft_ttl=60), "new")
+        self.assertEqual(builder.calls, 1)
+
+    def test_background_refresh_returns_stale(self):
+        """測試背景重建時請求立即拿到舊值"""
+        set_fresh("brands", "old", soft_ttl=0.01, hard_ttl=60)
+        time.sleep(0.02)
+
+        builder = CountingBuilder("new", delay=0.05)
+        self.assertEqual(get_or_rebuild("brands", builder, soft_ttl=60, background=True), "old")
+
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and cache.get("brands")["value"] != "new":
+            time.sleep(0.01)
+        self.assertEqual(get_or_rebuild("brands", builder, soft_ttl=60), "new")
+        self.assertEqual(builder.calls, 1)
+
+    async def test_async_single_rebuild_and_shared_format(self):
+        """測試非同步版本只重建一次，且與同步版本讀寫相同的快取格式"""
+        builder = CountingBuilder("value", delay=0.05)
+        results = await asyncio.gather(
+            *(aget_or_rebuild("brands", builder, soft_ttl=60) for _ in range(5))
+        )
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(builder.calls, 1)
+
+        set_fresh("brands", "from-sync", soft_ttl=60)
+        self.assertEqual(await aget_or_rebuild("brands", builder, soft_ttl=60), "from-sync")
+
+    def test_lock_is_exclusive(self):
+        """測試鎖只能被一個持有者取得，且只有持有者能釋放"""
+        first = CacheLock("brands")
+        second = CacheLock("brands")
+
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        second.release()
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    """TwoTierCache 測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.tier = TwoTierCache("test-tier", l1_ttl=60)
+
+    def test_l1_hit_skips_l2(self):
+        """測試 L1 命中時不讀 Redis"""
+        builder = CountingBuilder(["Honda"], delay=0)
+        self.assertEqual(self.tier.get_or_rebuild("brands", builder, soft_ttl=60), ["Honda"])
+        cache.delete("brands")
+
+        self.assertEqual(self.tier.get_or_rebuild("brands", builder, soft_ttl=60), ["Honda"])
+        self.assertEqual(builder.calls, 1)
+        stats = self.tier.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["l1_hits"], 1)
+        self.assertEqual(stats["l1_hit_rate"], 0.5)
+
+    def test_generation_check_after_l1_ttl(self):
+        """測試 L1 過期後以世代計數確認，未失效時沿用、失效時重建"""
+        self.tier.l1_ttl = 0
+        builder = CountingBuilder("v1", delay=0)
+        self.tier.get_or_rebuild("brands", builder, soft_ttl=60)
+        self.tier.get_or_rebuild("brands", builder, soft_ttl=60)
+        self.assertEqual(self.tier.stats()["l1_revalidated"], 1)
+
+        # 模擬其他 worker 失效：只改 Redis 上的世代與值，不動本行程 L1
+        cache.set(self.tier.generation_key, self.tier.generation() + 1)
+        cache.delete("brands")
+        builder.value = "v2"
+        self.assertEqual(self.tier.get_or_rebuild("brands", builder, soft_ttl=60), "v2")
+        self.assertEqual(builder.calls, 2)
+
+    def test_invalidate_clears_both_tiers(self):
+        """測試 invalidate 同時清除 L1 與 L2"""
+        builder = CountingBuilder("v1", delay=0)
+        self.tier.get_or_rebuild("brands", builder, soft_ttl=60)
+        self.tier.invalidate("brands")
+
+        self.assertIsNone(cache.get("brands"))
+        self.assertEqual(cache.get(self.tier.generation_key), 1)
+        builder.value = "v2"
+        self.assertEqual(self.tier.get_or_rebuild("brands", builder, soft_ttl=60), "v2")
+
+    def test_l2_hit_recorded(self):
+        """測試其他行程已寫入 L2 時記為 L2 命中"""
+        set_fresh("brands", "shared", soft_ttl=60)
+        builder = CountingBuilder("rebuilt", delay=0)
+
+        self.assertEqual(self.tier.get_or_rebuild("brands", builder, soft_ttl=60), "shared")
+        self.assertEqual(builder.calls, 0)
+        self.assertEqual(self.tier.stats()["l2_hits"], 1)
+
+    def test_lru_evicts_oldest(self):
+        """測試 LRU 超過容量時淘汰最久未使用的項目"""
+        lru = LocalLRU(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), 1)
+        self.assertEqual(len(lru), 2)
+
+
+class AsyncRedisClientTests(SimpleTestCase):
+    """redis.asyncio client 測試（只建立 client，不需要 Redis 伺服器）"""
+
+    def setUp(self):
+        self.backend = RedisCache(
+            "redis://127.0.0.1:6390/3",
+            {"OPTIONS": {"PASSWORD": "secret", "SOCKET_TIMEOUT": 3, "CONNECTION_POOL_KWARGS": {"max_connections": 7}}},
+        )
+
+    async def test_client_follows_django_redis_options_and_is_closed(self):
+        """測試 client 沿用 CACHES OPTIONS、同一 event loop 共用一個，且關閉後移除"""
+        with mock.patch.object(caching, "cache", self.backend):
+            redis_client = caching._async_redis()
+            self.assertIs(caching._async_redis(), redis_client)
+            pool = redis_client.connection_pool
+            self.assertEqual(pool.max_connections, 7)
+            self.assertEqual(pool.connection_kwargs["password"], "secret")
+            self.assertEqual(pool.connection_kwargs["socket_timeout"], 3)
+            self.assertEqual(pool.connection_kwargs["db"], 3)
+            self.assertNotIn("parser_class", pool.connection_kwargs)
+
+            await aclose_async_redis()
+            self.assertNotIn(asyncio.get_running_loop(), caching._async_clients)
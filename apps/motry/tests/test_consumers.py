@@ -0,0 +1,450 @@
+"""
+WebSocket Consumer 測試
+
+使用 InMemoryChannelLayer 測試連線權限與事件推播。
+"""
+
+import shutil
+import tempfile
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from apps.motry.consumers import NotificationConsumer, TaskEventConsumer, notification_connection_metrics
+from unittest import mock
+
+from apps.motry.models import Comment, FavoriteVehicle, Like, Notification, Post, UserVehicle, Vehicle
+from apps.motry.event_stream import LocalEventStream, local_stream, parse_event_id
+from apps.motry.frames import (
+    JSON_SUBPROTOCOL,
+    MSGPACK_DEFLATE_SUBPROTOCOL,
+    MSGPACK_SUBPROTOCOL,
+    decode_frame,
+    encode_frame,
+    select_subprotocol,
+)
+from apps.motry.notifications import vehicle_group
+from apps.motry.task_events import publish_task_event, task_events_group
+from apps.motry.tasks import export_vehicles_to_csv, fanout_new_post
+
+User = get_user_model()
+
+
+class TaskEventConsumerTests(TestCase):
+    """任務事件 WebSocket 測試"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="taskuser", password="testpass123")
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(TaskEventConsumer.as_asgi(), "/ws/motry/tasks/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_rejects_anonymous(self):
+        """測試未登入連線會被拒絕"""
+        communicator, connected = await self._connect(AnonymousUser())
+        self.assertFalse(connected)
+
+    async def test_receives_own_task_events(self):
+        """測試只收到自己任務的事件"""
+        communicator, connected = await self._connect(self.user)
+        self.assertTrue(connected)
+
+        layer = get_channel_layer()
+        await layer.group_send(
+            task_events_group(self.user.id + 1),
+            {"type": "task.event", "task_id": "other", "status": "SUCCESS"},
+        )
+        await layer.group_send(
+            task_events_group(self.user.id),
+            {"type": "task.event", "task_id": "abc", "status": "PROGRESS", "rows": 10000},
+        )
+
+        message = await communicator.receive_json_from()
+        self.assertEqual(message["task_id"], "abc")
+        self.assertEqual(message["status"], "PROGRESS")
+        self.assertEqual(message["rows"], 10000)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class TaskEventPublishTests(TestCase):
+    """Celery 任務完成時推播事件測試"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="publisher", password="testpass123")
+        Vehicle.objects.create(brand="Honda", model="Rebel 500")
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(task_events_group(self.user.id), self.channel)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def test_task_success_pushes_result(self):
+        """測試匯出任務成功後推播下載網址與統計"""
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            result = export_vehicles_to_csv.apply(kwargs={"user_id": self.user.id, "fmt": "jsonl"})
+
+        event = async_to_sync(self.layer.receive)(self.channel)
+        self.assertEqual(event["task_id"], result.id)
+        self.assertEqual(event["status"], "SUCCESS")
+        self.assertTrue(event["result"].endswith(".jsonl"))
+        self.assertEqual(event["stats"]["rows"], 1)
+
+    def test_publish_without_user_is_noop(self):
+        """測試沒有 user_id 時不推播"""
+        publish_task_event(None, "abc", "SUCCESS")
+        publish_task_event(self.user.id, "abc", "SUCCESS")
+
+        event = async_to_sync(self.layer.receive)(self.channel)
+        self.assertEqual(event["task_id"], "abc")
+
+
+    def test_shared_export_notifies_every_requester(self):
+        """測試第二位使用者共用執行中的匯出任務時，也會收到完成事件"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user.is_staff = True
+        self.user.save()
+        other = User.objects.create_user(username="second", password="testpass123", is_staff=True)
+        other_channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(task_events_group(other.id), other_channel)
+
+        client = Client()
+        with mock.patch("apps.motry.tasks.export_vehicles_to_csv.apply_async"):
+            client.force_login(self.user)
+            task_id = client.post(reverse("export_vehicles_csv")).json()["task_id"]
+            client.force_login(other)
+            self.assertEqual(client.post(reverse("export_vehicles_csv")).json()["task_id"], task_id)
+
+        publish_task_event(self.user.id, task_id, "SUCCESS", result="/media/exports/x.csv")
+        for channel in (self.channel, other_channel):
+            event = async_to_sync(self.layer.receive)(channel)
+            self.assertEqual((event["task_id"], event["status"]), (task_id, "SUCCESS"))
+
+class NotificationConsumerTests(TransactionTestCase):
+    """通知 WebSocket 依受眾推送測試（consumer 以 database_sync_to_async 查詢訂閱）"""
+
+    def setUp(self):
+        cache.clear()  # 訂閱集合快取以 user_id 為 key，避免沿用其他測試的資料
+        local_stream.clear()
+        self.author = User.objects.create_user(username="author", password="testpass123")
+        self.fan = User.objects.create_user(username="fan", password="testpass123")
+        self.stranger = User.objects.create_user(username="stranger", password="testpass123")
+        self.vehicle = Vehicle.objects.create(brand="Yamaha", model="MT-07")
+        self.other_vehicle = Vehicle.objects.create(brand="Honda", model="CB650R")
+        FavoriteVehicle.objects.create(user=self.fan, vehicle=self.vehicle)
+
+    async def _connect(self, user, path="/ws/motry/notifications/"):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), path)
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def _create_post(self, vehicle, user):
+        return Post.objects.create(vehicle=vehicle, user=user, body_text="新車心得")
+
+    async def test_new_post_only_reaches_subscribers(self):
+        """測試新貼文只推給收藏該車的使用者，不推給作者與其他人"""
+        author = await self._connect(self.author)
+        fan = await self._connect(self.fan)
+        stranger = await self._connect(self.stranger)
+
+        post = await database_sync_to_async(self._create_post)(self.vehicle, self.author)
+
+        message = await fan.receive_json_from()
+        self.assertEqual(message["type"], "new_post")
+        self.assertEqual(message["post_id"], post.id)
+        self.assertEqual(message["vehicle"]["id"], self.vehicle.id)
+        self.assertTrue(await stranger.receive_nothing())
+        self.assertTrue(await author.receive_nothing())
+        for communicator in (author, fan, stranger):
+            await communicator.disconnect()
+
+    async def test_msgpack_subprotocol(self):
+        """測試協商 msgpack subprotocol 後改送二進位 frame，未協商的連線仍為 JSON"""
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(),
+            "/ws/motry/notifications/",
+            subprotocols=["motry.unknown", MSGPACK_DEFLATE_SUBPROTOCOL, JSON_SUBPROTOCOL],
+        )
+        communicator.scope["user"] = self.fan
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, MSGPACK_DEFLATE_SUBPROTOCOL)
+        legacy = await self._connect(self.fan)
+
+        post = await database_sync_to_async(self._create_post)(self.vehicle, self.author)
+
+        frame = await communicator.receive_output()
+        self.assertIsNone(frame.get("text"))
+        message = decode_frame(frame["bytes"], subprotocol)
+        self.assertEqual(message["type"], "new_post")
+        self.assertEqual(message["post_id"], post.id)
+        self.assertEqual(message["vehicle"], {"id": self.vehicle.id, "name": str(self.vehicle)})
+        self.assertEqual((await legacy.receive_json_from())["post_id"], post.id)
+        for client in (communicator, legacy):
+            await client.disconnect()
+
+    async def test_watch_vehicle_page(self):
+        """測試瀏覽中的車輛頁面會收到該車新貼文，離開後不再收到"""
+        stranger = await self._connect(self.stranger)
+        await stranger.send_json_to({"action": "watch", "vehicle_id": self.other_vehicle.id})
+        await stranger.receive_nothing()  # 等待 group_add 完成
+
+        await database_sync_to_async(self._create_post)(self.other_vehicle, self.author)
+        message = await stranger.receive_json_from()
+        self.assertEqual(message["vehicle"]["id"], self.other_vehicle.id)
+
+        await stranger.send_json_to({"action": "watch", "vehicle_id": None})
+        await stranger.receive_nothing()
+        await database_sync_to_async(self._create_post)(self.other_vehicle, self.author)
+        self.assertTrue(await stranger.receive_nothing())
+        await stranger.disconnect()
+
+    async def test_subscription_change_while_connected(self):
+        """測試連線中加入最愛後，會開始收到該車的新貼文"""
+        stranger = await self._connect(self.stranger)
+        await database_sync_to_async(FavoriteVehicle.objects.create)(user=self.stranger, vehicle=self.other_vehicle)
+        await stranger.receive_nothing()  # 處理訂閱變更事件
+
+        await database_sync_to_async(self._create_post)(self.other_vehicle, self.author)
+        message = await stranger.receive_json_from()
+        self.assertEqual(message["vehicle"]["id"], self.other_vehicle.id)
+        await stranger.disconnect()
+
+    async def test_replay_missed_events_on_reconnect(self):
+        """測試重連時帶 last_event_id，補送斷線期間的事件且不重複"""
+        fan = await self._connect(self.fan)
+        await database_sync_to_async(self._create_post)(self.vehicle, self.author)
+        first = await fan.receive_json_from()
+        await fan.disconnect()
+
+        missed = [await database_sync_to_async(self._create_post)(self.vehicle, self.author) for _ in range(2)]
+
+        fan = await self._connect(self.fan, f"/ws/motry/notifications/?last_event_id={first['event_id']}")
+        frame = await fan.receive_json_from()
+        self.assertEqual(frame["type"], "batch")
+        replayed = frame["events"]
+        self.assertEqual([message["post_id"] for message in replayed], [post.id for post in missed])
+        self.assertTrue(all(message["replayed"] for message in replayed))
+        self.assertTrue(await fan.receive_nothing())
+
+        # 補送後照常接收即時事件
+        live = await database_sync_to_async(self._create_post)(self.vehicle, self.author)
+        message = await fan.receive_json_from()
+        self.assertEqual(message["post_id"], live.id)
+        self.assertNotIn("replayed", message)
+        await fan.disconnect()
+
+    def test_local_stream_reports_truncation(self):
+        """測試事件超過保留長度時回報無法完整補送"""
+        stream = LocalEventStream(maxlen=3)
+        first = stream.append("g", {"n": 0})
+        for n in range(1, 5):
+            stream.append("g", {"n": n})
+        events, truncated = stream.read_after(["g"], parse_event_id(first))
+        self.assertEqual([event["n"] for _, event in events], [2, 3, 4])
+        self.assertTrue(truncated)
+
+        events, truncated = stream.read_after(["g"], parse_event_id(events[0][0]))
+        self.assertEqual(len(events), 2)
+        self.assertFalse(truncated)
+
+    async def test_burst_is_batched_and_coalesced(self):
+        """測試短時間內的多筆事件合併為一個 frame，同一貼文的按讚合併並附 count"""
+        post = await database_sync_to_async(self._create_post)(self.other_vehicle, self.author)
+        author = await self._connect(self.author)
+        likers = [
+            await database_sync_to_async(User.objects.create_user)(username=f"liker{i}", password="testpass123")
+            for i in range(3)
+        ]
+        for liker in likers:
+            await database_sync_to_async(Like.objects.create)(post=post, user=liker)
+        await database_sync_to_async(Comment.objects.create)(post=post, user=self.fan, body_text="讚")
+
+        frame = await author.receive_json_from()
+        self.assertEqual(frame["type"], "batch")
+        self.assertEqual([event["type"] for event in frame["events"]], ["new_like", "new_comment"])
+        self.assertEqual(frame["events"][0]["count"], 3)
+        self.assertTrue(await author.receive_nothing())
+
+        metrics = notification_connection_metrics()
+        self.assertEqual(metrics["connections"], 1)
+        self.assertEqual(metrics["events"], 4)
+        self.assertEqual(metrics["coalesced"], 2)
+        self.assertEqual(metrics["frames"], 1)
+        await author.disconnect()
+
+    async def test_pending_queue_is_bounded(self):
+        """測試佇列超過上限時丟棄最舊事件並回報 dropped"""
+        author = await self._connect(self.author)
+        posts = [await database_sync_to_async(self._create_post)(self.other_vehicle, self.author) for _ in range(5)]
+        with mock.patch.object(NotificationConsumer, "max_pending", 3), mock.patch.object(
+            NotificationConsumer, "batch_max_events", 10
+        ):
+            for post in posts:
+                await database_sync_to_async(Comment.objects.create)(post=post, user=self.fan, body_text="+1")
+            frame = await author.receive_json_from()
+        self.assertEqual([event["post_id"] for event in frame["events"]], [post.id for post in posts[2:]])
+        self.assertEqual(frame["dropped"], 2)
+        self.assertEqual(notification_connection_metrics()["max_queue_depth"], 3)
+        await author.disconnect()
+
+    async def test_comment_notifies_post_author(self):
+        """測試留言只推給貼文作者（使用者 group）"""
+        post = await database_sync_to_async(self._create_post)(self.other_vehicle, self.author)
+        author = await self._connect(self.author)
+        fan = await self._connect(self.fan)
+
+        await database_sync_to_async(Comment.objects.create)(post=post, user=self.fan, body_text="讚")
+
+        message = await author.receive_json_from()
+        self.assertEqual(message["type"], "new_comment")
+        self.assertEqual(message["post_id"], post.id)
+        self.assertEqual(message["actor"], str(self.fan))
+        self.assertTrue(await fan.receive_nothing())
+        for communicator in (author, fan):
+            await communicator.disconnect()
+
+
+class FrameCodecTests(SimpleTestCase):
+    """通知 frame 編碼（JSON / msgpack / msgpack+deflate）測試"""
+
+    def _batch(self, size):
+        return {
+            "type": "batch",
+            "events": [
+                {
+                    "type": "new_post",
+                    "event_id": f"1700000000000-{index}",
+                    "post_id": index,
+                    "title": f"Post {index} on Yamaha MT-07",
+                    "vehicle": {"id": 7, "name": "Yamaha MT-07"},
+                    "actor": None,
+                }
+                for index in range(size)
+            ],
+            "dropped": 2,
+        }
+
+    def test_select_subprotocol(self):
+        """測試依前端順序選擇支援的 subprotocol，都不支援時維持 JSON"""
+        self.assertIsNone(select_subprotocol([]))
+        self.assertIsNone(select_subprotocol(["v10.stomp"]))
+        self.assertEqual(select_subprotocol([JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL]), JSON_SUBPROTOCOL)
+        self.assertEqual(select_subprotocol(["v10.stomp", MSGPACK_SUBPROTOCOL]), MSGPACK_SUBPROTOCOL)
+
+    def test_roundtrip_and_size(self):
+        """測試 msgpack 編碼可還原且比 JSON 小，較大的 frame 會壓縮"""
+        frame = self._batch(20)
+        expected = {
+            **frame,
+            "events": [{key: value for key, value in event.items() if value is not None} for event in frame["events"]],
+        }
+        json_size = len(encode_frame(frame, None).encode())
+        packed = encode_frame(frame, MSGPACK_SUBPROTOCOL)
+        deflated = encode_frame(frame, MSGPACK_DEFLATE_SUBPROTOCOL)
+
+        self.assertEqual(decode_frame(packed, MSGPACK_SUBPROTOCOL), expected)
+        self.assertEqual(decode_frame(deflated, MSGPACK_DEFLATE_SUBPROTOCOL), expected)
+        self.assertLess(len(packed), json_size * 0.6)
+        self.assertEqual(deflated[0], 1)
+        self.assertLess(len(deflated), len(packed))
+
+        # 太短的 frame 不壓縮
+        small = encode_frame({"type": "replay_truncated"}, MSGPACK_DEFLATE_SUBPROTOCOL)
+        self.assertEqual(small[0], 0)
+        self.assertEqual(decode_frame(small, MSGPACK_DEFLATE_SUBPROTOCOL), {"type": "replay_truncated"})
+
+
+class NewPostFanoutTests(TestCase):
+    """新貼文通知：交易提交後才寫入 Notification 並推播"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="poster", password="testpass123")
+        self.vehicle = Vehicle.objects.create(brand="Kawasaki", model="Z900")
+        self.subscribers = [
+            User.objects.create_user(username=f"sub{i}", password="testpass123") for i in range(5)
+        ]
+        for user in self.subscribers[:3]:
+            FavoriteVehicle.objects.create(user=user, vehicle=self.vehicle)
+        for user in self.subscribers[2:]:
+            UserVehicle.objects.create(user=user, vehicle=self.vehicle)
+        # 作者自己也收藏：不應通知自己
+        FavoriteVehicle.objects.create(user=self.author, vehicle=self.vehicle)
+        User.objects.create_user(username="bystander", password="testpass123")
+
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(vehicle_group(self.vehicle.id), self.channel)
+
+    def test_fanout_waits_for_commit(self):
+        """測試提交前不寫入也不推播，提交後通知所有訂閱者（不含作者）"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            post = Post.objects.create(vehicle=self.vehicle, user=self.author, body_text="試乘心得")
+        self.assertEqual(Notification.objects.count(), 0)
+        # fan-out 任務與熱門趨勢計分都等提交後才執行
+        self.assertEqual(len(callbacks), 2)
+
+        for callback in callbacks:
+            callback()
+        notified = set(Notification.objects.filter(related_post=post).values_list("user_id", flat=True))
+        self.assertEqual(notified, {user.id for user in self.subscribers})
+
+        event = async_to_sync(self.layer.receive)(self.channel)
+        self.assertEqual(event["post_id"], post.id)
+        self.assertEqual(event["kind"], Notification.NotificationType.NEW_POST)
+
+    def test_fanout_in_chunks_is_idempotent(self):
+        """測試分批寫入，且任務重跑不會重複通知"""
+        post = Post.objects.create(vehicle=self.vehicle, user=self.author, body_text="保養紀錄")
+        with mock.patch("apps.motry.notifications.NOTIFICATION_CHUNK_SIZE", 2):
+            with mock.patch.object(Notification.objects, "bulk_create", wraps=Notification.objects.bulk_create) as bulk:
+                result = fanout_new_post(post.id)
+        self.assertEqual(result["notified"], 5)
+        self.assertEqual(bulk.call_count, 3)
+
+        self.assertEqual(fanout_new_post(post.id)["notified"], 0)
+        self.assertEqual(Notification.objects.filter(related_post=post).count(), 5)
+
+    def test_broker_failure_does_not_fail_post(self):
+        """測試 broker 無法連線時，已提交的貼文不受影響，只記錄錯誤"""
+        with mock.patch.object(fanout_new_post, "delay", side_effect=ConnectionError("broker down")):
+            with self.assertLogs("django", "ERROR"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    post = Post.objects.create(vehicle=self.vehicle, user=self.author, body_text="試乘心得")
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+
+    def test_like_toggle_notifies_once(self):
+        """測試收回讚再按讚不會重複寫入通知"""
+        post = Post.objects.create(vehicle=self.vehicle, user=self.author, body_text="改裝分享")
+        fan = self.subscribers[0]
+        Like.objects.create(post=post, user=fan).delete()
+        Like.objects.create(post=post, user=fan).delete()
+        Like.objects.create(post=post, user=fan)
+        Like.objects.create(post=post, user=self.subscribers[1])
+
+        likes = Notification.objects.filter(user=self.author, notification_type=Notification.NotificationType.NEW_LIKE)
+        self.assertEqual(sorted(likes.values_list("actor_id", flat=True)), sorted([fan.id, self.subscribers[1].id]))
+
+    def test_comment_creates_notification_for_author(self):
+        """測試留言會寫入貼文作者的通知"""
+        post = Post.objects.create(vehicle=self.vehicle, user=self.author, body_text="改裝分享")
+        Comment.objects.create(post=post, user=self.subscribers[0], body_text="好看")
+        Comment.objects.create(post=post, user=self.author, body_text="謝謝")
+
+        notification = Notification.objects.get(user=self.author)
+        self.assertEqual(notification.notification_type, Notification.NotificationType.NEW_COMMENT)
+        self.assertEqual(notification.related_post, post)
@@ -0,0 +1,361 @@
+"""
+匯出引擎測試
+
+測試串流匯出的格式、欄位選擇、篩選條件與統計資料。
+"""
+
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from apps.motry.exports import (
+    ExportError,
+    aiter_stream_chunks,
+    export_fingerprint,
+    iter_stream_chunks,
+    resolve_columns,
+    run_export,
+)
+from apps.motry.models import Post, Rating, Vehicle
+from apps.motry.sharded_export import plan_shards, run_sharded_export
+from apps.motry.tasks import export_catalog_sharded, export_vehicles_to_csv, merge_catalog_shards
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
+User = get_user_model()
+
+
+class ExportEngineTestBase(TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        # 背景匯出一律寫到暫存目錄，不留在專案的 media/
+        self.enterContext(override_settings(MEDIA_ROOT=self.tmpdir))
+        Vehicle.objects.create(
+            brand="Yamaha", model="R1", displacement_cc=998, horsepower_ps=200,
+            cylinders=4, years_from=2020, years_to=2024,
+        )
+        Vehicle.objects.create(
+            brand="Honda", model="CB650R", displacement_cc=649, horsepower_ps=95, cylinders=4,
+        )
+        Vehicle.objects.create(
+            brand="Yamaha", model="MT-03", displacement_cc=321, horsepower_ps=42, cylinders=2,
+        )
+
+
+class ExportEngineTests(ExportEngineTestBase):
+    """run_export 格式與欄位測試"""
+
+    def test_csv_default_columns(self):
+        """測試預設欄位的 CSV 匯出"""
+        path = self.tmpdir / "out.csv"
+        stats = run_export(path, fmt="csv")
+
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][:3], ["ID", "Brand", "Model"])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][1:3], ["Honda", "CB650R"])
+        self.assertEqual(stats["rows"], 3)
+        self.assertIn("rows_per_sec", stats)
+        self.assertIn("peak_rss_kb", stats)
+        self.assertGreaterEqual(stats["rss_growth_kb"], 0)
+
+    def test_years_column_combined(self):
+        """測試年份欄位合併為 from-to"""
+        path = self.tmpdir / "out.csv"
+        run_export(path, fmt="csv", columns=["model", "years"], filters={"query": "R1"})
+
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows, [["Model", "Years"], ["R1", "2020-2024"]])
+
+    def test_gzip_csv(self):
+        """測試 gzip 壓縮 CSV"""
+        path = self.tmpdir / "out.csv.gz"
+        stats = run_export(path, fmt="csv.gz", columns="id,brand")
+
+        with gzip.open(path, "rt", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["ID", "Brand"])
+        self.assertEqual(stats["rows"], 3)
+
+    def test_jsonl_with_filters(self):
+        """測試 JSONL 匯出並套用與搜尋相同的篩選條件"""
+        path = self.tmpdir / "out.jsonl"
+        stats = run_export(
+            path,
+            fmt="jsonl",
+            columns=["brand", "model", "cylinders"],
+            filters={"brand": "yamaha", "cylinders": "4", "hp_min": "abc"},
+        )
+
+        lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+        self.assertEqual(lines, [{"brand": "Yamaha", "model": "R1", "cylinders": 4}])
+        self.assertEqual(stats["filters"], {"brand": "yamaha", "cylinders": "4", "hp_min": "abc"})
+
+    @unittest.skipIf(pq is None, "pyarrow 未安裝")
+    def test_parquet(self):
+        """測試 Parquet 匯出"""
+        path = self.tmpdir / "out.parquet"
+        run_export(path, fmt="parquet", columns=["id", "model", "horsepower_ps"], chunk_size=2)
+
+        table = pq.read_table(path)
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column_names, ["id", "model", "horsepower_ps"])
+
+    def test_invalid_format_and_columns(self):
+        """測試不支援的格式與欄位"""
+        with self.assertRaises(ExportError):
+            run_export(self.tmpdir / "out.xml", fmt="xml")
+        with self.assertRaises(ExportError):
+            resolve_columns(["id", "password"])
+
+
+class ExportTaskTests(ExportEngineTestBase):
+    """匯出任務與 API 參數測試"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.staff = User.objects.create_user(
+            username="exportstaff",
+            password="testpass123",
+            is_staff=True,
+        )
+
+    def test_task_result_contains_stats(self):
+        """測試任務結果包含檔案路徑與統計資料"""
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            result = export_vehicles_to_csv.run(fmt="jsonl", filters={"brand": "Honda"})
+
+        self.assertTrue(result["path"].endswith(".jsonl"))
+        self.assertEqual(result["rows"], 1)
+        self.assertTrue(Path(result["path"]).exists())
+
+    def test_export_api_rejects_parquet_without_pyarrow(self):
+        """測試未安裝 pyarrow 時 parquet 匯出直接回傳 400，不排程任務"""
+        self.client.login(username="exportstaff", password="testpass123")
+        with mock.patch("apps.motry.exports.PARQUET_AVAILABLE", False), mock.patch(
+            "apps.motry.tasks.export_vehicles_to_csv.apply_async"
+        ) as apply_async:
+            response = self.client.post(reverse("export_vehicles_csv"), {"format": "parquet"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("pyarrow", json.loads(response.content)["message"])
+        apply_async.assert_not_called()
+
+    def test_export_api_rejects_unknown_format(self):
+        """測試匯出 API 拒絕不支援的格式"""
+        self.client.login(username="exportstaff", password="testpass123")
+        response = self.client.post(reverse("export_vehicles_csv"), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(json.loads(response.content)["success"])
+
+
+class ExportResultReuseTests(ExportEngineTestBase):
+    """匯出結果重用與冪等鍵測試"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = Client()
+        User.objects.create_user(
+            username="reusestaff",
+            password="testpass123",
+            is_staff=True,
+        )
+        self.client.login(username="reusestaff", password="testpass123")
+
+    def test_fingerprint_changes_with_catalog(self):
+        """測試資料變動會改變匯出指紋"""
+        before = export_fingerprint("csv", None, {"brand": "Yamaha"})
+        self.assertEqual(before, export_fingerprint("csv", None, {"brand": " Yamaha "}))
+
+        vehicle = Vehicle.objects.get(model="R1")
+        vehicle.horsepower_ps = 210
+        vehicle.save()
+        self.assertNotEqual(before, export_fingerprint("csv", None, {"brand": "Yamaha"}))
+
+    def test_identical_request_reuses_file(self):
+        """測試相同條件的第二次請求直接回傳既有檔案"""
+        first = json.loads(self.client.post(reverse("export_vehicles_csv"), {"format": "jsonl"}).content)
+        self.assertFalse(first["cached"])
+
+        with mock.patch("apps.motry.tasks.export_vehicles_to_csv.apply_async") as apply_async:
+            second = json.loads(
+                self.client.post(reverse("export_vehicles_csv"), {"format": "jsonl"}).content
+            )
+        apply_async.assert_not_called()
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["task_id"], first["task_id"])
+        self.assertTrue(second["result"].endswith(".jsonl"))
+
+    def test_concurrent_requests_share_task(self):
+        """測試執行中的相同請求共用同一個 task id"""
+        with mock.patch("apps.motry.tasks.export_vehicles_to_csv.apply_async") as apply_async:
+            first = json.loads(self.client.post(reverse("export_vehicles_csv")).content)
+            second = json.loads(self.client.post(reverse("export_vehicles_csv")).content)
+            other = json.loads(self.client.post(reverse("export_vehicles_csv"), {"brand": "Honda"}).content)
+
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(first["task_id"], second["task_id"])
+        self.assertNotEqual(first["task_id"], other["task_id"])
+
+
+    def test_enqueue_failure_releases_claim(self):
+        """測試排程失敗（broker 無法連線）時釋放冪等鍵，下一次請求可重新排程"""
+        with mock.patch(
+            "apps.motry.tasks.export_vehicles_to_csv.apply_async", side_effect=ConnectionError("broker down")
+        ):
+            response = self.client.post(reverse("export_vehicles_csv"))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(json.loads(response.content)["success"])
+
+        with mock.patch("apps.motry.tasks.export_vehicles_to_csv.apply_async") as apply_async:
+            retry = json.loads(self.client.post(reverse("export_vehicles_csv")).content)
+        apply_async.assert_called_once()
+        self.assertEqual(retry["task_id"], apply_async.call_args.kwargs["task_id"])
+
+    def test_sharded_enqueue_failure_returns_503(self):
+        """測試分片匯出排程失敗（broker 無法連線）時回傳 503，而不是 500"""
+        with mock.patch(
+            "apps.motry.tasks.export_catalog_sharded.delay", side_effect=ConnectionError("broker down")
+        ), self.assertLogs("apps.motry.views", "ERROR"):
+            response = self.client.post(reverse("export_catalog_sharded"), {"shards": 2})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(json.loads(response.content)["success"])
+
+
+class StreamingDownloadTests(ExportEngineTestBase):
+    """小量匯出直接串流下載測試"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = Client()
+        User.objects.create_user(
+            username="streamstaff",
+            password="testpass123",
+            is_staff=True,
+        )
+        self.client.login(username="streamstaff", password="testpass123")
+
+    def test_stream_chunks_respect_buffer_size(self):
+        """測試串流內容依 buffer 大小切段且內容完整"""
+        chunks = list(iter_stream_chunks("jsonl", ["id", "model"], buffer_size=1))
+        self.assertEqual(len(chunks), 3)
+        models = [json.loads(chunk)["model"] for chunk in chunks]
+        self.assertEqual(models, ["CB650R", "MT-03", "R1"])
+
+    def test_async_stream_matches_sync(self):
+        """測試 ASGI 用的 async iterator 與同步版本輸出相同"""
+        async def collect():
+            return [chunk async for chunk in aiter_stream_chunks("csv", ["brand", "model"])]
+
+        self.assertEqual(async_to_sync(collect)(), list(iter_stream_chunks("csv", ["brand", "model"])))
+
+    def test_small_export_streams_csv(self):
+        """測試小量匯出直接回傳 CSV 串流"""
+        response = self.client.get(
+            reverse("export_vehicles_download"), {"brand": "Yamaha", "columns": "brand,model"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment", response["Content-Disposition"])
+
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows, [["Brand", "Model"], ["Yamaha", "MT-03"], ["Yamaha", "R1"]])
+
+    def test_large_export_falls_back_to_task(self):
+        """測試預估筆數過多時改排背景任務"""
+        with mock.patch("apps.motry.views.STREAM_EXPORT_MAX_ROWS", 2), mock.patch(
+            "apps.motry.tasks.export_vehicles_to_csv.apply_async"
+        ) as apply_async:
+            response = self.client.get(reverse("export_vehicles_download"), {"format": "jsonl"})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertIn("task_id", json.loads(response.content))
+        apply_async.assert_called_once()
+
+    def test_stream_rejects_file_only_formats(self):
+        """測試串流下載不支援 parquet 等格式"""
+        response = self.client.get(reverse("export_vehicles_download"), {"format": "parquet"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ShardedExportTests(ExportEngineTestBase):
+    """分片平行匯出測試"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="sharduser", password="testpass123")
+        for vehicle in Vehicle.objects.all():
+            Post.objects.create(vehicle=vehicle, user=user, body_text=f"About {vehicle.model}")
+            Rating.objects.create(vehicle=vehicle, user=user, score=4)
+        Post.objects.filter(vehicle__model="R1").update(is_deleted=True)
+
+    def _read_zip(self, path):
+        with zipfile.ZipFile(path) as archive:
+            return {
+                name: list(csv.reader(archive.read(name).decode("utf-8").splitlines()))
+                for name in archive.namelist()
+            }
+
+    def test_plan_covers_all_ids(self):
+        """測試分片區間涵蓋所有資料且不重疊"""
+        plan = [shard for shard in plan_shards(2) if shard.dataset == "vehicles"]
+        self.assertEqual(len(plan), 2)
+        ids = sorted(Vehicle.objects.values_list("id", flat=True))
+        covered = [i for i in ids for shard in plan if shard.lo <= i < shard.hi]
+        self.assertEqual(covered, ids)
+
+    def test_run_sharded_export_inline(self):
+        """測試依序執行的分片匯出合併結果"""
+        result = run_sharded_export(self.tmpdir / "catalog.zip", workers=1, shards=2)
+        self.assertEqual(result["rows"], {"vehicles": 3, "posts": 2, "ratings": 3})
+
+        content = self._read_zip(result["path"])
+        self.assertEqual(content["vehicles.csv"][0][:3], ["id", "brand", "model"])
+        self.assertEqual(len(content["vehicles.csv"]), 4)
+        self.assertEqual(len(content["posts.csv"]), 3)
+
+    def test_chord_export_task(self):
+        """測試以 Celery chord 執行分片匯出"""
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            result = export_catalog_sharded.apply(kwargs={"shards": 3, "merge_task_id": "merge-1"}).get()
+
+        self.assertEqual(result["merge_task_id"], "merge-1")
+        zips = list((self.tmpdir / "exports").glob("*.zip"))
+        self.assertEqual(len(zips), 1)
+        self.assertFalse(list((self.tmpdir / "exports").glob("*.parts")))
+        self.assertEqual(len(self._read_zip(zips[0])["ratings.csv"]), 4)
+
+    def test_merge_fails_when_parts_are_not_shared(self):
+        """測試分片檔不在本機（worker 未共用 MEDIA_ROOT）時合併任務明確失敗，不產生 zip"""
+        parts_dir = self.tmpdir / "job.parts"
+        parts_dir.mkdir()
+        parts = [{"dataset": "vehicles", "index": 0, "path": str(parts_dir / "vehicles-0000.csv"), "rows": 3}]
+        zip_path = self.tmpdir / "job.zip"
+
+        with self.assertRaisesMessage(FileNotFoundError, "MEDIA_ROOT"):
+            merge_catalog_shards.apply(args=(parts, str(parts_dir), str(zip_path))).get()
+        self.assertFalse(zip_path.exists())
+        self.assertFalse(parts_dir.exists())
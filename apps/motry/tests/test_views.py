@@ -4,9 +4,19 @@ View 單元測試
 測試所有 View 的回應狀態、權限控制、重定向行為。
 """
 
+import shutil
+import tempfile
+import time
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
-from django.test import TestCase, Client, override_settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from allauth.socialaccount.models import SocialApp
@@ -19,7 +29,23 @@ from apps.motry.models import (
     FavoriteVehicle,
     Rating,
     Like,
+    VehicleNeighbor,
+    PostTag,
+    Tag,
+)
+from apps.core.home import (
+    HOME_BUILD_LOCK,
+    HOME_DOCUMENT_CACHE_KEY,
+    RANDOM_POOLS,
+    SECTION_TTLS,
+    get_home_document,
+    refresh_home_document,
 )
+from apps.core.middleware import AsyncWhiteNoiseMiddleware
+from apps.motry.caching import CacheLock
+from apps.motry.cards import VehicleCard, sample_vehicle_ids
+from apps.motry.similarity import parse_extras, rebuild_neighbors
+from apps.motry.tasks import NEIGHBOR_REFRESH_DELAY, queue_neighbor_refresh, refresh_pending_vehicle_neighbors
 
 User = get_user_model()
 
@@ -470,6 +496,10 @@ class StaffViewTests(TestCase):
 
     def setUp(self):
         self.client = Client()
+        # 匯出任務（eager）寫到暫存目錄，不留在專案的 media/
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=tmpdir))
         self.user = User.objects.create_user(
             username="normaluser",
             password="testpass123",
@@ -493,3 +523,265 @@ class StaffViewTests(TestCase):
         response = self.client.post(reverse("export_vehicles_csv"))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "application/json")
+
+
+class SimilarVehicleTests(TestCase):
+    """規格相似車款（預先計算的鄰居）測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.mt07 = Vehicle.objects.create(
+            brand="Yamaha", model="MT-07", displacement_cc=689, horsepower_ps=74, cylinders=2, years_from=2021,
+            msrp_new=339000, intro_md="重量：184 kg",
+        )
+        self.cb650r = Vehicle.objects.create(
+            brand="Honda", model="CB650R", displacement_cc=649, horsepower_ps=95, cylinders=4, years_from=2021,
+            msrp_new=379000, intro_md="重量：202 kg",
+        )
+        self.sv650 = Vehicle.objects.create(
+            brand="Suzuki", model="SV650", displacement_cc=645, horsepower_ps=76, cylinders=2, years_from=2020,
+            msrp_new=329000,
+        )
+        self.gs = Vehicle.objects.create(
+            brand="BMW", model="R 1250 GS", displacement_cc=1254, horsepower_ps=136, cylinders=2, years_from=2019,
+            msrp_new=1150000, intro_md="重量：249 kg",
+        )
+        self.scooter = Vehicle.objects.create(
+            brand="Gogoro", model="S1", horsepower_ps=10, years_from=2015, intro_md="純電速克達，電池 1.3 kWh",
+        )
+        # 規格幾乎沒填的車：與任何車都沒有足夠的共同欄位
+        self.unknown = Vehicle.objects.create(brand="Unknown", model="Mystery", years_from=2020)
+
+    def _neighbors(self, vehicle):
+        return list(VehicleNeighbor.objects.filter(vehicle=vehicle).values_list("neighbor_id", flat=True))
+
+    def test_parse_extras(self):
+        """測試自簡介解析重量、扭力與純電標記"""
+        extras = parse_extras("重量：190 kg，最大扭力 68 N·m，座高 805 mm，油箱 14 L")
+        self.assertEqual(extras["weight"], 190)
+        self.assertEqual(extras["torque"], 68)
+        self.assertEqual(extras["seat_height"], 805)
+        self.assertEqual(extras["fuel_capacity"], 14)
+        self.assertEqual(extras["electric"], 0)
+        self.assertEqual(parse_extras("純電速克達")["electric"], 1)
+
+    def test_rebuild_orders_by_spec_distance(self):
+        """測試鄰居依規格距離排序，共同規格不足的車不列入"""
+        rebuild_neighbors(k=3)
+        self.assertEqual(self._neighbors(self.mt07)[0], self.sv650.id)
+        self.assertEqual(self._neighbors(self.mt07)[-1], self.gs.id)
+        self.assertEqual(self._neighbors(self.unknown), [])
+        self.assertNotIn(self.unknown.id, VehicleNeighbor.objects.values_list("neighbor_id", flat=True))
+        ranks = list(VehicleNeighbor.objects.filter(vehicle=self.mt07).values_list("rank", "distance"))
+        self.assertEqual([rank for rank, _ in ranks], [1, 2, 3])
+        self.assertEqual([distance for _, distance in ranks], sorted(distance for _, distance in ranks))
+
+    def test_refresh_after_update_and_delete(self):
+        """測試車款修改 / 刪除後，受影響的車在交易提交後重算"""
+        rebuild_neighbors()
+        before = self._neighbors(self.gs)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            twin = Vehicle.objects.create(
+                brand="BMW", model="R 1300 GS", displacement_cc=1300, horsepower_ps=145, cylinders=2,
+                years_from=2024, msrp_new=1200000, intro_md="重量：237 kg",
+            )
+        self.assertEqual(self._neighbors(self.gs)[0], twin.id)
+        self.assertEqual(self._neighbors(twin)[0], self.gs.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            twin.delete()
+        self.assertEqual(self._neighbors(self.gs), before)
+
+    def test_save_without_spec_change_is_not_queued(self):
+        """測試只改名稱等非規格欄位的儲存不排入重算，規格變更才排入"""
+        vehicle = Vehicle.objects.get(pk=self.mt07.pk)
+        with mock.patch("apps.motry.signals.queue_neighbor_refresh") as queue:
+            with self.captureOnCommitCallbacks(execute=True):
+                vehicle.generation = "2025"
+                vehicle.save()
+                Vehicle.objects.update_or_create(pk=self.sv650.pk, defaults={"cover_url": "https://example.com/sv.jpg"})
+            queue.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                vehicle.horsepower_ps = 73
+                vehicle.save()
+            queue.assert_called_once_with([vehicle.pk])
+
+    def test_changes_are_merged_into_one_task(self):
+        """測試一段時間內的多次變更只排一個延遲任務，任務一次取出全部變更"""
+        with mock.patch.object(refresh_pending_vehicle_neighbors, "apply_async") as apply_async:
+            queue_neighbor_refresh([self.mt07.id])
+            queue_neighbor_refresh([self.sv650.id, self.gs.id])
+        apply_async.assert_called_once_with(countdown=NEIGHBOR_REFRESH_DELAY)
+
+        with mock.patch("apps.motry.similarity.refresh_neighbors", return_value={}) as refresh:
+            refresh_pending_vehicle_neighbors()
+            refresh_pending_vehicle_neighbors()
+        refresh.assert_called_once_with({self.mt07.id, self.sv650.id, self.gs.id})
+
+    def test_detail_shows_similar_vehicles(self):
+        """測試車款頁顯示相似車款"""
+        rebuild_neighbors(k=3)
+        response = self.client.get(reverse("vehicle_detail", args=[self.mt07.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "相似車款")
+        self.assertEqual(response.context["similar_vehicles"][0], self.sv650)
+        self.assertEqual(len(response.context["similar_vehicles"]), 3)
+
+        response = self.client.get(reverse("vehicle_detail", args=[self.unknown.id]))
+        self.assertNotContains(response, "相似車款")
+
+
+class HomeRandomPicksTests(TestCase):
+    """首頁隨機推薦（id 範圍抽樣、精簡卡片快取）測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        vehicles = [Vehicle.objects.create(brand="Brand", model=f"Model {i}") for i in range(30)]
+        # 製造 id 空洞：只留下 1/3
+        Vehicle.objects.filter(id__in=[vehicle.id for vehicle in vehicles[::3]]).delete()
+        Vehicle.objects.filter(id__in=[vehicle.id for vehicle in vehicles[1::3]]).delete()
+        self.remaining = set(Vehicle.objects.values_list("id", flat=True))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_sample_handles_id_gaps(self):
+        """測試抽樣只回傳存在的車款、不重複，數量不足時回傳全部"""
+        for _ in range(20):
+            ids = sample_vehicle_ids(4)
+            self.assertEqual(len(ids), 4)
+            self.assertEqual(len(set(ids)), 4)
+            self.assertTrue(set(ids) <= self.remaining)
+        self.assertEqual(set(sample_vehicle_ids(50)), self.remaining)
+        Vehicle.objects.all().delete()
+        self.assertEqual(sample_vehicle_ids(4), [])
+
+    def test_sample_does_not_load_all_ids(self):
+        """測試抽樣不會查詢整張表的 id"""
+        with CaptureQueriesContext(connection) as queries:
+            sample_vehicle_ids(4)
+        for query in queries.captured_queries:
+            sql = query["sql"].upper()
+            self.assertTrue("WHERE" in sql or "MIN(" in sql, sql)
+            self.assertNotIn("RANDOM()", sql)
+
+    def test_home_caches_compact_cards(self):
+        """測試首頁隨機推薦取自首頁文件中的精簡卡片"""
+        response = self.client.get(reverse("core:home"))
+        self.assertFalse(response.context["recommended_trending"])
+        cards = response.context["recommended_vehicles"]
+        self.assertEqual(len(cards), 4)
+        self.assertTrue(all(isinstance(card, VehicleCard) for card in cards))
+        self.assertContains(response, cards[0].name)
+        pools = cache.get(HOME_DOCUMENT_CACHE_KEY)["random_pools"]["value"]
+        self.assertEqual(len(pools), RANDOM_POOLS)
+        self.assertIn(cards, pools)
+
+
+class HomeDocumentTests(TestCase):
+    """首頁 read model（預先計算的區塊文件）測試"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="sharer", password="testpass123")
+        self.vehicle = Vehicle.objects.create(brand="Honda", model="Rebel 500")
+        UserVehicle.objects.create(user=self.user, vehicle=self.vehicle, alias="小黑")
+        post = Post.objects.create(vehicle=self.vehicle, user=self.user, body_text="通勤")
+        PostTag.objects.create(post=post, tag=Tag.objects.create(name="通勤"))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_warm_document_renders_without_queries(self):
+        """測試文件已預先算好時，首頁只讀一次快取、不查詢資料庫"""
+        self.assertEqual(refresh_home_document(), list(SECTION_TTLS))
+        # 先請求一次，讓全站共用的品牌快取（context processor）也載入
+        self.client.get(reverse("core:home"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("core:home"))
+        self.assertEqual(len(queries), 0, [query["sql"] for query in queries.captured_queries])
+        self.assertContains(response, "#通勤")
+        self.assertContains(response, "小黑")
+        self.assertContains(response, "由 sharer 分享")
+        # 區塊都還新鮮時 beat 不需重算
+        self.assertEqual(refresh_home_document(), [])
+
+    def test_cold_document_builds_only_missing_sections(self):
+        """測試文件缺少區塊時只重算缺少的部分並寫回"""
+        refresh_home_document()
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY)
+        del document["latest_garage"]
+        document["popular_tags"]["value"] = ["舊標籤"]
+        cache.set(HOME_DOCUMENT_CACHE_KEY, document)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("core:home"))
+        tables = " ".join(query["sql"] for query in queries.captured_queries)
+        self.assertIn("motry_uservehicle", tables)
+        self.assertNotIn("motry_tag", tables)
+        self.assertContains(response, "#舊標籤")
+        self.assertIn("latest_garage", cache.get(HOME_DOCUMENT_CACHE_KEY))
+
+    def test_expired_section_is_rebuilt(self):
+        """測試超過區塊 TTL 的內容會在下一次 beat 或請求時重算"""
+        refresh_home_document()
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY)
+        document["popular_tags"] = {"value": ["舊標籤"], "built_at": time.time() - SECTION_TTLS["popular_tags"] - 1}
+        cache.set(HOME_DOCUMENT_CACHE_KEY, document)
+        self.assertEqual(get_home_document()["popular_tags"], ["通勤"])
+
+    def test_locked_rebuild_serves_stale_sections(self):
+        """測試其他行程持有重算鎖時，過期區塊直接用舊值，缺少的區塊等待逾時後自行計算且不寫回"""
+        refresh_home_document()
+        document = cache.get(HOME_DOCUMENT_CACHE_KEY)
+        document["popular_tags"] = {"value": ["舊標籤"], "built_at": time.time() - SECTION_TTLS["popular_tags"] - 1}
+        cache.set(HOME_DOCUMENT_CACHE_KEY, document)
+        lock = CacheLock(HOME_BUILD_LOCK)
+        self.assertTrue(lock.acquire())
+        self.addCleanup(lock.release)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_home_document()["popular_tags"], ["舊標籤"])
+        # beat 遇到鎖時略過本次
+        self.assertEqual(refresh_home_document(force=True), [])
+
+        del document["latest_garage"]
+        cache.set(HOME_DOCUMENT_CACHE_KEY, document)
+        with mock.patch("apps.core.home.WAIT_TIMEOUT", 0.1):
+            self.assertEqual(get_home_document()["latest_garage"][0].alias, "小黑")
+        self.assertNotIn("latest_garage", cache.get(HOME_DOCUMENT_CACHE_KEY))
+
+
+class AsyncMiddlewareChainTests(SimpleTestCase):
+    """ASGI middleware 鏈測試：async view 的請求不應被轉成同步"""
+
+    @override_settings(DEBUG=True)
+    def test_no_middleware_is_adapted_to_sync(self):
+        """測試載入 async middleware 鏈時沒有任何 middleware 需要 sync / async 轉接"""
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler().load_middleware(is_async=True)
+
+    async def test_static_and_dynamic_paths(self):
+        """測試 async 路徑：靜態檔由 WhiteNoise 回應，其餘交給下一層"""
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root, ignore_errors=True)
+        with open(f"{static_root}/app.css", "w") as fh:
+            fh.write("body {}")
+
+        async def view(request):
+            return HttpResponse("dynamic")
+
+        middleware = AsyncWhiteNoiseMiddleware(view)
+        middleware.add_files(static_root, prefix="/static/")
+        factory = RequestFactory()
+
+        response = await middleware(factory.get("/static/app.css"))
+        self.assertEqual(b"".join(response.streaming_content), b"body {}")
+        response.close()
+        response = await middleware(factory.get("/vehicles/"))
+        self.assertEqual(response.content, b"dynamic")
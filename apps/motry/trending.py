@@ -0,0 +1,313 @@
+"""
+熱門趨勢：依時間衰減的車款 / 標籤分數（Redis sorted set）。
+
+分數採「前向衰減」：事件發生時加上 ``weight × 2^((now - epoch) / half_life)``，
+越新的事件加得越多，等同所有舊分數隨時間以半衰期 TRENDING_HALF_LIFE 遞減，
+但不需要定時改寫每個成員——排名只取決於相對大小，讀取時 ``ZREVRANGE`` 即為目前的熱門排序。
+
+- 寫入：發文、按讚、留言、評分、加入最愛時（交易提交後）以一支 Lua script 讀 epoch、
+  以 Redis TIME 計算加權後 ``ZINCRBY``，一次往返；按讚與加入最愛可反覆取消再做，
+  同一使用者對同一貼文 / 車款只計一次（``record_event_once``）
+- 讀取：``ZREVRANGE 0 limit-1``（O(log n + limit)）；分數除以目前的放大倍率後即為「現在的熱度」
+- 維護：Celery beat 定時執行 ``renormalize_trending``，把分數換算回目前時間、epoch 移到現在
+  （避免倍率無限增大），並移除已衰減到 TRENDING_MIN_SCORE 以下或排名超過 TRENDING_MAX_MEMBERS 的成員；
+  sorted set 不存在時（Redis 清空、初次部署）以最近 TRENDING_REBUILD_DAYS 天的 DB 資料重建
+
+非 Redis 後端（locmem）或 Redis 連線失敗時改用行程內的 ``LocalTrending``，計算方式相同。
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from .caching import _redis_client
+from .models import Comment, FavoriteVehicle, Like, Post, PostTag, Rating, Tag, Vehicle
+
+logger = logging.getLogger(__name__)
+
+TRENDING_VEHICLES = "vehicles"
+TRENDING_TAGS = "tags"
+TRENDING_KINDS = (TRENDING_VEHICLES, TRENDING_TAGS)
+
+TRENDING_KEY = "motry:trending:{kind}"
+TRENDING_EPOCH_KEY = "motry:trending:{kind}:epoch"
+TRENDING_HALF_LIFE = 60 * 60 * 48  # 秒：兩天前的事件權重剩一半，一週前約剩 9%
+TRENDING_MIN_SCORE = 0.01  # 衰減到此以下的成員於維護時移除
+TRENDING_MAX_MEMBERS = 5000
+TRENDING_REBUILD_DAYS = 7
+
+# 可反覆取消再做的事件（按讚、加入最愛）已計分的 (使用者, 目標) 紀錄；
+# 保留 TRENDING_REBUILD_DAYS 天，之後該筆熱度已衰減到約 9%，再計一次影響不大
+TRENDING_SEEN_KEY = "motry:trending:seen:{event}:{user_id}:{target_id}"
+TRENDING_SEEN_TIMEOUT = 60 * 60 * 24 * TRENDING_REBUILD_DAYS
+
+# 各事件對車款熱度的權重
+EVENT_WEIGHTS = {
+	"post": 3.0,
+	"comment": 2.0,
+	"like": 1.0,
+	"rating": 2.0,
+	"favorite": 3.0,
+	"tag": 1.0,
+}
+
+# KEYS[1]：sorted set；KEYS[2]：epoch（ms）；ARGV[1]：成員；ARGV[2]：權重；ARGV[3]：半衰期（ms）
+INCR_SCRIPT = """
+local now = redis.call('TIME')
+now = now[1] * 1000 + math.floor(now[2] / 1000)
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+	epoch = now
+	redis.call('SET', KEYS[2], epoch)
+end
+local boost = tonumber(ARGV[2]) * math.pow(2, (now - epoch) / tonumber(ARGV[3]))
+return redis.call('ZINCRBY', KEYS[1], boost, ARGV[1])
+"""
+
+# KEYS 同上；ARGV[1]：半衰期（ms）；ARGV[2]：最低分數；ARGV[3]：最多成員數
+# 成員數受 TRENDING_MAX_MEMBERS 限制，逐筆 ZADD 不會長時間阻塞 Redis
+RENORMALIZE_SCRIPT = """
+local now = redis.call('TIME')
+now = now[1] * 1000 + math.floor(now[2] / 1000)
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch or redis.call('EXISTS', KEYS[1]) == 0 then
+	return -1
+end
+local factor = math.pow(2, -(now - epoch) / tonumber(ARGV[1]))
+local items = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #items, 2 do
+	redis.call('ZADD', KEYS[1], tonumber(items[i + 1]) * factor, items[i])
+end
+redis.call('SET', KEYS[2], now)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[2])
+local size = redis.call('ZCARD', KEYS[1])
+local limit = tonumber(ARGV[3])
+if size > limit then
+	redis.call('ZREMRANGEBYRANK', KEYS[1], 0, size - limit - 1)
+end
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_scripts: dict[str, object] = {}
+
+
+def _boost(now: float, epoch: float) -> float:
+	return math.pow(2, (now - epoch) / TRENDING_HALF_LIFE)
+
+
+class LocalTrending:
+	"""行程內的趨勢分數（Redis 無法使用時的備援）。"""
+
+	def __init__(self):
+		self._scores: dict[str, dict[int, float]] = {}
+		self._epochs: dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def incr(self, kind: str, member: int, weight: float) -> None:
+		now = time.time()
+		with self._lock:
+			epoch = self._epochs.setdefault(kind, now)
+			scores = self._scores.setdefault(kind, {})
+			scores[member] = scores.get(member, 0.0) + weight * _boost(now, epoch)
+
+	def top(self, kind: str, limit: int) -> list[tuple[int, float]]:
+		with self._lock:
+			scores = self._scores.get(kind, {})
+			divisor = _boost(time.time(), self._epochs.get(kind, time.time()))
+			return [(member, score / divisor) for member, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])]
+
+	def renormalize(self, kind: str) -> int:
+		now = time.time()
+		with self._lock:
+			scores = self._scores.get(kind)
+			if not scores:
+				return -1
+			divisor = _boost(now, self._epochs[kind])
+			kept = {member: score / divisor for member, score in scores.items() if score / divisor >= TRENDING_MIN_SCORE}
+			if len(kept) > TRENDING_MAX_MEMBERS:
+				kept = dict(heapq.nlargest(TRENDING_MAX_MEMBERS, kept.items(), key=lambda item: item[1]))
+			self._scores[kind] = kept
+			self._epochs[kind] = now
+			return len(kept)
+
+	def replace(self, kind: str, scores: dict[int, float]) -> None:
+		with self._lock:
+			self._scores[kind] = dict(scores)
+			self._epochs[kind] = time.time()
+
+	def clear(self) -> None:
+		with self._lock:
+			self._scores.clear()
+			self._epochs.clear()
+
+
+local_trending = LocalTrending()
+
+
+def _keys(kind: str) -> list[str]:
+	return [cache.make_key(TRENDING_KEY.format(kind=kind)), cache.make_key(TRENDING_EPOCH_KEY.format(kind=kind))]
+
+
+def _script(client, name: str, source: str):
+	if name not in _scripts:
+		_scripts[name] = client.register_script(source)
+	return _scripts[name]
+
+
+def record_event(kind: str, member_id: int | None, weight: float) -> None:
+	"""為車款 / 標籤加上一筆事件的熱度。"""
+	if not member_id or not weight:
+		return
+	client = _redis_client()
+	if client is None:
+		local_trending.incr(kind, member_id, weight)
+		return
+	try:
+		_script(client, "incr", INCR_SCRIPT)(
+			keys=_keys(kind), args=[member_id, repr(weight), TRENDING_HALF_LIFE * 1000], client=client
+		)
+	except RedisError:
+		logger.warning("Redis 無法使用，熱門趨勢改用行程內計數", exc_info=True)
+		local_trending.incr(kind, member_id, weight)
+
+
+def record_event_once(kind: str, member_id: int | None, event: str, user_id: int, target_id: int) -> None:
+	"""同一使用者對同一目標（貼文 / 車款）的 event 只計一次熱度：收回讚再按讚、移除最愛再加入不會重複加分。"""
+	try:
+		first = cache.add(
+			TRENDING_SEEN_KEY.format(event=event, user_id=user_id, target_id=target_id), 1, TRENDING_SEEN_TIMEOUT
+		)
+	except Exception:
+		# 快取無法使用時寧可多計一次，也不漏掉事件
+		logger.warning("無法記錄已計分的趨勢事件", exc_info=True)
+		first = True
+	if first:
+		record_event(kind, member_id, EVENT_WEIGHTS[event])
+
+
+def top_trending(kind: str, limit: int = 10) -> list[tuple[int, float]]:
+	"""回傳目前最熱門的 (id, 熱度) 列表；熱度已換算為現在時間的衰減後分數。"""
+	if limit <= 0:
+		return []
+	client = _redis_client()
+	if client is None:
+		return local_trending.top(kind, limit)
+	key, epoch_key = _keys(kind)
+	try:
+		pipe = client.pipeline(transaction=False)
+		pipe.zrevrange(key, 0, limit - 1, withscores=True)
+		pipe.get(epoch_key)
+		members, epoch = pipe.execute()
+	except RedisError:
+		logger.warning("Redis 無法使用，熱門趨勢改用行程內計數", exc_info=True)
+		return local_trending.top(kind, limit)
+	if not members:
+		return []
+	divisor = _boost(time.time(), int(epoch) / 1000) if epoch else 1.0
+	return [(int(member), score / divisor) for member, score in members]
+
+
+def renormalize_trending(kind: str) -> int:
+	"""
+	把分數換算回目前時間並修剪，回傳剩餘成員數。
+
+	sorted set 不存在時以 DB 重建（見 ``rebuild_trending``）。
+	"""
+	client = _redis_client()
+	if client is None:
+		result = local_trending.renormalize(kind)
+	else:
+		result = _script(client, "renormalize", RENORMALIZE_SCRIPT)(
+			keys=_keys(kind),
+			args=[TRENDING_HALF_LIFE * 1000, repr(TRENDING_MIN_SCORE), TRENDING_MAX_MEMBERS],
+			client=client,
+		)
+	if result == -1:
+		return rebuild_trending(kind)
+	return result
+
+
+def trending_scores_from_db(kind: str, days: int = TRENDING_REBUILD_DAYS) -> dict[int, float]:
+	"""以最近 days 天的 DB 紀錄計算衰減後的熱度（以現在為基準）。"""
+	now = timezone.now()
+	since = now - timedelta(days=days)
+	if kind == TRENDING_TAGS:
+		sources = [
+			(PostTag.objects.filter(post__created_at__gte=since).values_list("tag_id", "post__created_at"), "tag"),
+		]
+	else:
+		sources = [
+			(Post.objects.filter(created_at__gte=since).values_list("vehicle_id", "created_at"), "post"),
+			(Comment.objects.filter(created_at__gte=since).values_list("post__vehicle_id", "created_at"), "comment"),
+			(Like.objects.filter(created_at__gte=since).values_list("post__vehicle_id", "created_at"), "like"),
+			(Rating.objects.filter(created_at__gte=since).values_list("vehicle_id", "created_at"), "rating"),
+			(FavoriteVehicle.objects.filter(created_at__gte=since).values_list("vehicle_id", "created_at"), "favorite"),
+		]
+	scores: dict[int, float] = {}
+	for queryset, event in sources:
+		weight = EVENT_WEIGHTS[event]
+		for member_id, created_at in queryset.order_by().iterator(chunk_size=2000):
+			age = (now - created_at).total_seconds()
+			scores[member_id] = scores.get(member_id, 0.0) + weight * math.pow(2, -age / TRENDING_HALF_LIFE)
+	return {member_id: score for member_id, score in scores.items() if score >= TRENDING_MIN_SCORE}
+
+
+def rebuild_trending(kind: str, days: int = TRENDING_REBUILD_DAYS) -> int:
+	"""以 DB 重建整個 sorted set（寫入暫存 key 後 RENAME，讀取端不會看到一半的資料）。"""
+	scores = trending_scores_from_db(kind, days)
+	if len(scores) > TRENDING_MAX_MEMBERS:
+		scores = dict(heapq.nlargest(TRENDING_MAX_MEMBERS, scores.items(), key=lambda item: item[1]))
+	client = _redis_client()
+	if client is None:
+		local_trending.replace(kind, scores)
+		return len(scores)
+
+	key, epoch_key = _keys(kind)
+	now_ms = client.time()
+	now_ms = now_ms[0] * 1000 + now_ms[1] // 1000
+	pipe = client.pipeline(transaction=True)
+	if scores:
+		staging = f"{key}:rebuild"
+		pipe.delete(staging)
+		pipe.zadd(staging, {str(member_id): score for member_id, score in scores.items()})
+		pipe.rename(staging, key)
+	else:
+		pipe.delete(key)
+	pipe.set(epoch_key, now_ms)
+	pipe.execute()
+	return len(scores)
+
+
+def trending_vehicles(limit: int = 10):
+	"""依熱度排序的 Vehicle 列表（附 ``trending_score``）。"""
+	ranked = top_trending(TRENDING_VEHICLES, limit)
+	vehicles = Vehicle.objects.prefetch_related("images").in_bulk([vehicle_id for vehicle_id, _ in ranked])
+	result = []
+	for vehicle_id, score in ranked:
+		vehicle = vehicles.get(vehicle_id)
+		if vehicle is not None:
+			vehicle.trending_score = score
+			result.append(vehicle)
+	return result
+
+
+def trending_tags(limit: int = 10):
+	"""依熱度排序的 Tag 列表（附 ``trending_score``）。"""
+	ranked = top_trending(TRENDING_TAGS, limit)
+	tags = Tag.objects.in_bulk([tag_id for tag_id, _ in ranked])
+	result = []
+	for tag_id, score in ranked:
+		tag = tags.get(tag_id)
+		if tag is not None:
+			tag.trending_score = score
+			result.append(tag)
+	return result
@@ -19,10 +19,19 @@ urlpatterns = [
 	path("ajax/vehicle/<int:id>/rate/", views.rate_vehicle_ajax, name="rate_vehicle_ajax"),
 	path("ajax/comment/new/", views.comment_create_ajax, name="comment_create_ajax"),
 	path("api/vehicles/", views.VehicleListAPIView.as_view(), name="api_vehicle_list"),
+	path("api/garage/add/", views.api_garage_batch_add, name="api_garage_batch_add"),
+	path("api/garage/remove/", views.api_garage_batch_remove, name="api_garage_batch_remove"),
+	path("api/favorites/add/", views.api_favorite_batch_add, name="api_favorite_batch_add"),
+	path("api/favorites/remove/", views.api_favorite_batch_remove, name="api_favorite_batch_remove"),
 	path("api/garage/add/<int:vehicle_id>/", views.api_garage_add, name="api_garage_add"),
 	path("api/garage/remove/<int:vehicle_id>/", views.api_garage_remove, name="api_garage_remove"),
 	path("api/favorites/add/<int:vehicle_id>/", views.api_favorite_add, name="api_favorite_add"),
 	path("api/favorites/remove/<int:vehicle_id>/", views.api_favorite_remove, name="api_favorite_remove"),
+	path("api/membership/", views.api_membership, name="api_membership"),
+	path("api/trending/", views.api_trending, name="api_trending"),
+	path("api/notifications/", views.api_notifications, name="api_notifications"),
+	path("api/notifications/read/", views.api_notifications_read, name="api_notifications_read"),
+	path("api/notifications/metrics/", views.notification_metrics, name="notification_metrics"),
 	path("garage/", views.user_garage, name="user_garage"),
 	path("garage/<int:user_vehicle_id>/delete/", views.user_vehicle_delete, name="user_vehicle_delete"),
 	path("favorites/", views.user_favorites, name="user_favorites"),
@@ -31,5 +40,8 @@ urlpatterns = [
 	path("auth/logout/", auth_views.LogoutView.as_view(), name="logout"),
 	# Celery 背景任務端點
 	path("api/export/vehicles/", views.export_vehicles_csv, name="export_vehicles_csv"),
+	path("api/export/vehicles/download/", views.export_vehicles_download, name="export_vehicles_download"),
+	path("api/export/catalog/", views.export_catalog_sharded, name="export_catalog_sharded"),
 	path("api/export/status/<str:task_id>/", views.export_task_status, name="export_task_status"),
+	path("api/cache/stats/", views.cache_stats, name="cache_stats"),
 ]
@@ -0,0 +1,204 @@
+"""
+車輛清單 API（/api/vehicles/）的分頁、欄位選擇與增量同步。
+
+- 一般模式：依 (brand, model, id) 做 keyset 分頁，``cursor`` 為上一頁最後一筆的排序鍵
+- ``fields=``：逗號分隔欄位，直接投影到 ``values()``，id 一律包含
+- 篩選參數與搜尋頁相同（見 ``filters.filter_vehicles``）
+- 增量模式（``updated_since=``）：依 (updated_at, id) 分頁，只回傳之後有變動的車輛；
+  期間被刪除的車輛 id（來自 ``VehicleTombstone``）以同一個 cursor 依墓碑 id 分頁，每頁最多 limit 筆，
+  兩者任一還有資料時都會回傳 ``next_cursor``
+
+沒有 ``cursor`` / ``limit`` 的請求也只回傳第一頁（``DEFAULT_PAGE_SIZE`` 筆）；
+過去一次取得整個目錄的客戶端需改為依 ``next_cursor`` 取完所有頁面。
+
+客戶端增量同步流程：把上次同步第一頁回傳的 ``server_time`` 當作下次的 ``updated_since``，
+依 ``next_cursor`` 取完所有頁面（合併每頁的 ``vehicles`` 與 ``deleted``）；
+收到 ``full_resync_required`` 時需重新全量同步。
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import Mapping
+
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .filters import filter_vehicles
+from .models import Vehicle, VehicleTombstone
+
+VEHICLE_LIST_FIELDS = (
+	"id",
+	"brand",
+	"model",
+	"generation",
+	"years_from",
+	"years_to",
+	"displacement_cc",
+	"cylinders",
+	"horsepower_ps",
+	"msrp_new",
+	"used_price_min",
+	"used_price_max",
+	"cover_url",
+	"updated_at",
+)
+DEFAULT_VEHICLE_LIST_FIELDS = ("id", "brand", "model", "displacement_cc", "horsepower_ps", "cylinders")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# 墓碑保留天數；updated_since 早於此期限的客戶端需重新全量同步
+TOMBSTONE_RETENTION_DAYS = 30
+
+
+class VehicleListError(ValueError):
+	"""查詢參數錯誤（回傳 400）"""
+
+
+def encode_cursor(values: list) -> str:
+	raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+	return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+	try:
+		padded = cursor + "=" * (-len(cursor) % 4)
+		values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+	except (ValueError, UnicodeError):
+		raise VehicleListError("cursor 格式錯誤")
+	if not isinstance(values, list) or len(values) != size:
+		raise VehicleListError("cursor 格式錯誤")
+	return values
+
+
+def resolve_list_fields(raw: str | None) -> list[str]:
+	if not raw:
+		return list(DEFAULT_VEHICLE_LIST_FIELDS)
+	fields = [field.strip() for field in raw.split(",") if field.strip()]
+	unknown = [field for field in fields if field not in VEHICLE_LIST_FIELDS]
+	if unknown:
+		raise VehicleListError(f"不支援的欄位：{', '.join(unknown)}")
+	if "id" not in fields:
+		fields.insert(0, "id")
+	return list(dict.fromkeys(fields))
+
+
+def parse_page_size(raw: str | None) -> int:
+	if not raw:
+		return DEFAULT_PAGE_SIZE
+	try:
+		limit = int(raw)
+	except ValueError:
+		raise VehicleListError("limit 必須為整數")
+	return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_updated_since(raw: str) -> datetime:
+	try:
+		# 查詢字串中未編碼的 "+"（時區）會被解成空白
+		value = parse_datetime(str(raw).strip().replace(" ", "+"))
+	except ValueError:
+		value = None
+	if value is None:
+		raise VehicleListError("updated_since 必須為 ISO 8601 時間")
+	if timezone.is_naive(value):
+		value = timezone.make_aware(value, timezone.get_default_timezone())
+	return value
+
+
+def _fetch_page(qs: QuerySet, order: tuple[str, ...], fields: list[str], limit: int):
+	"""
+	取 limit + 1 筆判斷是否有下一頁；排序鍵欄位即使沒被選取也一併查詢。
+
+	回傳 (rows, 最後一筆的排序鍵或 None, 是否還有下一頁)。
+	"""
+	columns = list(dict.fromkeys([*fields, *order]))
+	rows = list(qs.order_by(*order).values(*columns)[: limit + 1])
+	has_more = len(rows) > limit
+	rows = rows[:limit]
+	last_key = None
+	if rows:
+		last = rows[-1]
+		last_key = [last[key].isoformat() if isinstance(last[key], datetime) else last[key] for key in order]
+	extra = [key for key in columns if key not in fields]
+	for row in rows:
+		for key in extra:
+			del row[key]
+	return rows, last_key, has_more
+
+
+def build_vehicle_page(params: Mapping) -> dict:
+	"""依查詢參數組出一頁車輛清單的回應內容。"""
+	fields = resolve_list_fields(params.get("fields"))
+	limit = parse_page_size(params.get("limit"))
+	cursor = params.get("cursor")
+	qs = filter_vehicles(Vehicle.objects.all(), params)
+
+	since_raw = params.get("updated_since")
+	if since_raw:
+		return _build_delta_page(qs, parse_updated_since(since_raw), cursor, fields, limit)
+
+	if cursor:
+		brand, model, last_id = decode_cursor(cursor, 3)
+		if not isinstance(last_id, int):
+			raise VehicleListError("cursor 格式錯誤")
+		qs = qs.filter(
+			Q(brand__gt=brand) | Q(brand=brand, model__gt=model) | Q(brand=brand, model=model, id__gt=last_id)
+		)
+	vehicles, last_key, has_more = _fetch_page(qs, ("brand", "model", "id"), fields, limit)
+	next_cursor = encode_cursor(last_key) if has_more else None
+	return {
+		"success": True,
+		"data": {
+			"vehicles": vehicles,
+			"next_cursor": next_cursor,
+		},
+	}
+
+
+def _build_delta_page(qs: QuerySet, since: datetime, cursor: str | None, fields: list[str], limit: int) -> dict:
+	"""
+	增量同步的一頁：變動車輛與刪除紀錄各自依自己的排序鍵往後取，cursor 同時記錄兩者的位置
+	（[updated_at, 車輛 id, 墓碑 id]）。第一頁的位置為 (since, 0, 0)。
+	"""
+	if cursor:
+		last_updated, last_id, last_tombstone = decode_cursor(cursor, 3)
+		if not isinstance(last_id, int) or not isinstance(last_tombstone, int):
+			raise VehicleListError("cursor 格式錯誤")
+		last_updated = parse_updated_since(last_updated)
+	else:
+		last_updated, last_id, last_tombstone = since, 0, 0
+	# 第一頁等同 updated_at >= since：同一時間戳記的變動寧可重複回傳（客戶端 upsert 為冪等），也不能漏掉
+	qs = qs.filter(Q(updated_at__gt=last_updated) | Q(updated_at=last_updated, id__gt=last_id))
+
+	server_time = timezone.now()
+	vehicles, last_key, vehicles_more = _fetch_page(qs, ("updated_at", "id"), fields, limit)
+	if last_key:
+		last_updated, last_id = parse_updated_since(last_key[0]), last_key[1]
+
+	tombstones = list(
+		VehicleTombstone.objects.filter(deleted_at__gte=since, pk__gt=last_tombstone)
+		.order_by("pk")
+		.values_list("pk", "vehicle_id")[: limit + 1]
+	)
+	tombstones_more = len(tombstones) > limit
+	tombstones = tombstones[:limit]
+	if tombstones:
+		last_tombstone = tombstones[-1][0]
+
+	next_cursor = None
+	if vehicles_more or tombstones_more:
+		next_cursor = encode_cursor([last_updated.isoformat(), last_id, last_tombstone])
+	data = {
+		"vehicles": vehicles,
+		"deleted": list(dict.fromkeys(vehicle_id for _, vehicle_id in tombstones)),
+		"next_cursor": next_cursor,
+		"server_time": server_time.isoformat(),
+	}
+	if not cursor:
+		data["full_resync_required"] = since < server_time - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+	return {"success": True, "data": data}
@@ -1,23 +1,63 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from asgiref.sync import sync_to_async
 from django import forms
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from apps.accounts.forms import CustomUserCreationForm
-from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Avg, Count, Max, Q, Prefetch
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db.models import Avg, Count, Max, Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.views import View
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_POST
-from django_ratelimit.decorators import ratelimit
 
 from celery.result import AsyncResult
+from .exports import (
+	EXPORT_FORMATS,
+	STREAM_CONTENT_TYPES,
+	STREAM_EXPORT_MAX_ROWS,
+	ExportError,
+	aiter_stream_chunks,
+	claim_export,
+	estimate_row_count,
+	export_file_url,
+	export_fingerprint,
+	export_queryset,
+	get_cached_export,
+	iter_stream_chunks,
+	release_export,
+	resolve_columns,
+	validate_format,
+)
+from .filters import VEHICLE_FILTER_PARAMS, clean_vehicle_filters, filter_vehicles
+from .consumers import notification_connection_metrics
+from .caching import acache_get, aget_or_rebuild, catalog_cache, two_tier_stats
+from .json_response import encode_body, encoded_json_response
+from .ratelimit import ratelimit
+from .vehicle_list import VehicleListError, build_vehicle_page
+from .inbox import InboxError, build_inbox_page, get_unread_count, mark_read, parse_optional_int
+from .membership import (
+	MembershipError,
+	aadd_to_collection,
+	aremove_from_collection,
+	get_membership,
+	membership_as_json,
+	parse_id_list,
+)
+from .task_events import TASK_STATUS_POLLS, add_task_subscriber, bump_counter
+from .trending import TRENDING_HALF_LIFE, TRENDING_KINDS, TRENDING_VEHICLES, trending_tags, trending_vehicles
 from .forms import (
 	PostCreateForm,
 	CommentCreateForm,
@@ -37,11 +77,21 @@ from .models import (
 	UserVehicle,
 	FavoriteVehicle,
 	Rating,
+	VehicleNeighbor,
+	RelatedVehicle,
 )
 
 
-VEHICLE_LIST_CACHE_KEY = "api:vehicle_list"
+logger = logging.getLogger(__name__)
+
+# 快取內容為編碼後的 bytes（raw + gzip），與舊版 dict 格式不相容，因此換新 key；
+# 實際 key 另外加上目錄世代與查詢參數雜湊，Vehicle 變動時舊頁面自然失效
+VEHICLE_LIST_CACHE_KEY = "api:vehicle_list:body"
 VEHICLE_LIST_CACHE_TIMEOUT = 60  # seconds
+VEHICLE_LIST_CACHE_HARD_TIMEOUT = 300  # 過期後仍可回傳舊值的時間，期間只會有一個請求重建
+TRENDING_API_LIMIT = 10
+TRENDING_API_MAX_LIMIT = 50
+RELATED_VEHICLES_LIMIT = 6
 
 
 def _vehicle_detail_queryset():
@@ -82,18 +132,30 @@ def _build_vehicle_detail_context(
 
 	user_rating = None
 	rating_form = None
-	if request.user.is_authenticated:
-		user_rating = Rating.objects.filter(vehicle=vehicle, user=request.user).first()
-		initial_score = str(user_rating.score) if user_rating else ""
-		rating_form = RatingForm(initial={"score": initial_score})
-
 	user_vehicle_entry = None
-	favorite_entry = None
+	favorite_entry = False
 	if request.user.is_authenticated:
-		user_vehicle_entry = UserVehicle.objects.filter(user=request.user, vehicle=vehicle).first()
-		favorite_entry = FavoriteVehicle.objects.filter(user=request.user, vehicle=vehicle).first()
+		# 評分 / 車庫 / 最愛狀態一次取得（命中快取時不查 DB）
+		membership = get_membership(request.user.id, [vehicle.id])
+		user_rating = membership["ratings"].get(vehicle.id)
+		rating_form = RatingForm(initial={"score": str(user_rating) if user_rating else ""})
+		if vehicle.id in membership["garage"]:
+			user_vehicle_entry = {"created_at": membership["garage"][vehicle.id]}
+		favorite_entry = vehicle.id in membership["favorites"]
 
 	gallery_images = vehicle.get_gallery_images()
+	# 預先計算的規格相似車款（見 ``similarity``），以 (vehicle, rank) 索引一次查出
+	similar_vehicles = [
+		row.neighbor
+		for row in VehicleNeighbor.objects.filter(vehicle_id=vehicle.id).select_related("neighbor").order_by("rank")
+	]
+	# 協同過濾「車友也喜歡」（見 ``recommendations``）
+	related_vehicles = [
+		row.related
+		for row in RelatedVehicle.objects.filter(vehicle_id=vehicle.id)
+		.select_related("related")
+		.order_by("rank")[:RELATED_VEHICLES_LIMIT]
+	]
 
 	return {
 		"vehicle": vehicle,
@@ -106,6 +168,8 @@ def _build_vehicle_detail_context(
 		"intro_form": intro_form or VehicleIntroForm(instance=vehicle),
 		"photo_form": photo_form or VehiclePhotoForm(),
 		"gallery_images": gallery_images,
+		"similar_vehicles": similar_vehicles,
+		"related_vehicles": related_vehicles,
 	}
 
 
@@ -119,39 +183,7 @@ def search(request: HttpRequest) -> HttpResponse:
 	hp_max = request.GET.get("hp_max", "").strip()
 	cylinders = request.GET.get("cylinders", "").strip()
 
-	qs = Vehicle.objects.all()
-	if query:
-		qs = qs.filter(Q(brand__icontains=query) | Q(model__icontains=query))
-	if brand:
-		qs = qs.filter(brand__icontains=brand)
-	if displacement_min:
-		try:
-			qs = qs.filter(displacement_cc__gte=int(displacement_min))
-		except ValueError:
-			pass
-	if displacement_max:
-		try:
-			qs = qs.filter(displacement_cc__lte=int(displacement_max))
-		except ValueError:
-			pass
-	if hp_min:
-		try:
-			qs = qs.filter(horsepower_ps__gte=int(hp_min))
-		except ValueError:
-			pass
-	if hp_max:
-		try:
-			qs = qs.filter(horsepower_ps__lte=int(hp_max))
-		except ValueError:
-			pass
-	if cylinders:
-		try:
-			cyl_values = [int(c.strip()) for c in cylinders.split(",") if c.strip()]
-			if cyl_values:
-				qs = qs.filter(cylinders__in=cyl_values)
-		except ValueError:
-			pass
-
+	qs = filter_vehicles(Vehicle.objects.all(), request.GET)
 	qs = qs.prefetch_related("images").order_by("brand", "model")
 	# 分頁設定
 	page_number = request.GET.get("page") or 1
@@ -480,7 +512,7 @@ def user_vehicle_delete(request: HttpRequest, user_vehicle_id: int) -> HttpRespo
 	return redirect("user_garage")
 
 
-def _api_collection_add(
+async def _api_collection_add(
 	request: HttpRequest,
 	vehicle_id: int,
 	model_class,
@@ -490,34 +522,37 @@ def _api_collection_add(
 ) -> JsonResponse:
 	"""
 	通用的「加入收藏」API 處理函式。
-	減少 garage/favorite add 的重複程式碼。
+	減少 garage/favorite add 的重複程式碼；與批次 API 共用 add_to_collection。
 	"""
-	vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
-	existing = model_class.objects.filter(user=request.user, vehicle=vehicle).first()
-	if existing:
+	user = await request.auser()
+	result = await aadd_to_collection(user.id, model_class, [vehicle_id])
+	if vehicle_id in result["missing"]:
+		raise Http404("找不到這台車。")
+
+	vehicle = result["labels"][vehicle_id]
+	if vehicle_id in result["existing"]:
 		return JsonResponse(
 			{
 				"success": False,
 				"message": f"{vehicle} 已在你的{collection_name}中。",
 				state_key: True,
-				id_key: existing.id,
+				id_key: result["existing"][vehicle_id],
 			},
 			status=200,
 		)
 
-	item = model_class.objects.create(user=request.user, vehicle=vehicle)
 	return JsonResponse(
 		{
 			"success": True,
 			"message": f"已將 {vehicle} 加入{collection_name}！",
 			state_key: True,
-			id_key: item.id,
+			id_key: result["added"][vehicle_id],
 		},
 		status=201,
 	)
 
 
-def _api_collection_remove(
+async def _api_collection_remove(
 	request: HttpRequest,
 	vehicle_id: int,
 	model_class,
@@ -527,11 +562,11 @@ def _api_collection_remove(
 ) -> JsonResponse:
 	"""
 	通用的「移除收藏」API 處理函式。
-	減少 garage/favorite remove 的重複程式碼。
+	減少 garage/favorite remove 的重複程式碼；與批次 API 共用 remove_from_collection。
 	"""
-	vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
-	item = model_class.objects.filter(user=request.user, vehicle=vehicle).first()
-	if not item:
+	user = await request.auser()
+	result = await aremove_from_collection(user.id, model_class, [vehicle_id])
+	if not result["removed"]:
 		return JsonResponse(
 			{
 				"success": False,
@@ -541,28 +576,50 @@ def _api_collection_remove(
 			status=404,
 		)
 
-	item.delete()
 	return JsonResponse(
 		{
 			"success": True,
-			"message": f"已將 {vehicle} 從{collection_name}移除。",
+			"message": f"已將 {result['labels'][vehicle_id]} 從{collection_name}移除。",
 			state_key: False,
 		},
 		status=200,
 	)
 
 
+async def _api_collection_batch(request: HttpRequest, model_class, action: str) -> JsonResponse:
+	"""批次加入 / 移除：POST vehicle_ids=1,2,3（最多 300 筆）。"""
+	try:
+		vehicle_ids = parse_id_list(request.POST, "vehicle_ids")
+	except MembershipError as exc:
+		return JsonResponse({"success": False, "error": str(exc)}, status=400)
+	if not vehicle_ids:
+		return JsonResponse({"success": False, "error": "請提供 vehicle_ids"}, status=400)
+
+	user = await request.auser()
+	if action == "add":
+		result = await aadd_to_collection(user.id, model_class, vehicle_ids)
+		return JsonResponse({
+			"success": True,
+			"added": sorted(result["added"]),
+			"existing": sorted(result["existing"]),
+			"missing": result["missing"],
+		})
+
+	result = await aremove_from_collection(user.id, model_class, vehicle_ids)
+	return JsonResponse({"success": True, "removed": result["removed"], "missing": result["missing"]})
+
+
 @login_required
 @require_POST
 @ratelimit(key='user', rate='30/m', method='POST', block=True)
-def api_garage_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
+async def api_garage_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 	"""
 	Week 10/11 範例：將車輛加入「我的車庫」。
 	- Method: POST
 	- URL: /api/garage/add/<vehicle_id>/
 	- Response: {"success": bool, "message": str, "in_garage": bool, "user_vehicle_id": int}
 	"""
-	return _api_collection_add(
+	return await _api_collection_add(
 		request, vehicle_id, UserVehicle,
 		collection_name="車庫",
 		state_key="in_garage",
@@ -573,14 +630,14 @@ def api_garage_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 @login_required
 @require_POST
 @ratelimit(key='user', rate='30/m', method='POST', block=True)
-def api_garage_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
+async def api_garage_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 	"""
 	Week 10/11 範例：自車庫移除車輛。
 	- Method: POST
 	- URL: /api/garage/remove/<vehicle_id>/
 	- Response: {"success": bool, "message": str, "in_garage": bool}
 	"""
-	return _api_collection_remove(
+	return await _api_collection_remove(
 		request, vehicle_id, UserVehicle,
 		collection_name="車庫",
 		state_key="in_garage",
@@ -591,14 +648,14 @@ def api_garage_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 @login_required
 @require_POST
 @ratelimit(key='user', rate='30/m', method='POST', block=True)
-def api_favorite_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
+async def api_favorite_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 	"""
 	Week 11 AJAX 範例：加入「我的最愛」（車款清單）。
 	- Method: POST
 	- URL: /api/favorites/add/<vehicle_id>/
 	- Response: {"success": bool, "favorite": bool, "favorite_id": int}
 	"""
-	return _api_collection_add(
+	return await _api_collection_add(
 		request, vehicle_id, FavoriteVehicle,
 		collection_name="最愛清單",
 		state_key="favorite",
@@ -609,13 +666,13 @@ def api_favorite_add(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 @login_required
 @require_POST
 @ratelimit(key='user', rate='30/m', method='POST', block=True)
-def api_favorite_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
+async def api_favorite_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 	"""
 	Week 11 AJAX 範例：從我的最愛清單移除車輛。
 	- Method: POST
 	- URL: /api/favorites/remove/<vehicle_id>/
 	"""
-	return _api_collection_remove(
+	return await _api_collection_remove(
 		request, vehicle_id, FavoriteVehicle,
 		collection_name="最愛清單",
 		state_key="favorite",
@@ -623,6 +680,158 @@ def api_favorite_remove(request: HttpRequest, vehicle_id: int) -> JsonResponse:
 	)
 
 
+@login_required
+@require_POST
+@ratelimit(key='user', rate='30/m', method='POST', block=True)
+async def api_garage_batch_add(request: HttpRequest) -> JsonResponse:
+	"""
+	批次加入車庫。
+	- Method: POST
+	- URL: /api/garage/add/
+	- Params: vehicle_ids=1,2,3
+	- Response: {"success": bool, "added": [id], "existing": [id], "missing": [id]}
+	"""
+	return await _api_collection_batch(request, UserVehicle, "add")
+
+
+@login_required
+@require_POST
+@ratelimit(key='user', rate='30/m', method='POST', block=True)
+async def api_garage_batch_remove(request: HttpRequest) -> JsonResponse:
+	"""
+	批次自車庫移除。
+	- Method: POST
+	- URL: /api/garage/remove/
+	- Params: vehicle_ids=1,2,3
+	- Response: {"success": bool, "removed": [id], "missing": [id]}
+	"""
+	return await _api_collection_batch(request, UserVehicle, "remove")
+
+
+@login_required
+@require_POST
+@ratelimit(key='user', rate='30/m', method='POST', block=True)
+async def api_favorite_batch_add(request: HttpRequest) -> JsonResponse:
+	"""
+	批次加入我的最愛。
+	- Method: POST
+	- URL: /api/favorites/add/
+	- Params: vehicle_ids=1,2,3
+	- Response: {"success": bool, "added": [id], "existing": [id], "missing": [id]}
+	"""
+	return await _api_collection_batch(request, FavoriteVehicle, "add")
+
+
+@login_required
+@require_POST
+@ratelimit(key='user', rate='30/m', method='POST', block=True)
+async def api_favorite_batch_remove(request: HttpRequest) -> JsonResponse:
+	"""
+	批次自我的最愛移除。
+	- Method: POST
+	- URL: /api/favorites/remove/
+	- Params: vehicle_ids=1,2,3
+	- Response: {"success": bool, "removed": [id], "missing": [id]}
+	"""
+	return await _api_collection_batch(request, FavoriteVehicle, "remove")
+
+
+@login_required
+def api_membership(request: HttpRequest) -> JsonResponse:
+	"""
+	批次查詢使用者與多台車輛 / 多篇貼文的關係。
+	- Method: GET
+	- URL: /api/membership/?vehicle_ids=1,2,3&post_ids=10,11（各最多 300 筆）
+	- Response: {"success": true, "data": {"favorites": [id], "garage": [id],
+	  "ratings": {"<vehicle_id>": score}, "liked_posts": [id]}}
+	"""
+	try:
+		vehicle_ids = parse_id_list(request.GET, "vehicle_ids")
+		post_ids = parse_id_list(request.GET, "post_ids")
+	except MembershipError as exc:
+		return JsonResponse({"success": False, "error": str(exc)}, status=400)
+
+	membership = get_membership(request.user.id, vehicle_ids, post_ids)
+	return JsonResponse({"success": True, "data": membership_as_json(membership)})
+
+
+@login_required
+def api_notifications(request: HttpRequest) -> JsonResponse:
+	"""
+	通知收件匣（由新到舊）。
+	- Method: GET
+	- URL: /api/notifications/?limit=20&cursor=...&unread=1
+	- Response: {"success": true, "data": {"notifications": [...], "next_cursor": str|null, "unread_count": int}}
+	"""
+	try:
+		data = build_inbox_page(request.user.id, request.GET)
+	except InboxError as exc:
+		return JsonResponse({"success": False, "error": str(exc)}, status=400)
+	return JsonResponse({"success": True, "data": data})
+
+
+@login_required
+@require_POST
+@ratelimit(key='user', rate='30/m', method='POST', block=True)
+def api_notifications_read(request: HttpRequest) -> JsonResponse:
+	"""
+	批次標記已讀。
+	- Method: POST
+	- URL: /api/notifications/read/
+	- Params: min_id / max_id（含端點，皆可省略；都省略時標記全部）
+	- Response: {"success": true, "updated": int, "unread_count": int}
+	"""
+	try:
+		min_id = parse_optional_int(request.POST, "min_id")
+		max_id = parse_optional_int(request.POST, "max_id")
+	except InboxError as exc:
+		return JsonResponse({"success": False, "error": str(exc)}, status=400)
+
+	updated = mark_read(request.user.id, min_id=min_id, max_id=max_id)
+	return JsonResponse({"success": True, "updated": updated, "unread_count": get_unread_count(request.user.id)})
+
+
+def api_trending(request: HttpRequest) -> JsonResponse:
+	"""
+	本週熱門車款 / 標籤（依時間衰減的熱度排序，見 ``trending``）。
+	- Method: GET
+	- URL: /api/trending/?kind=vehicles|tags&limit=10
+	- Response: {"success": true, "data": {"kind": str, "half_life_hours": int, "results": [...]}}
+	"""
+	kind = request.GET.get("kind") or TRENDING_VEHICLES
+	if kind not in TRENDING_KINDS:
+		return JsonResponse({"success": False, "error": "kind 必須為 vehicles 或 tags"}, status=400)
+	try:
+		limit = int(request.GET.get("limit") or TRENDING_API_LIMIT)
+	except ValueError:
+		return JsonResponse({"success": False, "error": "limit 必須為整數"}, status=400)
+	limit = max(1, min(limit, TRENDING_API_MAX_LIMIT))
+
+	if kind == TRENDING_VEHICLES:
+		results = [
+			{
+				"id": vehicle.id,
+				"brand": vehicle.brand,
+				"model": vehicle.model,
+				"displacement_cc": vehicle.displacement_cc,
+				"horsepower_ps": vehicle.horsepower_ps,
+				"score": round(vehicle.trending_score, 3),
+			}
+			for vehicle in trending_vehicles(limit)
+		]
+	else:
+		results = [
+			{"id": tag.id, "name": tag.name, "score": round(tag.trending_score, 3)}
+			for tag in trending_tags(limit)
+		]
+	return JsonResponse(
+		{
+			"success": True,
+			"data": {"kind": kind, "half_life_hours": TRENDING_HALF_LIFE // 3600, "results": results},
+		}
+	)
+
+
 @login_required
 def user_favorites(request: HttpRequest) -> HttpResponse:
 	favorites = (
@@ -641,37 +850,52 @@ def user_favorites(request: HttpRequest) -> HttpResponse:
 
 class VehicleListAPIView(View):
 	"""
-	Read-only JSON API（Week 11 範例）：回傳車輛清單並使用 Redis 快取 60 秒。
+	Read-only JSON API（Week 11 範例）：回傳車輛清單並使用 Redis 快取 60 秒（過期時 single-flight 重建）。
+	快取的是編碼好的回應 bytes（含 gzip 版本），命中時直接寫回，不再重新序列化。
+	- Params:
+	  - cursor / limit（預設 100，最多 500）：keyset 分頁
+	  - fields：逗號分隔欄位，例如 id,brand,model,updated_at
+	  - 與搜尋頁相同的篩選條件（query / brand / displacement_min / hp_min / cylinders ...）
+	  - updated_since：ISO 8601 時間，只回傳之後變動的車輛與被刪除的 id（不快取）
 	Response:
 	{
 		"success": true,
-		"data": {"vehicles": [{id, brand, model, displacement_cc, horsepower_ps, cylinders}]}
+		"data": {
+			"vehicles": [{id, brand, model, displacement_cc, horsepower_ps, cylinders}],
+			"next_cursor": str|null,
+			// 僅 updated_since 模式
+			"server_time": str, "deleted": [id], "full_resync_required": bool
+		}
 	}
 	"""
 
-	def get(self, _request: HttpRequest) -> JsonResponse:
-		cached = cache.get(VEHICLE_LIST_CACHE_KEY)
-		if cached is not None:
-			return JsonResponse(cached, status=200)
-
-		vehicles = list(
-			Vehicle.objects.order_by("brand", "model").values(
-				"id",
-				"brand",
-				"model",
-				"displacement_cc",
-				"horsepower_ps",
-				"cylinders",
+	async def get(self, request: HttpRequest) -> HttpResponse:
+		# async view：快取命中時全程在 event loop 上完成，不需切換到執行緒
+		params = request.GET
+		try:
+			if params.get("updated_since"):
+				page = await sync_to_async(build_vehicle_page)(params)
+				return encoded_json_response(request, encode_body(page))
+			generation = await acache_get(catalog_cache.generation_key, 0)
+			body = await aget_or_rebuild(
+				_vehicle_list_cache_key(params, generation),
+				lambda: encode_body(build_vehicle_page(params)),
+				soft_ttl=VEHICLE_LIST_CACHE_TIMEOUT,
+				hard_ttl=VEHICLE_LIST_CACHE_HARD_TIMEOUT,
 			)
-		)
-		response_data = {
-			"success": True,
-			"data": {
-				"vehicles": vehicles,
-			},
-		}
-		cache.set(VEHICLE_LIST_CACHE_KEY, response_data, VEHICLE_LIST_CACHE_TIMEOUT)
-		return JsonResponse(response_data, status=200)
+		except VehicleListError as exc:
+			return JsonResponse({"success": False, "error": str(exc)}, status=400)
+		return encoded_json_response(request, body)
+
+
+def _vehicle_list_cache_key(params, generation: int) -> str:
+	relevant = sorted(
+		(name, params.get(name))
+		for name in (*VEHICLE_FILTER_PARAMS, "fields", "cursor", "limit")
+		if params.get(name)
+	)
+	digest = hashlib.sha1(json.dumps(relevant, ensure_ascii=False).encode("utf-8")).hexdigest()
+	return f"{VEHICLE_LIST_CACHE_KEY}:{generation}:{digest}"
 
 
 def _prepare_user_vehicle_field(form: PostCreateForm, user_vehicles: list[UserVehicle]) -> None:
@@ -694,9 +918,9 @@ def _safe_redirect(request: HttpRequest, target: str | None, fallback: str) -> s
 @login_required
 @require_POST
 @ratelimit(key='user', rate='30/m', method='POST', block=True)
-def rate_vehicle_ajax(request: HttpRequest, id: int) -> JsonResponse:
-	"""AJAX 版本的車輛評分"""
-	vehicle = get_object_or_404(Vehicle, pk=id)
+async def rate_vehicle_ajax(request: HttpRequest, id: int) -> JsonResponse:
+	"""AJAX 版本的車輛評分（async view，使用 async ORM）"""
+	vehicle = await aget_object_or_404(Vehicle.objects.only("id"), pk=id)
 	
 	if request.method != "POST":
 		return JsonResponse({"success": False, "error": "Invalid method"}, status=405)
@@ -707,14 +931,14 @@ def rate_vehicle_ajax(request: HttpRequest, id: int) -> JsonResponse:
 		return JsonResponse({"success": False, "error": str(errors[0])}, status=400)
 	
 	score = int(form.cleaned_data["score"])
-	_, created = Rating.objects.update_or_create(
+	_, created = await Rating.objects.aupdate_or_create(
 		vehicle=vehicle,
-		user=request.user,
+		user=await request.auser(),
 		defaults={"score": score},
 	)
 	
 	# 重新計算平均評分
-	stats = vehicle.ratings.aggregate(avg=Avg("score"), count=Count("id"))
+	stats = await vehicle.ratings.aaggregate(avg=Avg("score"), count=Count("id"))
 	
 	return JsonResponse({
 		"success": True,
@@ -778,48 +1002,208 @@ def comment_create_ajax(request: HttpRequest) -> JsonResponse:
 @require_POST
 def export_vehicles_csv(request: HttpRequest) -> JsonResponse:
 	"""
-	觸發 Celery 背景任務：匯出車輛資料為 CSV。
+	觸發 Celery 背景任務：匯出車輛資料。
 	- Method: POST
 	- URL: /api/export/vehicles/
 	- 僅限管理員使用
-	- Response: {"success": bool, "task_id": str, "message": str}
+	- Params: format (csv / csv.gz / jsonl / parquet)、columns（逗號分隔）、
+	  以及與搜尋頁相同的篩選條件（query / brand / displacement_min ...）
+	- 相同條件且車輛資料未變動時直接回傳既有檔案（cached=true, result=網址）；
+	  相同條件的任務執行中時回傳同一個 task_id
+	- Response: {"success": bool, "task_id": str|null, "cached": bool, "message": str}
+	"""
+	fmt = request.POST.get("format", "csv").strip() or "csv"
+	try:
+		validate_format(fmt)
+		columns = [column.key for column in resolve_columns(request.POST.get("columns"))]
+	except ExportError as exc:
+		return JsonResponse({"success": False, "message": str(exc)}, status=400)
+
+	return _enqueue_vehicle_export(request, fmt, columns, clean_vehicle_filters(request.POST))
+
+
+@staff_member_required
+def export_vehicles_download(request: HttpRequest) -> HttpResponse:
 	"""
+	小量匯出直接串流下載（不經 Celery、不寫暫存檔）。
+	- Method: GET
+	- URL: /api/export/vehicles/download/
+	- 僅限管理員使用
+	- Params: format (csv / jsonl)、columns、以及與搜尋頁相同的篩選條件
+	- 預估筆數超過 STREAM_EXPORT_MAX_ROWS 時改排背景任務，
+	  回傳 202 與 /api/export/vehicles/ 相同格式的 JSON
+	"""
+	fmt = request.GET.get("format", "csv").strip() or "csv"
+	if fmt not in STREAM_CONTENT_TYPES:
+		return JsonResponse(
+			{"success": False, "message": f"串流下載僅支援：{', '.join(STREAM_CONTENT_TYPES)}"},
+			status=400,
+		)
+	try:
+		columns = [column.key for column in resolve_columns(request.GET.get("columns"))]
+	except ExportError as exc:
+		return JsonResponse({"success": False, "message": str(exc)}, status=400)
+
+	filters = clean_vehicle_filters(request.GET)
+	if estimate_row_count(export_queryset(filters), STREAM_EXPORT_MAX_ROWS) > STREAM_EXPORT_MAX_ROWS:
+		response = _enqueue_vehicle_export(request, fmt, columns, filters)
+		response.status_code = 202
+		return response
+
+	# daphne 下使用 async iterator，避免 Django 先把同步 iterator 整個讀進記憶體
+	stream = aiter_stream_chunks if isinstance(request, ASGIRequest) else iter_stream_chunks
+	response = StreamingHttpResponse(
+		stream(fmt, columns, filters),
+		content_type=STREAM_CONTENT_TYPES[fmt],
+	)
+	response["Content-Disposition"] = f'attachment; filename="vehicle_export{EXPORT_FORMATS[fmt]}"'
+	response["X-Accel-Buffering"] = "no"
+	return response
+
+
+def _enqueue_vehicle_export(request: HttpRequest, fmt: str, columns: list[str], filters: dict) -> JsonResponse:
+	"""排程背景匯出；相同條件已有結果或執行中時直接重用。"""
 	from .tasks import export_vehicles_to_csv
 
-	task = export_vehicles_to_csv.delay(user_id=request.user.id)
+	digest = export_fingerprint(fmt, columns, filters)
+
+	# 資料未變動且已有相同條件的匯出檔：直接回傳，不再排程
+	cached_export = get_cached_export(digest)
+	if cached_export:
+		return JsonResponse({
+			"success": True,
+			"task_id": cached_export.get("task_id"),
+			"cached": True,
+			"result": export_file_url(cached_export["path"]),
+			"message": "資料未變動，直接提供先前的匯出結果。",
+		})
+
+	# 相同條件的任務正在執行中：共用同一個 task id
+	task_id = str(uuid.uuid4())
+	running_task_id = claim_export(digest, task_id)
+	if running_task_id:
+		# 登記為共用者，進度與完成事件也會推播到此使用者的 WebSocket
+		add_task_subscriber(running_task_id, request.user.id)
+		return JsonResponse({
+			"success": True,
+			"task_id": running_task_id,
+			"cached": False,
+			"message": "相同條件的匯出任務正在處理中，請稍後查詢結果。",
+		})
+
+	try:
+		export_vehicles_to_csv.apply_async(
+			kwargs={
+				"user_id": request.user.id,
+				"fmt": fmt,
+				"columns": columns,
+				"filters": filters,
+				"digest": digest,
+			},
+			task_id=task_id,
+		)
+	except Exception:
+		# 排程失敗（例如 broker 無法連線）：釋放冪等鍵，否則相同條件的匯出會一直被回報為處理中直到逾時
+		release_export(digest)
+		logger.exception("匯出任務排程失敗")
+		return JsonResponse({"success": False, "message": "匯出任務暫時無法排程，請稍後再試。"}, status=503)
 	return JsonResponse({
 		"success": True,
-		"task_id": task.id,
+		"task_id": task_id,
+		"cached": False,
 		"message": "匯出任務已排入背景處理，請稍後查詢結果。",
 	})
 
 
 @staff_member_required
-def export_task_status(request: HttpRequest, task_id: str) -> JsonResponse:  # noqa: ARG001
+@require_POST
+def export_catalog_sharded(request: HttpRequest) -> JsonResponse:
+	"""
+	觸發分片平行匯出：車款目錄 + 貼文 + 評分，輸出為 zip。
+	- Method: POST
+	- URL: /api/export/catalog/
+	- 僅限管理員使用
+	- Params: shards（每個資料集的分片數，1~32，預設 4）
+	- Response: {"success": bool, "task_id": str, "message": str}
+	  task_id 為最終合併任務，可直接用於 /api/export/status/<task_id>/ 或 WebSocket 事件
+	"""
+	from .tasks import export_catalog_sharded as export_catalog_sharded_task
+
+	try:
+		shards = min(max(int(request.POST.get("shards", 4)), 1), 32)
+	except ValueError:
+		return JsonResponse({"success": False, "message": "shards 必須為整數"}, status=400)
+
+	merge_task_id = str(uuid.uuid4())
+	try:
+		export_catalog_sharded_task.delay(user_id=request.user.id, shards=shards, merge_task_id=merge_task_id)
+	except Exception:
+		# 排程失敗（例如 broker 無法連線）：與 _enqueue_vehicle_export 相同回傳 503，而不是 500
+		logger.exception("分片匯出任務排程失敗")
+		return JsonResponse({"success": False, "message": "匯出任務暫時無法排程，請稍後再試。"}, status=503)
+	return JsonResponse({
+		"success": True,
+		"task_id": merge_task_id,
+		"message": "分片匯出任務已排入背景處理，請稍後查詢結果。",
+	})
+
+
+@staff_member_required
+async def export_task_status(request: HttpRequest, task_id: str) -> JsonResponse:  # noqa: ARG001
 	"""
 	查詢 Celery 任務狀態。
 	- Method: GET
 	- URL: /api/export/status/<task_id>/
-	- Response: {"task_id": str, "status": str, "result": str|null}
+	- Response: {"task_id": str, "status": str, "result": str|null, "stats": dict|null}
+	- 前端優先透過 WebSocket（/ws/motry/tasks/）接收完成事件，此端點為備援
+	- Celery result backend 只有同步 API，查詢本身合併成一次執行緒切換
 	"""
+	return JsonResponse(await sync_to_async(_export_task_status_payload)(task_id))
+
+
+def _export_task_status_payload(task_id: str) -> dict:
+	bump_counter(TASK_STATUS_POLLS)
 	result = AsyncResult(task_id)
 	response_data = {
 		"task_id": task_id,
 		"status": result.status,
 		"result": None,
+		"stats": None,
 	}
 
+	if result.status == "PROGRESS" and isinstance(result.info, dict):
+		response_data["stats"] = result.info
+
 	if result.successful():
-		file_path = result.result
-		# 轉換為相對於 MEDIA_URL 的路徑
-		from django.conf import settings
-		import os
-		if file_path and file_path.startswith(str(settings.MEDIA_ROOT)):
-			relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
-			response_data["result"] = f"{settings.MEDIA_URL}{relative_path}"
+		task_result = result.result
+		if isinstance(task_result, dict):
+			response_data["result"] = export_file_url(task_result.get("path"))
+			response_data["stats"] = {k: v for k, v in task_result.items() if k != "path"}
 		else:
-			response_data["result"] = file_path
+			response_data["result"] = export_file_url(task_result)
 	elif result.failed():
 		response_data["result"] = str(result.result)
 
-	return JsonResponse(response_data)
+	return response_data
+
+
+@staff_member_required
+def cache_stats(request: HttpRequest) -> JsonResponse:  # noqa: ARG001
+	"""
+	本行程兩層快取（L1 行程內 / L2 Redis）的命中統計。
+	- Method: GET
+	- URL: /api/cache/stats/
+	- 計數為單一 worker 行程自啟動以來的累計值
+	"""
+	return JsonResponse({"pid": os.getpid(), "caches": two_tier_stats()})
+
+
+@staff_member_required
+def notification_metrics(request: HttpRequest) -> JsonResponse:  # noqa: ARG001
+	"""
+	本行程通知 WebSocket 連線的待送佇列統計（深度、合併、丟棄）。
+	- Method: GET
+	- URL: /api/notifications/metrics/
+	- 只在 daphne（ASGI）行程中有連線資料
+	"""
+	return JsonResponse({"pid": os.getpid(), **notification_connection_metrics()})
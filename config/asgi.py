@@ -1,11 +1,11 @@
+import asyncio
 import os
+import sys
 
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
-from apps.motry import routing as motry_routing
-
 # 允許環境自行設定 DJANGO_SETTINGS_MODULE，預設為開發設定
 os.environ.setdefault(
 	"DJANGO_SETTINGS_MODULE",
@@ -14,6 +14,26 @@ os.environ.setdefault(
 
 django_asgi_app = get_asgi_application()
 
+# consumers 會匯入 models，需在 Django 初始化（get_asgi_application）之後才能匯入
+from apps.motry import routing as motry_routing  # noqa: E402
+from apps.motry.caching import aclose_async_redis  # noqa: E402
+
+
+def _close_async_redis_on_shutdown():
+	"""daphne 不支援 ASGI lifespan：在 Twisted reactor 關閉前釋放 async view 使用的 redis.asyncio 連線。"""
+	if "twisted.internet.reactor" not in sys.modules:
+		return
+	from twisted.internet import defer, reactor
+
+	reactor.addSystemEventTrigger(
+		"before",
+		"shutdown",
+		lambda: defer.Deferred.fromFuture(asyncio.ensure_future(aclose_async_redis())),
+	)
+
+
+_close_async_redis_on_shutdown()
+
 application = ProtocolTypeRouter(
 	{
 		"http": django_asgi_app,
@@ -42,7 +42,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # ← 加在這裡 (SecurityMiddleware 之後)
+    'apps.core.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise + async 路徑 (SecurityMiddleware 之後)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +66,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 "apps.motry.context_processors.vehicle_brand_map",
+                "apps.motry.context_processors.notification_badge",
             ],
         },
     }
@@ -271,6 +272,36 @@ CELERY_BEAT_SCHEDULE = {
         "task": "apps.motry.tasks.refresh_brand_cache",
         "schedule": 60 * 5,  # 每 5 分鐘執行一次
     },
+    # 每天清理超過保留期限（30 天）的車輛刪除紀錄
+    "purge-vehicle-tombstones-daily": {
+        "task": "apps.motry.tasks.purge_vehicle_tombstones",
+        "schedule": 60 * 60 * 24,
+    },
+    # 每 15 分鐘以 DB 校正通知未讀數計數器
+    "reconcile-unread-counters": {
+        "task": "apps.motry.tasks.reconcile_unread_counters",
+        "schedule": 60 * 15,
+    },
+    # 每小時把熱門趨勢分數換算回目前時間（避免衰減倍率持續放大）並修剪冷門車款 / 標籤
+    "renormalize-trending-scores": {
+        "task": "apps.motry.tasks.renormalize_trending_scores",
+        "schedule": 60 * 60,
+    },
+    # 每天全量重算規格相似車款（車款變更時另有增量更新）
+    "rebuild-vehicle-neighbors-daily": {
+        "task": "apps.motry.tasks.refresh_vehicle_neighbors",
+        "schedule": 60 * 60 * 24,
+    },
+    # 每 6 小時以收藏 / 車庫 / 評分重算協同過濾推薦
+    "rebuild-recommendations": {
+        "task": "apps.motry.tasks.rebuild_recommendations",
+        "schedule": 60 * 60 * 6,
+    },
+    # 每分鐘重算即將過期的首頁區塊（熱門標籤 / 車友車庫 / 本週熱門 / 隨機推薦）
+    "refresh-home-document": {
+        "task": "apps.core.tasks.refresh_home_document",
+        "schedule": 60,
+    },
     # 每週同步機車資料（週日凌晨 4 點）
     "sync-motorcycles-weekly": {
         "task": "apps.motry.tasks.sync_motorcycles_task",